@@ -0,0 +1,132 @@
+"""
+Compare scheduling the copies of a mixed-size batch of files in one queue to separate lanes
+for small files and for the parts of large files.
+
+Uploads are simulated, so nothing is sent to S3:
+
+- a small file takes one request of `--latency-ms`, bound by the request rate;
+- a large file takes one request to start it, then parts of 8 MiB, which share a link
+  of `--bandwidth-mbps`, so parts running at the same time take longer.
+
+- fifo: one lane, tasks start in the order they were submitted, like `ThreadPoolExecutor`.
+- lanes: `copy_file_list()`, with small files and parts of large files in separate lanes.
+
+Usage:
+
+    python benchmarks/copy_lanes.py [--small N] [--large N] [--large-size-mb MB] [--latency-ms MS]
+                                    [--bandwidth-mbps MBPS] [--concurrency N]
+"""
+
+import argparse
+import os
+import threading
+import time
+from unittest import mock
+
+MB = 1024 * 1024
+
+
+class Link:
+    """Link of a fixed bandwidth, which sends data in the order it was given."""
+
+    def __init__(self, bandwidth):
+        self._bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._free_at = 0
+
+    def send(self, size):
+        with self._lock:
+            start = max(time.perf_counter(), self._free_at)
+            self._free_at = start + size / self._bandwidth
+            done_at = self._free_at
+        time.sleep(max(0, done_at - time.perf_counter()))
+
+
+def fake_upload(link, latency, part_size, finished):
+    from quilt3.util import PhysicalKey
+
+    def upload(ctx, size, src_path, dest_bucket, dest_key):
+        time.sleep(latency)
+        if size < part_size:
+            ctx.progress(size)
+            finished[src_path] = time.perf_counter()
+            ctx.done(PhysicalKey(dest_bucket, dest_key, None), None)
+            return
+
+        parts = -(-size // part_size)
+        remaining = [parts]
+        lock = threading.Lock()
+
+        def upload_part(start, end):
+            time.sleep(latency)
+            link.send(end - start)
+            ctx.progress(end - start)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                finished[src_path] = time.perf_counter()
+                ctx.done(PhysicalKey(dest_bucket, dest_key, None), None)
+
+        for start in range(0, size, part_size):
+            ctx.run(upload_part, start, min(start + part_size, size))
+
+    return upload
+
+
+def run(mode, file_list, args):
+    from quilt3 import data_transfer
+
+    part_size = data_transfer.s3_transfer_config.multipart_chunksize
+    link = Link(args.bandwidth_mbps * MB)
+    finished = {}
+    upload = fake_upload(link, args.latency_ms / 1000, part_size, finished)
+    lanes = {'fifo': (0, 0), 'lanes': (data_transfer._SMALL_OBJECTS_LANE, data_transfer._LARGE_OBJECTS_LANE)}[mode]
+
+    with (
+        mock.patch.object(data_transfer, '_upload_or_reuse_file', upload),
+        mock.patch.object(data_transfer, 'MAX_CONCURRENCY', args.concurrency),
+        mock.patch.object(data_transfer, 'MAX_ADAPTIVE_CONCURRENCY', args.concurrency),
+        mock.patch.object(data_transfer, '_SMALL_OBJECTS_LANE', lanes[0]),
+        mock.patch.object(data_transfer, '_LARGE_OBJECTS_LANE', lanes[1]),
+    ):
+        t0 = time.perf_counter()
+        data_transfer.copy_file_list(file_list)
+        elapsed = time.perf_counter() - t0
+
+    small = [finished[src.path] - t0 for src, _, size in file_list if size < part_size]
+    large = [finished[src.path] - t0 for src, _, size in file_list if size >= part_size]
+    print(
+        f'{mode:>5}: {elapsed:.2f}s total, small files done at {max(small, default=0):.2f}s, '
+        f'large files done at {max(large, default=0):.2f}s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--small', type=int, default=5_000)
+    parser.add_argument('--large', type=int, default=4)
+    parser.add_argument('--large-size-mb', type=int, default=400)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--bandwidth-mbps', type=float, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault('QUILT_MINIMIZE_STDOUT', 'true')
+    from quilt3.util import PhysicalKey
+
+    # Large files come last, so with one queue their parts only start once all small files are done.
+    file_list = [
+        (PhysicalKey.from_path(f'/small/{i}'), PhysicalKey('bucket', f'small/{i}', None), 1024)
+        for i in range(args.small)
+    ] + [
+        (PhysicalKey.from_path(f'/large/{i}'), PhysicalKey('bucket', f'large/{i}', None), args.large_size_mb * MB)
+        for i in range(args.large)
+    ]
+
+    for mode in ('fifo', 'lanes'):
+        run(mode, file_list, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Compare writing the parts of a multipart download to the way it was done before.
+
+- reopen: every part opens the file again, seeks, and writes a new `bytes` object
+  per `io_chunksize` through buffered I/O, into a file that isn't preallocated.
+- pwrite: `_download_file()`, which preallocates the file, and writes every part through one file
+  descriptor with `os.pwrite()` from buffers reused by each thread.
+
+Responses are served from memory, so this measures the local side of a download only.
+
+Usage:
+
+    python benchmarks/download_pwrite.py [--size-mb MB] [--concurrency N] [--dir PATH]
+"""
+
+import argparse
+import math
+import os
+import pathlib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+
+
+class FakeBody:
+    def __init__(self, data, size):
+        self._data = memoryview(data)
+        self._remaining = size
+
+    def read(self, amt):
+        amt = min(amt, self._remaining, len(self._data))
+        self._remaining -= amt
+        return bytes(self._data[:amt])
+
+    def readinto(self, buf):
+        amt = min(len(buf), self._remaining, len(self._data))
+        buf[:amt] = self._data[:amt]
+        self._remaining -= amt
+        return amt
+
+
+class FakeS3Client:
+    def __init__(self, size):
+        self._size = size
+        self._data = os.urandom(MB)
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is None:
+            return {'Body': FakeBody(self._data, self._size)}
+        start, end = map(int, Range[len('bytes=') :].split('-'))
+        return {'Body': FakeBody(self._data, end - start + 1)}
+
+
+class FakeClientProvider:
+    def __init__(self, client):
+        self._client = client
+
+    def find_correct_client(self, api_type, bucket, param_dict):
+        return self._client
+
+
+def download_file_reopen(ctx, size, src_bucket, src_key, src_version, dest_path):
+    from quilt3.data_transfer import s3_transfer_config
+
+    s3_client = ctx.s3_client_provider.find_correct_client(None, src_bucket, {})
+    dest_file = pathlib.Path(dest_path)
+    dest_file.open('wb').close()
+    part_size = s3_transfer_config.multipart_chunksize
+
+    def download_part(part_number):
+        with dest_file.open('r+b') as chunk_f:
+            start = part_number * part_size
+            end = min(start + part_size, size) - 1
+            chunk_f.seek(start)
+            body = s3_client.get_object(Bucket=src_bucket, Key=src_key, Range=f'bytes={start}-{end}')['Body']
+            while True:
+                chunk = body.read(s3_transfer_config.io_chunksize)
+                if not chunk:
+                    break
+                ctx.progress(chunk_f.write(chunk))
+
+    for part_number in range(math.ceil(size / part_size)):
+        ctx.run(download_part, part_number)
+
+
+def run(mode, path, size, concurrency):
+    from quilt3 import data_transfer
+
+    download = {'reopen': download_file_reopen, 'pwrite': data_transfer._download_file}[mode]
+    futures = []
+    with ThreadPoolExecutor(concurrency) as executor:
+        ctx = data_transfer.WorkerContext(
+            s3_client_provider=FakeClientProvider(FakeS3Client(size)),
+            progress=lambda num_bytes: None,
+            done=lambda physical_key, checksum: None,
+            run=lambda func, *args: futures.append(executor.submit(func, *args)),
+        )
+        t0 = time.perf_counter()
+        download(ctx, size, 'bucket', 'key', None, path)
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - t0
+    assert os.path.getsize(path) == size
+    print(f'{mode:>6}: {size / MB:.0f} MiB in {elapsed:.2f}s ({size / MB / elapsed:.0f} MiB/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=4096)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--dir', help="directory to download to instead of a temporary one")
+    args = parser.parse_args()
+
+    os.environ.setdefault('QUILT_MINIMIZE_STDOUT', 'true')
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        path = os.path.join(tmp_dir, 'object')
+        for mode in ('reopen', 'pwrite'):
+            run(mode, path, args.size_mb * MB, args.concurrency)
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare loading a browsed manifest from JSONL with loading it from the Arrow cache.
+
+- jsonl: what `Package.browse()` does for manifests below `MANIFEST_ARROW_CACHE_MIN_SIZE`.
+- cold-cache: parses JSONL into a compact package and saves the Arrow cache.
+- warm-cache: memory-maps the Arrow cache saved by cold-cache.
+
+Each step also computes the top hash, so the time to decode entries is included.
+Steps run in fresh subprocesses, so peak RSS numbers are not polluted by the other ones.
+
+Usage:
+
+    python benchmarks/manifest_cache.py [--entries N] [--manifest PATH]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from manifest_load import generate_manifest
+
+
+def load_jsonl(path, cache_path):
+    from quilt3.packages import Package
+
+    return Package._from_path(path)
+
+
+def load_cached(path, cache_path):
+    from quilt3.packages import Package
+
+    return Package._from_cached_table(path, cache_path, path)
+
+
+STEPS = {
+    'jsonl': load_jsonl,
+    'cold-cache': load_cached,
+    'warm-cache': load_cached,
+}
+
+
+def run_child(step, path, cache_path):
+    t0 = time.perf_counter()
+    pkg = STEPS[step](path, cache_path)
+    loaded = time.perf_counter()
+    pkg.top_hash  # pylint: disable=pointless-statement
+    elapsed = time.perf_counter()
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'load': loaded - t0, 'total': elapsed - t0, 'maxrss_kib': maxrss}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=500_000)
+    parser.add_argument('--manifest', help="existing manifest to load instead of a generated one")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=STEPS, help=argparse.SUPPRESS)
+    parser.add_argument('--cache', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.manifest, args.cache)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.manifest
+        if path is None:
+            path = os.path.join(tmp_dir, 'manifest.jsonl')
+            generate_manifest(path, args.entries)
+        cache_path = os.path.join(tmp_dir, 'manifest.arrow')
+        print(f'manifest: {path} ({os.path.getsize(path) / 2**20:.1f} MiB)')
+
+        env = dict(os.environ, QUILT_MINIMIZE_STDOUT='true')
+        for step in STEPS:
+            results = []
+            for _ in range(args.repeat):
+                if step == 'cold-cache' and os.path.exists(cache_path):
+                    os.unlink(cache_path)
+                out = subprocess.run(
+                    [sys.executable, __file__, '--child', step, '--manifest', path, '--cache', cache_path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    env=env,
+                ).stdout
+                results.append(json.loads(out.splitlines()[-1]))
+            load = min(r['load'] for r in results)
+            total = min(r['total'] for r in results)
+            rss = max(r['maxrss_kib'] for r in results)
+            print(
+                f'{step:>10}: best of {args.repeat}: load {load:.2f}s, load + top hash {total:.2f}s, '
+                f'peak RSS {rss / 1024:.0f} MiB'
+            )
+        print(f'cache: {os.path.getsize(cache_path) / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Compare the single-pass manifest loader with the previous two-pass one.
+
+The previous loader counted lines to size the progress bar, seeked back and parsed the file again.
+Each loader runs in a fresh subprocess, so peak RSS numbers are not polluted by the other one.
+
+Usage:
+
+    python benchmarks/manifest_load.py [--entries N] [--manifest PATH]
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def generate_manifest(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'version': 'v0', 'message': 'benchmark', 'user_meta': {}}) + '\n')
+        for i in range(entries):
+            lk = f'dir{i % 100}/sub{i % 1000}/file{i}.bin'
+            f.write(
+                json.dumps(
+                    {
+                        'logical_key': lk,
+                        'physical_keys': [f's3://benchmark-bucket/{lk}?versionId=v{i}'],
+                        'size': i,
+                        'hash': {'type': 'sha2-256-chunked', 'value': f'{i:064x}'},
+                        'meta': {'user_meta': {'index': i}} if i % 10 == 0 else {},
+                    }
+                )
+                + '\n'
+            )
+
+
+def load_two_pass(path):
+    import jsonlines
+    from tqdm import tqdm
+
+    from quilt3.packages import DISABLE_TQDM, ManifestJSONDecoder, Package, PackageEntry, PhysicalKey
+
+    gc.disable()
+    try:
+        with open(path, encoding='utf-8') as readable_file:
+            line_count = 0
+            for _ in readable_file:
+                line_count += 1
+            readable_file.seek(0)
+
+            reader = jsonlines.Reader(
+                tqdm(readable_file, total=line_count, disable=DISABLE_TQDM),
+                loads=ManifestJSONDecoder().decode,
+            )
+            meta = reader.read()
+            pkg = Package()
+            pkg._meta = meta
+            for obj in reader:
+                path = Package._split_key(obj.pop('logical_key'))
+                subpkg = pkg._ensure_subpackage(path[:-1])
+                if not obj.get('physical_keys', None):
+                    subpkg.set_meta(obj['meta'])
+                    continue
+                subpkg._children[path[-1]] = PackageEntry(
+                    PhysicalKey.from_url(obj['physical_keys'][0]),
+                    obj['size'],
+                    obj['hash'],
+                    obj['meta'],
+                )
+    finally:
+        gc.enable()
+    return pkg
+
+
+def load_single_pass(path):
+    from quilt3.packages import Package
+
+    return Package._from_path(path)
+
+
+LOADERS = {
+    'two-pass': load_two_pass,
+    'single-pass': load_single_pass,
+}
+
+
+def run_child(loader, path):
+    t0 = time.perf_counter()
+    LOADERS[loader](path)
+    elapsed = time.perf_counter() - t0
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'elapsed': elapsed, 'maxrss_kib': maxrss}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=500_000)
+    parser.add_argument('--manifest', help="existing manifest to load instead of a generated one")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=LOADERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.manifest)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.manifest
+        if path is None:
+            path = os.path.join(tmp_dir, 'manifest.jsonl')
+            generate_manifest(path, args.entries)
+        print(f'manifest: {path} ({os.path.getsize(path) / 2**20:.1f} MiB)')
+
+        env = dict(os.environ, QUILT_MINIMIZE_STDOUT='true')
+        for loader in LOADERS:
+            results = []
+            for _ in range(args.repeat):
+                out = subprocess.run(
+                    [sys.executable, __file__, '--child', loader, '--manifest', path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    env=env,
+                ).stdout
+                results.append(json.loads(out.splitlines()[-1]))
+            best = min(r['elapsed'] for r in results)
+            rss = max(r['maxrss_kib'] for r in results)
+            print(f'{loader:>12}: best of {args.repeat}: {best:.2f}s, peak RSS {rss / 1024:.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare adding a large local directory with `Package.set_dir()` to the way it was done before.
+
+- rglob: `Path.rglob('*')`, then `is_file()`, `stat()` and `PhysicalKey.from_path()`
+  of every path, and `Package.set()` of every file, in a single thread.
+- scandir: `Package.set_dir()`, which lists directories with `os.scandir()` in a pool of threads
+  and adds files a directory at a time.
+
+`--latency-ms` adds a delay to every directory listing and every `stat()`/`lstat()` call
+to simulate a network filesystem.
+
+Usage:
+
+    python benchmarks/set_dir_scan.py [--files N] [--files-per-dir N] [--latency-ms MS] [--dir PATH]
+"""
+
+import argparse
+import contextlib
+import os
+import pathlib
+import tempfile
+import time
+from unittest import mock
+
+
+def generate_tree(root, files, files_per_dir):
+    """Creates `files` empty files in a two-level tree of directories."""
+    dirs_per_level = max(1, round((files / files_per_dir) ** 0.5))
+    created = 0
+    for i in range(dirs_per_level):
+        for j in range(dirs_per_level):
+            if created >= files:
+                return
+            path = os.path.join(root, f'dir{i:04}', f'sub{j:04}')
+            os.makedirs(path)
+            for k in range(min(files_per_dir, files - created)):
+                with open(os.path.join(path, f'file{k:06}.bin'), 'wb'):
+                    pass
+            created += min(files_per_dir, files - created)
+    while created < files:
+        with open(os.path.join(root, f'extra{created:09}.bin'), 'wb'):
+            pass
+        created += 1
+
+
+def set_dir_rglob(pkg, path):
+    from quilt3.packages import PackageEntry
+    from quilt3.util import PhysicalKey
+
+    src_path = pathlib.Path(path).resolve()
+    for f in src_path.rglob('*'):
+        if not f.is_file():
+            continue
+        logical_key = f.relative_to(src_path).as_posix()
+        pkg._set(logical_key, PackageEntry(PhysicalKey.from_path(f), f.stat().st_size, None, None))
+
+
+class SlowDirEntry:
+    def __init__(self, entry, delay):
+        self._entry = entry
+        self._delay = delay
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self, *, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def stat(self, *, follow_symlinks=True):
+        time.sleep(self._delay)
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+@contextlib.contextmanager
+def slow_filesystem(delay):
+    if not delay:
+        yield
+        return
+    scandir, stat, lstat = os.scandir, os.stat, os.lstat
+
+    @contextlib.contextmanager
+    def slow_scandir(path='.'):
+        time.sleep(delay)
+        with scandir(path) as it:
+            yield (SlowDirEntry(entry, delay) for entry in it)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(delay)
+        return stat(*args, **kwargs)
+
+    def slow_lstat(*args, **kwargs):
+        time.sleep(delay)
+        return lstat(*args, **kwargs)
+
+    with (
+        mock.patch('os.scandir', slow_scandir),
+        mock.patch('os.stat', slow_stat),
+        mock.patch('os.lstat', slow_lstat),
+    ):
+        yield
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1_000_000)
+    parser.add_argument('--files-per-dir', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--dir', help="existing directory to add instead of a generated one")
+    args = parser.parse_args()
+
+    os.environ.setdefault('QUILT_MINIMIZE_STDOUT', 'true')
+    from quilt3.packages import Package
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.dir
+        if path is None:
+            path = os.path.join(tmp_dir, 'tree')
+            t0 = time.perf_counter()
+            generate_tree(path, args.files, args.files_per_dir)
+            print(f'generated {args.files} files in {time.perf_counter() - t0:.1f}s')
+
+        results = {}
+        for mode in ('rglob', 'scandir'):
+            pkg = Package()
+            with slow_filesystem(args.latency_ms / 1000):
+                t0 = time.perf_counter()
+                if mode == 'rglob':
+                    set_dir_rglob(pkg, path)
+                else:
+                    pkg.set_dir('/', path)
+                elapsed = time.perf_counter() - t0
+            results[mode] = sorted((lk, entry.physical_key.path, entry.size) for lk, entry in pkg.walk())
+            print(f'{mode:>7}: {len(results[mode])} files in {elapsed:.2f}s')
+        assert results['rglob'] == results['scandir']
+
+
+if __name__ == '__main__':
+    main()
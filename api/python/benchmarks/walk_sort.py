@@ -0,0 +1,145 @@
+"""
+Count directory sorts and tree traversals done by `Package.push()`.
+
+- cached: the sorted view of each directory is kept between traversals and the entries
+  of the pushed package are walked once to select files to copy and find temporary files.
+- uncached: every traversal sorts every directory again and each consumer walks the tree
+  on its own, the way it was done before.
+
+Copying objects and uploading the manifest are replaced with no-ops, and workflow validation
+is skipped, so only the work done in memory is measured.
+
+Usage:
+
+    python benchmarks/walk_sort.py [--entries N] [--manifest PATH]
+"""
+
+import argparse
+import contextlib
+import functools
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from manifest_load import generate_manifest
+
+TRAVERSALS = ('walk', '_walk', '_walk_rows', '_walk_dir_meta', '_iter_top_hash_parts', '_get_top_hash_segments')
+
+
+class Counter:
+    def __init__(self):
+        self.sorts = 0
+        self.sort_time = 0
+        self.traversals = 0
+
+    def sorted(self, iterable, **kwargs):
+        self.sorts += 1
+        t0 = time.perf_counter()
+        try:
+            return sorted(iterable, **kwargs)
+        finally:
+            self.sort_time += time.perf_counter() - t0
+
+    def count_traversal(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Recursive calls for subdirectories are part of the traversal that made them.
+            if sys._getframe(1).f_code.co_name not in TRAVERSALS:
+                self.traversals += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+
+def copy_file_list(file_list, message=None, callback=None):
+    from quilt3.util import PhysicalKey
+
+    return [(PhysicalKey(dest.bucket, dest.path, 'v1'), None) for _, dest, _ in file_list]
+
+
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+
+def push_manifest(self, name, registry, top_hash):
+    self._dump(NullWriter())
+
+
+@contextlib.contextmanager
+def uncached(counter):
+    from quilt3.packages import Package
+
+    def sorted_items(self):
+        return counter.sorted(self._children.items())
+
+    def walk_into(self, *visitors):
+        for visitor in visitors:
+            for logical_key, entry in self.walk():
+                visitor(logical_key, entry)
+
+    with (
+        mock.patch.object(Package, '_sorted_items', sorted_items),
+        mock.patch.object(Package, '_walk_into', walk_into),
+    ):
+        yield
+
+
+def run(pkg, mode):
+    import quilt3.packages
+    from quilt3.packages import Package
+
+    counter = Counter()
+    patches = [
+        mock.patch.object(quilt3.packages, 'sorted', counter.sorted, create=True),
+        mock.patch.object(quilt3.packages.workflows, 'validate', lambda **kwargs: None),
+        mock.patch.object(Package, '_push_manifest', push_manifest),
+        *(mock.patch.object(Package, name, counter.count_traversal(getattr(Package, name))) for name in TRAVERSALS),
+    ]
+    with contextlib.ExitStack() as stack:
+        if mode == 'uncached':
+            stack.enter_context(uncached(counter))
+        for patch in patches:
+            stack.enter_context(patch)
+        t0 = time.perf_counter()
+        pkg._push(
+            'benchmark/pkg',
+            's3://registry-bucket',
+            workflow=None,
+            print_info=False,
+            force=True,
+            dedupe=False,
+            copy_file_list_fn=copy_file_list,
+        )
+        elapsed = time.perf_counter() - t0
+    print(
+        f'{mode:>9}: {counter.sorts} sorts ({counter.sort_time:.2f}s), {counter.traversals} traversals, '
+        f'push {elapsed:.2f}s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--manifest', help="existing manifest to push instead of a generated one")
+    args = parser.parse_args()
+
+    os.environ.setdefault('QUILT_MINIMIZE_STDOUT', 'true')
+    from quilt3.packages import Package
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.manifest
+        if path is None:
+            path = os.path.join(tmp_dir, 'manifest.jsonl')
+            generate_manifest(path, args.entries)
+        for mode in ('uncached', 'cached'):
+            # A fresh package each time, so the sorted views of the previous run aren't reused.
+            with open(path, encoding='utf-8') as f:
+                pkg = Package.load(f)
+            run(pkg, mode)
+
+
+if __name__ == '__main__':
+    main()
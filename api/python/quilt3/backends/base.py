@@ -1,12 +1,16 @@
 import abc
+import io
 import operator
 import time
+from collections.abc import Callable
+from typing import BinaryIO
 
 from quilt3.data_transfer import (
     copy_file,
     delete_url,
     get_bytes,
     list_url,
+    open_writer,
     put_bytes,
 )
 from quilt3.util import PhysicalKey, QuiltException
@@ -90,6 +94,17 @@ class PackageRegistry(abc.ABC):
     def push_manifest(self, pkg_name: str, top_hash: str, manifest_data: bytes):
         pass
 
+    def push_manifest_stream(self, pkg_name: str, top_hash: str, write_manifest: Callable[[BinaryIO], None]):
+        """
+        Same as `push_manifest()`, but the manifest is written by `write_manifest(writable_file)`.
+
+        Registries that can upload the manifest while it's being written, without keeping all of it
+        in memory, override this; by default the manifest is buffered and passed to `push_manifest()`.
+        """
+        buf = io.BytesIO()
+        write_manifest(buf)
+        return self.push_manifest(pkg_name, top_hash, buf.getvalue())
+
     @abc.abstractmethod
     def resolve_top_hash(self, pkg_name: str, hash_prefix: str) -> str:
         pass
@@ -136,8 +151,12 @@ class PackageRegistryV1(PackageRegistry):
         return self.root.join(f'packages/{top_hash}')
 
     def push_manifest(self, pkg_name: str, top_hash: str, manifest_data: bytes):
+        return self.push_manifest_stream(pkg_name, top_hash, lambda f: f.write(manifest_data))
+
+    def push_manifest_stream(self, pkg_name: str, top_hash: str, write_manifest: Callable[[BinaryIO], None]):
         """returns: timestamp to support catalog drag-and-drop => browse"""
-        put_bytes(manifest_data, self.manifest_pk(pkg_name, top_hash))
+        with open_writer(self.manifest_pk(pkg_name, top_hash)) as manifest_file:
+            write_manifest(manifest_file)
         hash_bytes = top_hash.encode()
         # TODO: use a float to string formatter instead of double casting
         timestamp_str = str(int(time.time()))
@@ -252,14 +271,16 @@ class PackageRegistryV2(PackageRegistry):
         for dt, top_hash in self.list_package_versions_with_timestamps(pkg_name):
             yield str(int(dt.timestamp())), top_hash
 
-    def push_manifest(self, pkg_name: str, top_hash: str, manifest_data: bytes):
-        put_bytes(manifest_data, self.manifest_pk(pkg_name, top_hash))
+    def push_manifest_stream(self, pkg_name: str, top_hash: str, write_manifest: Callable[[BinaryIO], None]):
+        with open_writer(self.manifest_pk(pkg_name, top_hash)) as manifest_file:
+            write_manifest(manifest_file)
         put_bytes(top_hash.encode(), self.pointer_latest_pk(pkg_name))
 
     @staticmethod
     def _top_hash_from_path(path: str) -> str:
         return path.rsplit('/', 2)[-2]
 
+    push_manifest = PackageRegistryV1.push_manifest
     resolve_top_hash = PackageRegistryV1.resolve_top_hash
     resolve_top_hash_requires_pkg_name = True
     shorten_top_hash = PackageRegistryV1.shorten_top_hash
@@ -142,12 +142,14 @@ class Bucket:
         for result in results:
             delete_object(self._pk.bucket, result['Key'])
 
-    def ls(self, path=None, recursive=False):
+    def ls(self, path=None, recursive=False, *, parallel=False):
         """List data from the specified path.
 
         Parameters:
             path (str): bucket path to list
             recursive (bool): show subdirectories and their contents as well
+            parallel (bool): with `recursive`, list subdirectories concurrently,
+                in a pool of `QUILT_TRANSFER_MAX_CONCURRENCY` threads
 
         Returns:
             `list`: Return value structure has not yet been permanently decided
@@ -159,7 +161,7 @@ class Bucket:
         elif not path:
             path = ""  # enumerate top-of-bucket
 
-        results = list_object_versions(self._pk.bucket, path, recursive=recursive)
+        results = list_object_versions(self._pk.bucket, path, recursive=recursive, parallel=parallel)
         return results
 
     def fetch(self, key, path):
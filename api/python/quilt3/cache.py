@@ -0,0 +1,153 @@
+"""
+SQLite database of the local caches, safe to use from several threads and processes.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import pathlib
+import sqlite3
+import threading
+
+# SQLite versions before 3.32 limit a statement to 999 parameters.
+MAX_PARAMS = 900
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS object_path (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS checksum (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    hash_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (dev, ino, hash_type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS content (
+    hash_type TEXT NOT NULL,
+    hash_value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    last_access INTEGER NOT NULL,
+    PRIMARY KEY (hash_type, hash_value)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS content_last_access ON content (last_access);
+
+CREATE TABLE IF NOT EXISTS bucket (
+    name TEXT NOT NULL,
+    fact TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires INTEGER NOT NULL,
+    PRIMARY KEY (name, fact)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS migration (
+    name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Errors of an unusable cache, e.g. on a read-only filesystem or locked by another process for too long.
+# Caches are optional, so callers treat them as a miss or skip the write.
+ERRORS = (OSError, sqlite3.Error)
+
+_lock = threading.Lock()
+_databases: dict[tuple[int, pathlib.Path], Database] = {}
+
+
+def db_path(cache_path: pathlib.Path) -> pathlib.Path:
+    return cache_path / 'cache.db'
+
+
+class Database:
+    """
+    Connection of this process to a cache database, shared by threads.
+
+    Statements of different threads are serialized, but only while each statement
+    or write transaction runs.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are explicit, and other processes holding the write lock are waited for.
+        conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        try:
+            # WAL lets readers proceed while another process writes.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+        except BaseException:
+            conn.close()
+            raise
+        self.path = path
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def query(self, sql: str, params=()) -> list:
+        """Runs a read-only statement and returns its rows."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs a write transaction, which takes the database lock up front to avoid deadlocks between processes.
+
+        Yields the underlying connection; other threads wait until the transaction is done.
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def connection(cache_path: pathlib.Path) -> Database:
+    """
+    Returns the connection of this process to the cache database in `cache_path`, creating it if needed.
+
+    If the database was removed, e.g. by `ObjectPathCache.clear()`, a new one is created.
+    Raises one of `ERRORS` if the database can't be used.
+    """
+    path = db_path(cache_path)
+    key = (os.getpid(), path)
+    with _lock:
+        db = _databases.get(key)
+        if db is not None and not path.exists():
+            db.close()
+            db = None
+        if db is None:
+            db = _databases[key] = Database(path)
+        return db
+
+
+def close(cache_path: pathlib.Path):
+    """Closes the connection of this process to the cache database in `cache_path`, if any."""
+    with _lock:
+        db = _databases.pop((os.getpid(), db_path(cache_path)), None)
+    if db is not None:
+        db.close()
+
+
+def chunked(items: list, size: int = MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
 import concurrent
+import contextlib
+import errno
 import functools
 import hashlib
+import io
 import itertools
 import logging
 import math
+import operator
 import os
 import pathlib
 import queue
 import shutil
 import stat
 import threading
+import time
 import types
+import uuid
 import warnings
 from codecs import iterdecode
 from collections import defaultdict, deque
@@ -30,6 +36,7 @@ from botocore.client import Config
 from botocore.exceptions import (
     ClientError,
     ConnectionError,
+    ConnectTimeoutError,
     HTTPClientError,
     ReadTimeoutError,
 )
@@ -43,13 +50,20 @@ from tenacity import (
 )
 from tqdm import tqdm
 
-from . import checksums, hooks, util
-from .session import get_boto3_session
-from .util import DISABLE_TQDM, PhysicalKey, QuiltException
+from . import cache, checksums, hooks, util
+from .session import get_boto3_session, get_boto3_session_key
+from .util import CACHE_PATH, DISABLE_TQDM, PhysicalKey, QuiltException
 
 MAX_COPY_FILE_LIST_RETRIES = 3
 MAX_FIX_HASH_RETRIES = 3
-MAX_CONCURRENCY = util.get_pos_int_from_env('QUILT_TRANSFER_MAX_CONCURRENCY') or 10
+_MAX_CONCURRENCY_FROM_ENV = util.get_pos_int_from_env('QUILT_TRANSFER_MAX_CONCURRENCY')
+MAX_CONCURRENCY = _MAX_CONCURRENCY_FROM_ENV or 10
+# Upper bound of the concurrency of `copy_file_list()`, which starts with `MAX_CONCURRENCY`, see `AdaptiveExecutor`.
+# An explicitly set `QUILT_TRANSFER_MAX_CONCURRENCY` stays the cap unless this one is set too.
+MAX_ADAPTIVE_CONCURRENCY = util.get_pos_int_from_env('QUILT_TRANSFER_MAX_ADAPTIVE_CONCURRENCY') or (
+    MAX_CONCURRENCY if _MAX_CONCURRENCY_FROM_ENV else 64
+)
+BUCKET_CACHE_TTL = util.get_pos_int_from_env('QUILT_BUCKET_CACHE_TTL') or 24 * 60 * 60
 
 
 logger = logging.getLogger(__name__)
@@ -69,6 +83,139 @@ class S3NoValidClientError(Exception):
         self.message = message
 
 
+class BucketCache:
+    """
+    Facts about S3 buckets learned from requests, e.g. their regions, so that other processes
+    don't have to learn them again. Facts expire after `BUCKET_CACHE_TTL` seconds.
+
+    Requests don't fail if the cache can't be used: that's a miss, and facts are just not saved.
+    """
+
+    @staticmethod
+    def get(bucket: str, fact: str) -> str | None:
+        if not util.IS_CACHE_ENABLED:
+            return None
+        try:
+            rows = cache.connection(CACHE_PATH).query(
+                'SELECT value FROM bucket WHERE name = ? AND fact = ? AND expires > ?',
+                (bucket, fact, int(time.time())),
+            )
+        except cache.ERRORS as e:
+            logger.debug("Failed to read bucket cache: %s", e)
+            return None
+        return rows[0][0] if rows else None
+
+    @staticmethod
+    def set(bucket: str, fact: str, value: str):
+        if not util.IS_CACHE_ENABLED:
+            return
+        try:
+            with cache.connection(CACHE_PATH).transaction() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO bucket VALUES (?, ?, ?, ?)',
+                    (bucket, fact, value, int(time.time()) + BUCKET_CACHE_TTL),
+                )
+        except cache.ERRORS as e:
+            logger.debug("Failed to write bucket cache: %s", e)
+
+
+# bucket -> region, or None if it's not known to differ from the region of clients.
+_bucket_regions: dict[str, str | None] = {}
+
+
+def _get_bucket_region(bucket: str) -> str | None:
+    if bucket not in _bucket_regions:
+        _bucket_regions[bucket] = BucketCache.get(bucket, 'region')
+    return _bucket_regions[bucket]
+
+
+def _register_bucket_region_handlers(s3_client):
+    """
+    Sends requests to the known regions of buckets, instead of sending them to the region of
+    `s3_client` and following the redirect, and remembers the regions that botocore redirects to.
+    """
+    client_region = s3_client.meta.region_name
+
+    def use_known_region(builtins, params, **kwargs):
+        bucket = params.get('Bucket')
+        # The region was changed by the botocore redirector if the known one turned out to be wrong.
+        if bucket is None or builtins.get('AWS::Region') != client_region:
+            return
+        region = _get_bucket_region(bucket)
+        if region is not None:
+            builtins['AWS::Region'] = region
+
+    def remember_region(context, **kwargs):
+        redirect_ctx = context.get('s3_redirect', {})
+        bucket = redirect_ctx.get('bucket')
+        if bucket is None or not redirect_ctx.get('redirected'):
+            return
+        region = context.get('signing', {}).get('region')
+        if region is not None and _bucket_regions.get(bucket) != region:
+            _bucket_regions[bucket] = region
+            BucketCache.set(bucket, 'region', region)
+
+    s3_client.meta.events.register('before-endpoint-resolution.s3', use_known_region)
+    s3_client.meta.events.register('after-call.s3', remember_region)
+
+
+# S3 error codes that mean requests should be sent at a lower rate.
+THROTTLING_ERROR_CODES = frozenset(
+    (
+        'SlowDown',
+        'ServiceUnavailable',
+        'RequestTimeout',
+        'Throttling',
+        'ThrottlingException',
+        'RequestLimitExceeded',
+        '503',
+    )
+)
+THROTTLING_EXCEPTIONS = (ReadTimeoutError, ConnectTimeoutError)
+
+# `AdaptiveExecutor` running a task in the current thread, if any.
+_current_task = threading.local()
+
+
+def _register_throttling_handler(s3_client):
+    """Makes `AdaptiveExecutor` back off when requests of its tasks are throttled, even if they're retried."""
+
+    def on_retry(response, caught_exception, **kwargs):
+        executor = getattr(_current_task, 'executor', None)
+        if executor is None:
+            return
+        if caught_exception is not None:
+            throttled = isinstance(caught_exception, THROTTLING_EXCEPTIONS)
+        else:
+            http_response, parsed = response
+            throttled = (
+                http_response.status_code == 503 or parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+            )
+        if throttled:
+            executor.backoff()
+
+    s3_client.meta.events.register('needs-retry.s3', on_retry)
+
+
+class _S3Clients:
+    """Clients built by `S3ClientProvider` and the client type that works for each bucket+api_call."""
+
+    def __init__(self, identity=None):
+        self.lock = Lock()
+        self.use_unsigned_client = {}  # f'{action}/{bucket}' -> use_unsigned_client_bool
+        self.standard_client = None
+        self.unsigned_client = None
+        # Hash of `get_boto3_session_key()`, i.e. of the access key and region of the session, if client types
+        # are kept in `BucketCache`: a client type that works with some credentials is only reused with them.
+        self.identity = identity
+
+
+# Clients shared by providers in this process, see `S3ClientProvider._get_shared_clients()`.
+MAX_SHARED_S3_CLIENTS = 16
+_shared_s3_clients: dict[tuple, _S3Clients] = {}
+_shared_s3_clients_lock = Lock()
+
+
 class S3ClientProvider:
     """
     An s3_client is either signed with standard credentials or unsigned. This class exists to dynamically provide the
@@ -76,6 +223,11 @@ class S3ClientProvider:
     can't read from the bucket, check if the bucket is public in which case we should be using an unsigned client.
     This check is expensive at scale so the class also keeps track of which client to use for each bucket+api_call.
 
+    Clients and client types are shared by all providers in the process while the credentials and region
+    of `get_boto3_session()` stay the same, so they are only built and checked once. A subclass or a patch that
+    overrides `get_boto_session()` gets clients of its own. Client types, and regions of buckets, are also kept in
+    `BucketCache`, so other processes don't check them again.
+
     If there are no credentials available at all (i.e. you don't have AWS credentials and you don't have a
     Quilt-provided role from quilt3.login()), the standard client will also be unsigned so that users can still
     access public s3 buckets.
@@ -84,21 +236,42 @@ class S3ClientProvider:
     """
 
     def __init__(self):
-        self._use_unsigned_client = {}  # f'{action}/{bucket}' -> use_unsigned_client_bool
-        self._standard_client = None
-        self._unsigned_client = None
+        self._clients = self._get_shared_clients()
+
+    def _get_shared_clients(self):
+        cls = type(self)
+        if cls.get_boto_session is not cls._default_get_boto_session:
+            return _S3Clients()
+        key = (
+            os.getpid(),  # Clients can't be used after a fork.
+            cls,
+            cls._build_client,
+            hooks.get_build_s3_client_hook(),
+            MAX_CONCURRENCY,
+            MAX_ADAPTIVE_CONCURRENCY,
+            get_boto3_session_key(),
+        )
+        with _shared_s3_clients_lock:
+            clients = _shared_s3_clients.get(key)
+            if clients is None:
+                if len(_shared_s3_clients) >= MAX_SHARED_S3_CLIENTS:
+                    # Drop the oldest, probably built with credentials that were refreshed since.
+                    del _shared_s3_clients[next(iter(_shared_s3_clients))]
+                identity = hashlib.sha256(repr(key[-1]).encode()).hexdigest()
+                clients = _shared_s3_clients[key] = _S3Clients(identity)
+        return clients
 
     @property
     def standard_client(self):
-        if self._standard_client is None:
+        if self._clients.standard_client is None:
             self._build_standard_client()
-        return self._standard_client
+        return self._clients.standard_client
 
     @property
     def unsigned_client(self):
-        if self._unsigned_client is None:
+        if self._clients.unsigned_client is None:
             self._build_unsigned_client()
-        return self._unsigned_client
+        return self._clients.unsigned_client
 
     def get_correct_client(self, action: S3Api, bucket: str):
         if not self.client_type_known(action, bucket):
@@ -116,11 +289,19 @@ class S3ClientProvider:
         return f"{action}/{bucket}"
 
     def set_cache(self, action: S3Api, bucket: str, use_unsigned: bool):
-        self._use_unsigned_client[self.key(action, bucket)] = use_unsigned
+        self._clients.use_unsigned_client[self.key(action, bucket)] = use_unsigned
+        if self._clients.identity is not None:
+            BucketCache.set(bucket, f'{self._clients.identity}/{action}', 'unsigned' if use_unsigned else 'standard')
 
     def should_use_unsigned_client(self, action: S3Api, bucket: str):
         # True if should use unsigned, False if should use standard, None if don't know yet
-        return self._use_unsigned_client.get(self.key(action, bucket))
+        key = self.key(action, bucket)
+        use_unsigned = self._clients.use_unsigned_client.get(key)
+        if use_unsigned is None and self._clients.identity is not None:
+            client_type = BucketCache.get(bucket, f'{self._clients.identity}/{action}')
+            if client_type is not None:
+                use_unsigned = self._clients.use_unsigned_client[key] = client_type == 'unsigned'
+        return use_unsigned
 
     def client_type_known(self, action: S3Api, bucket: str):
         return self.should_use_unsigned_client(action, bucket) is not None
@@ -154,6 +335,8 @@ class S3ClientProvider:
     def get_boto_session(self):
         return get_boto3_session()
 
+    _default_get_boto_session = get_boto_session
+
     @staticmethod
     def _build_client_base(session, client_kwargs):
         return session.client('s3', **client_kwargs)
@@ -161,7 +344,8 @@ class S3ClientProvider:
     def _build_client(self, is_unsigned):
         session = self.get_boto_session()
         conf_kwargs = {
-            "max_pool_connections": MAX_CONCURRENCY,
+            # Shared clients are also used by threads outside of transfers, e.g. by get_bytes().
+            "max_pool_connections": max(MAX_CONCURRENCY, MAX_ADAPTIVE_CONCURRENCY) + 10,
         }
         if is_unsigned(session):
             conf_kwargs["signature_version"] = UNSIGNED
@@ -169,19 +353,24 @@ class S3ClientProvider:
             "config": Config(**conf_kwargs),
         }
         hook = hooks.get_build_s3_client_hook()
-        return (
+        s3_client = (
             self._build_client_base(session, client_kwargs)
             if hook is None
             else hook(self._build_client_base, session, client_kwargs)
         )
+        _register_bucket_region_handlers(s3_client)
+        _register_throttling_handler(s3_client)
+        return s3_client
 
     def _build_standard_client(self):
-        s3_client = self._build_client(lambda session: session.get_credentials() is None)
-        self._standard_client = s3_client
+        with self._clients.lock:
+            if self._clients.standard_client is None:
+                self._clients.standard_client = self._build_client(lambda session: session.get_credentials() is None)
 
     def _build_unsigned_client(self):
-        s3_client = self._build_client(lambda session: True)
-        self._unsigned_client = s3_client
+        with self._clients.lock:
+            if self._clients.unsigned_client is None:
+                self._clients.unsigned_client = self._build_client(lambda session: True)
 
 
 def check_list_object_versions_works_for_client(s3_client, params):
@@ -245,7 +434,7 @@ class WorkerContext:
     s3_client_provider: S3ClientProvider
     progress: Callable[[int], None]
     done: Callable[[PhysicalKey, str | None], None]
-    run: Callable[..., None]
+    run: Callable[..., Future]
 
 
 def _copy_local_file(ctx: WorkerContext, size: int, src_path: str, dest_path: str):
@@ -327,6 +516,38 @@ def _upload_file(ctx: WorkerContext, size: int, src_path: str, dest_bucket: str,
             ctx.run(upload_part, i, start, end)
 
 
+# Buffers that download workers read response bodies into, reused by all parts a thread downloads.
+_download_buffers = threading.local()
+
+
+def _get_download_buffer() -> memoryview:
+    buf = getattr(_download_buffers, 'buf', None)
+    if buf is None or len(buf) != s3_transfer_config.io_chunksize:
+        buf = _download_buffers.buf = memoryview(bytearray(s3_transfer_config.io_chunksize))
+    return buf
+
+
+def _readinto(body, buf: memoryview) -> int:
+    readinto = getattr(body, 'readinto', None)
+    if readinto is not None:
+        return readinto(buf)
+    chunk = body.read(len(buf))
+    buf[: len(chunk)] = chunk
+    return len(chunk)
+
+
+def _preallocate(fileno: int, size: int):
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fileno, 0, size)
+            return
+        except OSError as ex:
+            # Not supported by the filesystem.
+            if ex.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    os.ftruncate(fileno, size)
+
+
 def _download_file(
     ctx: WorkerContext,
     size: int,
@@ -344,58 +565,95 @@ def _download_file(
 
     dest_file.parent.mkdir(parents=True, exist_ok=True)
 
-    with dest_file.open('wb') as f:
-        fileno = f.fileno()
-        is_regular_file = stat.S_ISREG(os.stat(fileno).st_mode)
-
-        # TODO: To enable this we need to fix some tests in test_packages,
-        #       that setup mocked responses to return less data than expected/specified in the manifest.
-        # if is_regular_file:
-        #     # Preallocate file.
-        #     if hasattr(os, 'posix_fallocate'):
-        #         os.posix_fallocate(fileno, 0, size)
-        #     else:
-        #         f.truncate(size)
-
     if src_version is not None:
         params.update(VersionId=src_version)
 
-    # Note: we are not calculating checksums when downloading,
-    # so we're free to use S3 defaults (or anything else) here.
-    part_size = s3_transfer_config.multipart_chunksize
-    is_multi_part = is_regular_file and size >= s3_transfer_config.multipart_threshold and size > part_size
+    # All parts are written through this file, which is closed once all of them have finished, failed
+    # or been cancelled.
+    f = dest_file.open('wb', buffering=0)
+    try:
+        fileno = f.fileno()
+        is_regular_file = stat.S_ISREG(os.fstat(fileno).st_mode)
+
+        # Note: we are not calculating checksums when downloading,
+        # so we're free to use S3 defaults (or anything else) here.
+        part_size = s3_transfer_config.multipart_chunksize
+        is_multi_part = is_regular_file and size >= s3_transfer_config.multipart_threshold and size > part_size
+        if is_multi_part:
+            # Only ranges of the expected size are requested, so the file can't end up larger than `size`.
+            _preallocate(fileno, size)
+    except BaseException:
+        f.close()
+        raise
+
     part_numbers = range(math.ceil(size / part_size)) if is_multi_part else (None,)
     remaining_counter = len(part_numbers)
     remaining_counter_lock = Lock()
+    failed = False
+    use_pwrite = is_regular_file and hasattr(os, 'pwrite')
+    write_lock = Lock()
+
+    def write(data, offset):
+        if use_pwrite:
+            return os.pwrite(f.fileno(), data, offset)
+        with write_lock:
+            if is_multi_part:
+                f.seek(offset)
+            return f.write(data)
+
+    def finish_part(ok: bool) -> bool:
+        """
+        Closes the file after the last part, and returns whether the download is complete.
+        """
+        nonlocal remaining_counter, failed
+        with remaining_counter_lock:
+            remaining_counter -= 1
+            failed = failed or not ok
+            if remaining_counter:
+                return False
+        try:
+            if failed and is_regular_file:
+                # Don't leave a preallocated file of the expected size that looks like a complete download.
+                os.ftruncate(fileno, 0)
+        finally:
+            f.close()
+        return not failed
 
     def download_part(part_number):
-        nonlocal remaining_counter
-
-        with dest_file.open('r+b') as chunk_f:
-            if part_number is not None:
-                start = part_number * part_size
-                end = min(start + part_size, size) - 1
-                part_params = dict(params, Range=f'bytes={start}-{end}')
-                chunk_f.seek(start)
-            else:
-                part_params = params
+        if part_number is not None:
+            offset = part_number * part_size
+            end = min(offset + part_size, size) - 1
+            part_params = dict(params, Range=f'bytes={offset}-{end}')
+        else:
+            offset = 0
+            part_params = params
 
+        ok = False
+        try:
             resp = s3_client.get_object(**part_params)
             body = resp['Body']
+            buf = _get_download_buffer()
             while True:
-                chunk = body.read(s3_transfer_config.io_chunksize)
-                if not chunk:
+                num_read = _readinto(body, buf)
+                if not num_read:
                     break
-                ctx.progress(chunk_f.write(chunk))
-
-        with remaining_counter_lock:
-            remaining_counter -= 1
-            done = remaining_counter == 0
-        if done:
+                written = 0
+                while written < num_read:
+                    written += write(buf[written:num_read], offset + written)
+                offset += num_read
+                ctx.progress(num_read)
+            ok = True
+        finally:
+            complete = finish_part(ok)
+        if complete:
             ctx.done(PhysicalKey.from_path(dest_path), None)
 
+    def part_cancelled(future):
+        if future.cancelled():
+            finish_part(False)
+
     for part_number in part_numbers:
-        ctx.run(download_part, part_number)
+        ctx.run(download_part, part_number).add_done_callback(part_cancelled)
 
 
 def _copy_remote_file(
@@ -500,6 +758,95 @@ class FileChecksumTask:
         return cls(physical_key, size, checksums.MultiPartChecksumCalculator.get_calculator_cls(hash_type))
 
 
+class ChecksumCache:
+    """
+    Checksums of local files, so unchanged files aren't hashed again.
+
+    Like `ObjectPathCache`, a checksum is only used while the device, inode, size
+    and modification time of the file are unchanged.
+    """
+
+    # Files modified this recently aren't cached: another write within the resolution
+    # of the filesystem's timestamps could leave the modification time unchanged.
+    RACY_MTIME_NS = 2_000_000_000
+
+    @staticmethod
+    def _file_version(stat_result: os.stat_result) -> tuple[int, int, int, int]:
+        return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+    @classmethod
+    def get(cls, stat_result: os.stat_result, hash_type: str) -> str | None:
+        if not util.IS_CACHE_ENABLED:
+            return None
+        try:
+            rows = cache.connection(CACHE_PATH).query(
+                'SELECT size, mtime_ns, checksum FROM checksum WHERE dev = ? AND ino = ? AND hash_type = ?',
+                (stat_result.st_dev, stat_result.st_ino, hash_type),
+            )
+        except cache.ERRORS as e:
+            logger.debug("Failed to read checksum cache: %s", e)
+            return None
+
+        for size, mtime_ns, checksum in rows:
+            if (size, mtime_ns) == (stat_result.st_size, stat_result.st_mtime_ns):
+                return checksum
+        return None
+
+    @classmethod
+    def set(cls, path: str, stat_result: os.stat_result, hash_type: str, checksum: str):
+        """
+        Caches `checksum` of the file at `path` calculated after it was stat-ed as `stat_result`,
+        unless the file was changed since then.
+        """
+        if not util.IS_CACHE_ENABLED:
+            return
+        try:
+            if (
+                cls._file_version(os.stat(path)) != cls._file_version(stat_result)
+                or time.time_ns() - stat_result.st_mtime_ns < cls.RACY_MTIME_NS
+            ):
+                return
+        except OSError:
+            return
+        try:
+            with cache.connection(CACHE_PATH).transaction() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO checksum VALUES (?, ?, ?, ?, ?, ?)',
+                    (
+                        stat_result.st_dev,
+                        stat_result.st_ino,
+                        hash_type,
+                        stat_result.st_size,
+                        stat_result.st_mtime_ns,
+                        checksum,
+                    ),
+                )
+        except cache.ERRORS as e:
+            logger.debug("Failed to write checksum cache: %s", e)
+
+
+def _stat_local_file(path: str, size: int) -> os.stat_result | None:
+    """Returns `os.stat()` of `path` if it's a file of `size` bytes, `None` otherwise."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(stat_result.st_mode) or stat_result.st_size != size:
+        return None
+    return stat_result
+
+
+def _cached_local_checksum(path: str, size: int, hash_type: str, calculate: Callable[[], str]) -> str:
+    stat_result = _stat_local_file(path, size)
+    if stat_result is None:
+        return calculate()
+    checksum = ChecksumCache.get(stat_result, hash_type)
+    if checksum is None:
+        checksum = calculate()
+        ChecksumCache.set(path, stat_result, hash_type, checksum)
+    return checksum
+
+
 def _calculate_local_checksum(
     path: str,
     size: int,
@@ -523,46 +870,68 @@ def _calculate_local_checksum(
     return checksum_calculator_cls.combine_parts(checksum_parts)
 
 
-def _reuse_remote_file(ctx: WorkerContext, size: int, src_path: str, dest_bucket: str, dest_path: str):
-    # Optimization: check if the remote file already exists and has the right ETag,
-    # and skip the upload.
-    if size < UPLOAD_ETAG_OPTIMIZATION_THRESHOLD:
-        return None
+def _calculate_local_sha256_chunked(path: str, size: int) -> str:
+    return _cached_local_checksum(
+        path,
+        size,
+        checksums.SHA256_CHUNKED_HASH_NAME,
+        lambda: _calculate_local_checksum(
+            path, size, checksum_calculator_cls=checksums.SHA256MultiPartChecksumCalculator
+        ),
+    )
+
+
+def _head_object_with_checksum(ctx: WorkerContext, bucket: str, key: str, version_id: str | None = None):
+    """Returns `head_object()` of the given object with its checksum, or `None` if it can't be read."""
+    params = dict(Bucket=bucket, Key=key)
+    if version_id is not None:
+        params.update(VersionId=version_id)
     try:
-        params = dict(Bucket=dest_bucket, Key=dest_path)
-        s3_client = ctx.s3_client_provider.find_correct_client(S3Api.HEAD_OBJECT, dest_bucket, params)
-        resp = s3_client.head_object(**params, ChecksumMode="ENABLED")
+        s3_client = ctx.s3_client_provider.find_correct_client(S3Api.HEAD_OBJECT, bucket, params)
+        return s3_client.head_object(**params, ChecksumMode="ENABLED")
     except ClientError:
-        # Destination doesn't exist, so fall through to the normal upload.
-        pass
+        # The object doesn't exist or isn't readable.
+        return None
     except S3NoValidClientError:
         # S3ClientProvider can't currently distinguish between a user that has PUT but not LIST permissions and a
-        # user that has no permissions. If we can't find a valid client, proceed to the upload stage anyway.
-        pass
+        # user that has no permissions.
+        return None
+
+
+def _s3_to_quilt_checksum(s3_checksum: str, size: int) -> str | None:
+    """
+    Converts `ChecksumSHA256` of an S3 object of `size` bytes to a `sha2-256-chunked` checksum,
+    or returns `None` if the object wasn't uploaded in the parts that checksum expects.
+    """
+    if "-" in s3_checksum:
+        checksum, num_parts_str = s3_checksum.split("-", 1)
+        num_parts = int(num_parts_str)
     else:
-        dest_size = resp["ContentLength"]
-        if dest_size != size:
-            return None
-        # TODO: we could check hashes of parts, to finish faster
-        s3_checksum = resp.get("ChecksumSHA256")
-        if s3_checksum is not None:
-            if "-" in s3_checksum:
-                checksum, num_parts_str = s3_checksum.split("-", 1)
-                num_parts = int(num_parts_str)
-            else:
-                checksum = checksums._simple_s3_to_quilt_checksum(s3_checksum)
-                num_parts = None
-            expected_num_parts = (
-                math.ceil(size / checksums.get_checksum_chunksize(size)) if checksums.is_mpu(size) else None
-            )
-            if num_parts == expected_num_parts and checksum == _calculate_local_checksum(
-                src_path, size, checksum_calculator_cls=checksums.SHA256MultiPartChecksumCalculator
-            ):
-                return resp.get("VersionId"), checksum
-        elif resp.get("ServerSideEncryption") != "aws:kms" and resp["ETag"] == _calculate_etag(src_path):
-            return resp.get("VersionId"), _calculate_local_checksum(
-                src_path, size, checksum_calculator_cls=checksums.SHA256MultiPartChecksumCalculator
-            )
+        checksum = checksums._simple_s3_to_quilt_checksum(s3_checksum)
+        num_parts = None
+    expected_num_parts = math.ceil(size / checksums.get_checksum_chunksize(size)) if checksums.is_mpu(size) else None
+    return checksum if num_parts == expected_num_parts else None
+
+
+def _reuse_remote_file(ctx: WorkerContext, size: int, src_path: str, dest_bucket: str, dest_path: str):
+    # Optimization: check if the remote file already exists and has the right ETag,
+    # and skip the upload.
+    if size < UPLOAD_ETAG_OPTIMIZATION_THRESHOLD:
+        return None
+    # If the destination doesn't exist, or we can't find a valid client, fall through to the normal upload.
+    resp = _head_object_with_checksum(ctx, dest_bucket, dest_path)
+    if resp is None or resp["ContentLength"] != size:
+        return None
+    # TODO: we could check hashes of parts, to finish faster
+    s3_checksum = resp.get("ChecksumSHA256")
+    if s3_checksum is not None:
+        checksum = _s3_to_quilt_checksum(s3_checksum, size)
+        if checksum is not None and checksum == _calculate_local_sha256_chunked(src_path, size):
+            return resp.get("VersionId"), checksum
+    elif resp.get("ServerSideEncryption") != "aws:kms" and resp["ETag"] == _cached_local_checksum(
+        src_path, size, 'ETag', lambda: _calculate_etag(src_path)
+    ):
+        return resp.get("VersionId"), _calculate_local_sha256_chunked(src_path, size)
 
     return None
 
@@ -578,6 +947,212 @@ def _upload_or_reuse_file(ctx: WorkerContext, size: int, src_path: str, dest_buc
     _upload_file(ctx, size, src_path, dest_bucket, dest_path)
 
 
+def _reuse_remote_copy(ctx: WorkerContext, size: int, src_checksum: str, dest_bucket: str, dest_key: str):
+    # Optimization: check if the destination already exists with the known checksum of the source,
+    # e.g. when a package is pushed to a bucket again, and skip the copy.
+    if size < UPLOAD_ETAG_OPTIMIZATION_THRESHOLD:
+        return None
+    resp = _head_object_with_checksum(ctx, dest_bucket, dest_key)
+    if resp is None or resp["ContentLength"] != size or resp.get("ChecksumSHA256") is None:
+        return None
+    if _s3_to_quilt_checksum(resp["ChecksumSHA256"], size) != src_checksum:
+        return None
+    return resp.get("VersionId"), src_checksum
+
+
+def _copy_or_reuse_remote_file(
+    ctx: WorkerContext,
+    size: int,
+    src_bucket: str,
+    src_key: str,
+    src_version: str | None,
+    dest_bucket: str,
+    dest_key: str,
+    src_checksum: str | None = None,
+):
+    result = None
+    if src_checksum is not None:
+        result = _reuse_remote_copy(ctx, size, src_checksum, dest_bucket, dest_key)
+    if result is not None:
+        dest_version_id, checksum = result
+        ctx.progress(size)
+        ctx.done(PhysicalKey(dest_bucket, dest_key, dest_version_id), checksum)
+        return  # Optimization succeeded.
+    _copy_remote_file(ctx, size, src_bucket, src_key, src_version, dest_bucket, dest_key)
+
+
+class AdaptiveExecutor:
+    """
+    Runs tasks in threads, like `ThreadPoolExecutor`, but adapts how many of them run at a time.
+
+    Tasks are submitted to one of `lanes` queues. A free thread takes the next task of the lane with the fewest
+    running tasks, or, on a tie, the task that was submitted first, so tasks of one lane can't starve the others,
+    while a lane can use all threads the others don't need. With one lane or one thread, tasks start in the order
+    they were submitted. Concurrency starts at `concurrency` and is adjusted
+    in windows of `WINDOW` seconds, AIMD-style: while tasks are waiting for a thread and the throughput
+    reported with `add_progress()` keeps improving, it grows by about 1/8, up to `max_concurrency`;
+    when requests are throttled or time out, it's halved, at most once per window. `on_change` is called
+    with the new concurrency from the thread that changed it, but not while holding the lock of the executor.
+    """
+
+    WINDOW = 1.0
+    # Throughput must improve by this factor for concurrency to grow again.
+    MIN_IMPROVEMENT = 1.05
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_concurrency: int,
+        on_change: Callable[[int], None] | None = None,
+        *,
+        lanes: int = 1,
+    ):
+        self.concurrency = concurrency
+        self._max_concurrency = max(concurrency, max_concurrency)
+        self._on_change = on_change
+        self._reported_concurrency = concurrency
+        self._report_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._queues: list[deque[tuple[int, Future, Callable, tuple]]] = [deque() for _ in range(lanes)]
+        self._queued = 0
+        self._submitted = 0
+        self._threads: list[threading.Thread] = []
+        self._running = 0
+        self._lane_running = [0] * lanes
+        self._shutdown = False
+        self._last_throughput = None
+        self._last_backoff = -math.inf
+        self._start_window()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        return False
+
+    def submit(self, fn, *args, lane: int = 0) -> Future:
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self._queues[lane].append((self._submitted, future, fn, args))
+            self._submitted += 1
+            self._queued += 1
+            self._start_threads()
+            self._cond.notify()
+        return future
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def add_progress(self, num_bytes: int):
+        with self._cond:
+            self._window_bytes += num_bytes
+
+    def backoff(self):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_backoff < self.WINDOW:
+                return
+            self._last_backoff = now
+            self._set_concurrency(max(1, self.concurrency // 2))
+            self._last_throughput = None
+            self._start_window()
+        self._report_concurrency()
+
+    def _start_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._saturated = False
+
+    def _start_threads(self):
+        while len(self._threads) < self.concurrency and self._queued > len(self._threads) - self._running:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _set_concurrency(self, concurrency):
+        if concurrency == self.concurrency:
+            return
+        logger.debug('copy files: concurrency %d -> %d', self.concurrency, concurrency)
+        self.concurrency = concurrency
+        self._start_threads()
+        self._cond.notify_all()
+
+    def _report_concurrency(self):
+        if self._on_change is None:
+            return
+        # Changes made by other threads in the meantime are reported once, with the latest value.
+        with self._report_lock:
+            concurrency = self.concurrency
+            if concurrency != self._reported_concurrency:
+                self._reported_concurrency = concurrency
+                self._on_change(concurrency)
+
+    def _end_window(self):
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.WINDOW:
+            return
+        throughput = self._window_bytes / elapsed
+        if self._saturated and (
+            self._last_throughput is None or throughput > self._last_throughput * self.MIN_IMPROVEMENT
+        ):
+            self._set_concurrency(min(self._max_concurrency, self.concurrency + max(1, self.concurrency // 8)))
+        self._last_throughput = throughput
+        self._start_window()
+
+    def _next_lane(self) -> int:
+        return min(
+            (lane for lane, queue in enumerate(self._queues) if queue),
+            key=lambda lane: (self._lane_running[lane], self._queues[lane][0][0]),
+        )
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queued or self._running >= self.concurrency:
+                    if self._shutdown and not self._queued:
+                        return
+                    self._cond.wait()
+                lane = self._next_lane()
+                _, future, fn, args = self._queues[lane].popleft()
+                self._queued -= 1
+                self._running += 1
+                self._lane_running[lane] += 1
+                if self._queued and self._running >= self.concurrency:
+                    self._saturated = True
+
+            if future.set_running_or_notify_cancel():
+                _current_task.executor = self
+                try:
+                    result = fn(*args)
+                except BaseException as ex:
+                    if isinstance(ex, THROTTLING_EXCEPTIONS) or (
+                        isinstance(ex, ClientError)
+                        and ex.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+                    ):
+                        self.backoff()
+                    future.set_exception(ex)
+                else:
+                    future.set_result(result)
+                finally:
+                    _current_task.executor = None
+
+            with self._cond:
+                self._running -= 1
+                self._lane_running[lane] -= 1
+                self._end_window()
+                self._cond.notify()
+            self._report_concurrency()
+
+
 def _copy_file_list_last_retry(retry_state):
     return retry_state.fn(
         *retry_state.args,
@@ -585,16 +1160,25 @@ def _copy_file_list_last_retry(retry_state):
     )
 
 
+# Lanes of `AdaptiveExecutor` in `copy_file_list()`: copies of small objects are bound by the request rate,
+# and parts of large objects by bandwidth, so one kind doesn't wait behind thousands of the other.
+_SMALL_OBJECTS_LANE = 0
+_LARGE_OBJECTS_LANE = 1
+
+
 @retry(
     stop=stop_after_attempt(MAX_COPY_FILE_LIST_RETRIES - 1),
     wait=wait_exponential(multiplier=1, min=1, max=10),
     retry=retry_if_not_result(all),
     retry_error_callback=_copy_file_list_last_retry,
 )
-def _copy_file_list_internal(file_list, results, message, callback, exceptions_to_ignore=(ClientError,)):
+def _copy_file_list_internal(
+    file_list, results, message, callback, exceptions_to_ignore=(ClientError,), src_checksums=None
+):
     """
     Takes a list of tuples (src, dest, size) and copies the data in parallel.
     `results` is the list where results will be stored.
+    `src_checksums` are the known checksums of sources, see `copy_file_list()`.
     Returns versioned URLs for S3 destinations and regular file URLs for files.
     """
     if not file_list:
@@ -615,9 +1199,13 @@ def _copy_file_list_internal(file_list, results, message, callback, exceptions_t
 
     s3_client_provider = S3ClientProvider()  # Share provider across threads to reduce redundant public bucket checks
 
+    def show_concurrency(concurrency):
+        with lock:
+            progress.set_postfix(concurrency=concurrency)
+
     with (
         tqdm(desc=message, total=total_size, unit='B', unit_scale=True, disable=DISABLE_TQDM) as progress,
-        ThreadPoolExecutor(MAX_CONCURRENCY) as executor,
+        AdaptiveExecutor(MAX_CONCURRENCY, MAX_ADAPTIVE_CONCURRENCY, on_change=show_concurrency, lanes=2) as executor,
     ):
 
         def progress_callback(bytes_transferred):
@@ -625,13 +1213,15 @@ def _copy_file_list_internal(file_list, results, message, callback, exceptions_t
                 raise Exception("Interrupted")
             with lock:
                 progress.update(bytes_transferred)
+            executor.add_progress(bytes_transferred)
 
-        def run_task(idx, func, *args):
-            future = executor.submit(func, *args)
+        def run_task(idx, func, *args, lane):
+            future = executor.submit(func, *args, lane=lane)
             with lock:
                 futures.append(future)
                 future_to_idx[future] = idx
                 idx_to_futures[idx].append(future)
+            return future
 
         def worker(idx, src, dest, size):
             if stopped:
@@ -649,7 +1239,7 @@ def _copy_file_list_internal(file_list, results, message, callback, exceptions_t
                 s3_client_provider=s3_client_provider,
                 progress=progress_callback,
                 done=done_callback,
-                run=functools.partial(run_task, idx),
+                run=functools.partial(run_task, idx, lane=_LARGE_OBJECTS_LANE),
             )
 
             if dest.version_id:
@@ -666,15 +1256,26 @@ def _copy_file_list_internal(file_list, results, message, callback, exceptions_t
                 if dest.is_local():
                     _download_file(ctx, size, src.bucket, src.path, src.version_id, dest.path)
                 else:
-                    _copy_remote_file(ctx, size, src.bucket, src.path, src.version_id, dest.bucket, dest.path)
+                    _copy_or_reuse_remote_file(
+                        ctx,
+                        size,
+                        src.bucket,
+                        src.path,
+                        src.version_id,
+                        dest.bucket,
+                        dest.path,
+                        None if src_checksums is None else src_checksums[idx],
+                    )
 
         try:
             for idx, (args, result) in enumerate(zip(file_list, results, strict=True)):
                 if result is not None:
                     continue
-                run_task(idx, worker, idx, *args)
+                size = args[2]
+                lane = _LARGE_OBJECTS_LANE if size >= s3_transfer_config.multipart_threshold else _SMALL_OBJECTS_LANE
+                run_task(idx, worker, idx, *args, lane=lane)
 
-            # ThreadPoolExecutor does not appear to have a way to just wait for everything to complete.
+            # The executor does not have a way to just wait for everything to complete.
             # Shutting it down will cause it to wait - but will prevent any new tasks from starting.
             # So, manually wait for all tasks to complete.
             # This will also raise any exception that happened in a worker thread.
@@ -733,18 +1334,111 @@ def delete_object(bucket, key):
     s3_client.delete_object(Bucket=bucket, Key=key)  # Actually delete it
 
 
-def list_object_versions(bucket, prefix, recursive=True):
+_LIST_METHODS = {
+    S3Api.LIST_OBJECTS_V2: 'list_objects_v2',
+    S3Api.LIST_OBJECT_VERSIONS: 'list_object_versions',
+}
+
+
+def _next_page_params(api: S3Api, response: dict) -> dict | None:
+    """Returns pagination parameters of the page after `response`, or `None` if it's the last one."""
+    if not response.get('IsTruncated'):
+        return None
+    if api == S3Api.LIST_OBJECTS_V2:
+        return {'ContinuationToken': response['NextContinuationToken']}
+    params = {'KeyMarker': response['NextKeyMarker']}
+    if response.get('NextVersionIdMarker'):
+        params['VersionIdMarker'] = response['NextVersionIdMarker']
+    return params
+
+
+def _iter_list_pages(api: S3Api, bucket: str, prefix: str, *, parallel: bool = False):
+    """
+    Yields response pages of a recursive listing of `prefix` as they arrive.
+
+    With `parallel`, sub-prefixes are discovered with `Delimiter='/'` and listed concurrently
+    by `MAX_CONCURRENCY` threads, so pages come in no particular order, but each key
+    is still listed exactly once. `CommonPrefixes` of discovery requests are removed from pages.
+    """
     if prefix and not prefix.endswith('/'):
         raise ValueError("Prefix must end with /")
 
     list_obj_params = dict(Bucket=bucket, Prefix=prefix)
-    if not recursive:
-        # Treat '/' as a directory separator and only return one level of files instead of everything.
-        list_obj_params.update(Delimiter='/')
+    s3_client = S3ClientProvider().find_correct_client(api, bucket, list_obj_params)
+    if not parallel:
+        yield from s3_client.get_paginator(_LIST_METHODS[api]).paginate(**list_obj_params)
+        return
+
+    list_page = getattr(s3_client, _LIST_METHODS[api])
+    # Sub-prefixes are discovered until there are enough of them to keep all connections busy,
+    # the rest are listed without a delimiter, so deep trees don't cost a request per directory.
+    max_waiting_prefixes = 4 * MAX_CONCURRENCY
+
+    def list_prefix_page(prefix, discover, page_params):
+        params = dict(Bucket=bucket, Prefix=prefix, **page_params)
+        if discover:
+            params['Delimiter'] = '/'
+        return prefix, discover, list_page(**params)
+
+    results = queue.SimpleQueue()
+    waiting = deque([(prefix, True, {})])
+    running = 0
+    executor = ThreadPoolExecutor(MAX_CONCURRENCY)
+    try:
+        while waiting or running:
+            while waiting and running < MAX_CONCURRENCY:
+                executor.submit(list_prefix_page, *waiting.popleft()).add_done_callback(results.put)
+                running += 1
+            page_prefix, discover, response = results.get().result()
+            running -= 1
+            next_params = _next_page_params(api, response)
+            if next_params is not None:
+                # Prefixes already being listed go first, so only a page per thread is held in memory.
+                waiting.appendleft((page_prefix, discover, next_params))
+            for common_prefix in response.pop('CommonPrefixes', ()):
+                waiting.append((common_prefix['Prefix'], len(waiting) < max_waiting_prefixes, {}))
+            yield response
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_objects(bucket, prefix, *, parallel=False):
+    """
+    Yields objects under `prefix`, as `Contents` items of ListObjectsV2 responses,
+    as pages arrive. See `_iter_list_pages()` for `parallel`.
+    """
+    for response in _iter_list_pages(S3Api.LIST_OBJECTS_V2, bucket, prefix, parallel=parallel):
+        yield from response.get('Contents', ())
+
+
+def iter_object_versions(bucket, prefix, *, parallel=False):
+    """
+    Yields object versions under `prefix`, as `Versions` items of ListObjectVersions responses,
+    as pages arrive. See `_iter_list_pages()` for `parallel`.
+    """
+    for response in _iter_list_pages(S3Api.LIST_OBJECT_VERSIONS, bucket, prefix, parallel=parallel):
+        yield from response.get('Versions', ())
+
+
+def list_object_versions(bucket, prefix, recursive=True, *, parallel=False):
+    if prefix and not prefix.endswith('/'):
+        raise ValueError("Prefix must end with /")
 
-    # TODO: make this a generator?
     versions = []
     delete_markers = []
+
+    if recursive:
+        for response in _iter_list_pages(S3Api.LIST_OBJECT_VERSIONS, bucket, prefix, parallel=parallel):
+            versions += response.get('Versions', [])
+            delete_markers += response.get('DeleteMarkers', [])
+        if parallel:
+            # Each key is listed by a single sub-prefix, so a stable sort restores the order of S3.
+            versions.sort(key=operator.itemgetter('Key'))
+            delete_markers.sort(key=operator.itemgetter('Key'))
+        return versions, delete_markers
+
+    # Treat '/' as a directory separator and only return one level of files instead of everything.
+    list_obj_params = dict(Bucket=bucket, Prefix=prefix, Delimiter='/')
     prefixes = []
 
     s3_client = S3ClientProvider().find_correct_client(S3Api.LIST_OBJECT_VERSIONS, bucket, list_obj_params)
@@ -755,22 +1449,23 @@ def list_object_versions(bucket, prefix, recursive=True):
         delete_markers += response.get('DeleteMarkers', [])
         prefixes += response.get('CommonPrefixes', [])
 
-    if recursive:
-        return versions, delete_markers
-    else:
-        return prefixes, versions, delete_markers
+    return prefixes, versions, delete_markers
 
 
-def list_objects(bucket, prefix, recursive=True):
+def list_objects(bucket, prefix, recursive=True, *, parallel=False):
     if prefix and not prefix.endswith('/'):
         raise ValueError("Prefix must end with /")
 
+    if recursive:
+        objects = list(iter_objects(bucket, prefix, parallel=parallel))
+        if parallel:
+            objects.sort(key=operator.itemgetter('Key'))
+        return objects
+
     objects = []
     prefixes = []
-    list_obj_params = dict(Bucket=bucket, Prefix=prefix)
-    if not recursive:
-        # Treat '/' as a directory separator and only return one level of files instead of everything.
-        list_obj_params.update(Delimiter='/')
+    # Treat '/' as a directory separator and only return one level of files instead of everything.
+    list_obj_params = dict(Bucket=bucket, Prefix=prefix, Delimiter='/')
 
     s3_client = S3ClientProvider().find_correct_client(S3Api.LIST_OBJECTS_V2, bucket, list_obj_params)
     paginator = s3_client.get_paginator('list_objects_v2')
@@ -779,28 +1474,82 @@ def list_objects(bucket, prefix, recursive=True):
         objects += response.get('Contents', [])
         prefixes += response.get('CommonPrefixes', [])
 
-    if recursive:
-        return objects
-    else:
-        return prefixes, objects
+    return prefixes, objects
 
 
 def _looks_like_dir(pk: PhysicalKey):
     return pk.basename() == ''
 
 
+def _scan_local_dir_level(path: str, dir_key: tuple, ignore):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    # Like `Path.rglob()`, don't follow symlinks to directories.
+                    if entry.is_dir(follow_symlinks=False):
+                        if ignore is None or not ignore(entry.path, True):
+                            subdirs.append((entry.path, (*dir_key, entry.name)))
+                    elif entry.is_file() and (ignore is None or not ignore(entry.path, False)):
+                        # Directories being scanned aren't symlinks, so only symlinked files need resolving.
+                        file_path = os.path.realpath(entry.path) if entry.is_symlink() else entry.path
+                        if os.path.sep != '/':
+                            file_path = file_path.replace(os.path.sep, '/')
+                        files.append((entry.name, file_path, entry.stat().st_size))
+                except FileNotFoundError:
+                    # If a file does not exist, is it really a file?
+                    pass
+    except (FileNotFoundError, PermissionError):
+        pass
+    return dir_key, files, subdirs
+
+
+def scan_local_dir(path, ignore=None):
+    """
+    Recursively lists regular files in the local directory `path`.
+
+    Directories are listed with `os.scandir()` by a pool of threads, and sizes come from
+    the `DirEntry` objects, so each file costs a single `stat()`, which matters on network
+    filesystems. Symlinks to files are followed, symlinks to directories are not.
+
+    Args:
+        path: real path of the directory, as in `PhysicalKey.from_path(path).path`
+        ignore: optional callable `(path, is_dir) -> bool`, ignored directories aren't scanned
+
+    Yields:
+        `(dir_key, files)` for each directory with files, in no particular order, where `dir_key`
+        is a tuple of path segments relative to `path` and `files` is a list of
+        `(name, real_path, size)` tuples.
+    """
+    results = queue.SimpleQueue()
+    executor = ThreadPoolExecutor(MAX_CONCURRENCY)
+
+    def submit(dir_path, dir_key):
+        executor.submit(_scan_local_dir_level, dir_path, dir_key, ignore).add_done_callback(results.put)
+
+    try:
+        submit(path, ())
+        pending = 1
+        while pending:
+            dir_key, files, subdirs = results.get().result()
+            pending -= 1
+            for subdir in subdirs:
+                submit(*subdir)
+            pending += len(subdirs)
+            if files:
+                yield dir_key, files
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
 def list_url(src: PhysicalKey):
     if src.is_local():
-        src_file = pathlib.Path(src.path)
-
-        for f in src_file.rglob('*'):
-            try:
-                if f.is_file():
-                    size = f.stat().st_size
-                    yield f.relative_to(src_file).as_posix(), size
-            except FileNotFoundError:
-                # If a file does not exist, is it really a file?
-                pass
+        for dir_key, files in scan_local_dir(src.path):
+            prefix = ''.join(f'{name}/' for name in dir_key)
+            for name, _, size in files:
+                yield prefix + name, size
     else:
         if src.version_id is not None:
             raise ValueError(f"Directories cannot have version IDs: {src}")
@@ -843,17 +1592,19 @@ def delete_url(src: PhysicalKey):
         s3_client.delete_object(Bucket=src.bucket, Key=src.path)
 
 
-def copy_file_list(file_list, message=None, callback=None):
+def copy_file_list(file_list, message=None, callback=None, *, src_checksums=None):
     """
     Takes a list of tuples (src, dest, size) and copies them in parallel.
     URLs must be regular files, not directories.
+    `src_checksums`, if given, are the known `sha2-256-chunked` checksums of the sources, or `None`
+    for unknown ones: copies between S3 objects are skipped if the destination already has that checksum.
     Returns versioned URLs for S3 destinations and regular file URLs for files.
     """
     for src, dest, _ in file_list:
         if _looks_like_dir(src) or _looks_like_dir(dest):
             raise ValueError("Directories are not allowed")
 
-    return _copy_file_list_internal(file_list, [None] * len(file_list), message, callback)
+    return _copy_file_list_internal(file_list, [None] * len(file_list), message, callback, src_checksums=src_checksums)
 
 
 def copy_file(src: PhysicalKey, dest: PhysicalKey, size=None, message=None, callback=None):
@@ -911,17 +1662,142 @@ def put_bytes(data: bytes, dest: PhysicalKey):
         )
 
 
+# Parts being uploaded by `open_writer()`, each takes up to a part size of memory.
+WRITER_MAX_PENDING_PARTS = 4
+
+
+class _S3MultipartWriter(io.RawIOBase):
+    """
+    Writable stream that uploads to S3 in parts as soon as they are filled,
+    so memory use doesn't depend on the object size. Objects smaller than one part
+    are uploaded with a single `put_object()` by `finish()`.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str):
+        super().__init__()
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._parts = []  # Futures of `upload_part()` results.
+
+    def writable(self):
+        return True
+
+    def _part_size(self):
+        # Grow parts, so objects up to a few hundred GB fit into the limit of 10,000 parts.
+        return s3_transfer_config.multipart_chunksize * (1 + len(self._parts) // 1000)
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer += b
+        while len(self._buffer) >= self._part_size():
+            part_size = self._part_size()
+            self._upload_part(bytes(self._buffer[:part_size]))
+            del self._buffer[:part_size]
+        return len(b)
+
+    def _upload_part(self, data: bytes):
+        if self._upload_id is None:
+            resp = self._s3_client.create_multipart_upload(Bucket=self._bucket, Key=self._key)
+            self._upload_id = resp['UploadId']
+            self._executor = ThreadPoolExecutor(WRITER_MAX_PENDING_PARTS)
+        if len(self._parts) >= WRITER_MAX_PENDING_PARTS:
+            # Wait for a part to be uploaded before buffering another one.
+            self._parts[-WRITER_MAX_PENDING_PARTS].result()
+
+        def upload(part_number):
+            resp = self._s3_client.upload_part(
+                Body=data,
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+            )
+            return {'PartNumber': part_number, 'ETag': resp['ETag']}
+
+        self._parts.append(self._executor.submit(upload, len(self._parts) + 1))
+
+    def finish(self) -> PhysicalKey:
+        """
+        Uploads the rest of the data and completes the upload.
+        """
+        if self._upload_id is None:
+            resp = self._s3_client.put_object(Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer))
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            with self._executor:
+                parts = [f.result() for f in self._parts]
+            resp = self._s3_client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        self.close()
+        return PhysicalKey(self._bucket, self._key, resp.get('VersionId'))
+
+    def abort(self):
+        self.close()
+        if self._upload_id is not None:
+            self._executor.shutdown()
+            self._s3_client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+
+    def close(self):
+        super().close()
+        self._buffer = bytearray()
+
+
+@contextlib.contextmanager
+def open_writer(dest: PhysicalKey):
+    """
+    Opens `dest` for writing as a binary stream, the same as `put_bytes()` with the data
+    written to the stream, but without keeping all of it in memory.
+
+    Nothing is written to `dest` if the block raises: local files are written to
+    a temporary file which replaces `dest` at the end; S3 objects are uploaded in parts
+    while data is still being written, and the upload is aborted on error.
+    """
+    if _looks_like_dir(dest):
+        raise ValueError("Invalid path: %r" % dest.path)
+
+    if dest.is_local():
+        dest_file = pathlib.Path(dest.path)
+        dest_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = dest_file.with_name(f'.{dest_file.name}.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(tmp_file, 'xb') as f:
+                yield f
+            os.replace(tmp_file, dest_file)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+    else:
+        if dest.version_id is not None:
+            raise ValueError("Cannot set VersionId on destination")
+        writer = _S3MultipartWriter(S3ClientProvider().standard_client, dest.bucket, dest.path)
+        try:
+            yield writer
+            writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+
+
 def _local_get_bytes(pk: PhysicalKey):
     return pathlib.Path(pk.path).read_bytes()
 
 
-def _s3_query_object(pk: PhysicalKey, *, head=False):
+def _s3_query_object(pk: PhysicalKey, *, head=False, find_correct_client=None):
     params = dict(Bucket=pk.bucket, Key=pk.path)
     if pk.version_id is not None:
         params.update(VersionId=pk.version_id)
-    s3_client = S3ClientProvider().find_correct_client(
-        S3Api.HEAD_OBJECT if head else S3Api.GET_OBJECT, pk.bucket, params
-    )
+    if find_correct_client is None:
+        find_correct_client = S3ClientProvider().find_correct_client
+    s3_client = find_correct_client(S3Api.HEAD_OBJECT if head else S3Api.GET_OBJECT, pk.bucket, params)
     return (s3_client.head_object if head else s3_client.get_object)(**params)
 
 
@@ -939,7 +1815,7 @@ def get_bytes_and_effective_pk(src: PhysicalKey) -> tuple[bytes, PhysicalKey]:
     return resp['Body'].read(), PhysicalKey(src.bucket, src.path, resp.get('VersionId'))
 
 
-def get_size_and_version(src: PhysicalKey):
+def get_size_and_version(src: PhysicalKey, *, find_correct_client=None):
     """
     Gets size and version for the object at a given URL.
 
@@ -956,12 +1832,50 @@ def get_size_and_version(src: PhysicalKey):
             raise QuiltException("Not a file: %r" % str(src_file))
         size = src_file.stat().st_size
     else:
-        resp = _s3_query_object(src, head=True)
+        resp = _s3_query_object(src, head=True, find_correct_client=find_correct_client)
         size = resp['ContentLength']
         version = resp.get('VersionId')
     return size, version
 
 
+def get_sizes_and_versions(src_list: list[PhysicalKey]) -> list[tuple[int, str | None] | Exception]:
+    """
+    Gets sizes and versions of many objects, like `get_size_and_version()`, with
+    concurrent requests that share S3 clients.
+
+    Returns:
+        `(size, version)` or the exception raised for each URL
+    """
+    if not src_list:
+        return []
+
+    find_correct_client = with_lock(S3ClientProvider().find_correct_client)
+
+    def get(src):
+        try:
+            return get_size_and_version(src, find_correct_client=find_correct_client)
+        except (
+            QuiltException,
+            OSError,
+            ClientError,
+            ConnectionError,
+            HTTPClientError,
+            ReadTimeoutError,
+            S3NoValidClientError,
+        ) as ex:
+            return ex
+
+    with (
+        tqdm(desc="Getting sizes", total=len(src_list), disable=DISABLE_TQDM) as progress,
+        ThreadPoolExecutor(MAX_CONCURRENCY) as executor,
+    ):
+        results = []
+        for result in executor.map(get, src_list):
+            results.append(result)
+            progress.update()
+    return results
+
+
 def calculate_multipart_checksum(tasks: list[FileChecksumTask]) -> list[str | Exception]:
     if not tasks:
         return []
@@ -1018,6 +1932,14 @@ def _calculate_checksum_internal(
     tasks: list[FileChecksumTask],
     results: list[str | Exception | None],
 ) -> list[str | Exception]:
+    local_stats = {}
+    for idx, (task, result) in enumerate(zip(tasks, results, strict=True)):
+        if (result is None or isinstance(result, Exception)) and task.physical_key.is_local():
+            stat_result = _stat_local_file(task.physical_key.path, task.size)
+            if stat_result is not None:
+                local_stats[idx] = stat_result
+                results[idx] = ChecksumCache.get(stat_result, task.checksum_calculator_cls.checksum_type)
+
     total_size = sum(
         task.size
         for task, result in zip(tasks, results, strict=True)
@@ -1095,6 +2017,13 @@ def _calculate_checksum_internal(
                 future_results = [future.result() for future in future_list]
                 exceptions = [ex for ex in future_results if isinstance(ex, Exception)]
                 results[idx] = exceptions[0] if exceptions else checksum_calculator_cls.combine_parts(future_results)
+                if idx in local_stats and not exceptions:
+                    ChecksumCache.set(
+                        tasks[idx].physical_key.path,
+                        local_stats[idx],
+                        checksum_calculator_cls.checksum_type,
+                        results[idx],
+                    )
         finally:
             stopped = True
             for _, _, future_list in futures:
@@ -11,7 +11,7 @@ import time
 
 import requests
 
-from . import Package, __version__ as quilt3_version, api, session, util
+from . import Package, __version__ as quilt3_version, api, packages, session, util
 from .backends import get_package_registry
 from .session import open_url
 from .util import (
@@ -203,6 +203,33 @@ def cmd_verify(name, registry, top_hash, dir, extra_files_ok):
         return 1
 
 
+def cmd_diff(name, registry, hash_a, hash_b):
+    prefixes = {'added': 'A', 'modified': 'M', 'deleted': 'D'}
+    for change, logical_key in Package.diff_manifests(registry, name, hash_a, hash_b):
+        print(f"{prefixes[change]}\t{logical_key}")
+
+
+def parse_non_negative_int(value):
+    value = int(value)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a non-negative integer.')
+    return value
+
+
+def cmd_cache(prune):
+    if prune is not None:
+        removed = packages.ContentCache.prune(prune)
+        print(f"Removed {removed} objects from the cache.")
+    count, size = packages.ContentCache.stats()
+    print(f"Objects: {count}")
+    print(f"Size: {size} B")
+    if packages.CONTENT_CACHE_MAX_SIZE:
+        print(f"Maximum size: {packages.CONTENT_CACHE_MAX_SIZE} B")
+    else:
+        print("Maximum size: not set, the cache is disabled")
+    print(f"Location: {packages.CACHE_PATH}")
+
+
 # This is not a lambda to ease of testing.
 def _selector_fn_no_copy(*args):
     return False
@@ -374,6 +401,16 @@ def create_parser():
         type=str,
         required=False,
     )
+    install_p.add_argument(
+        "--incremental",
+        help="Skip files that already exist in DEST with the same size and hash.",
+        action="store_true",
+    )
+    install_p.add_argument(
+        "--delete-extra",
+        help="Delete files in DEST that are not in the package. Can't be combined with --path.",
+        action="store_true",
+    )
     install_p.set_defaults(func=Package.install)
 
     # list-packages
@@ -419,6 +456,46 @@ def create_parser():
     )
     verify_p.set_defaults(func=cmd_verify)
 
+    # diff
+    shorthelp = "List entries added, modified or deleted between two revisions of a package"
+    diff_p = subparsers.add_parser("diff", description=shorthelp, help=shorthelp, allow_abbrev=False)
+    diff_p.add_argument(
+        "name",
+        help="Name of package, in the USER/PKG format",
+        type=str,
+    )
+    diff_p.add_argument(
+        "hash_a",
+        help="Hash of the revision to compare from",
+        type=str,
+    )
+    diff_p.add_argument(
+        "hash_b",
+        help="Hash of the revision to compare to",
+        type=str,
+    )
+    diff_p.add_argument(
+        "--registry",
+        help="Registry where package is located, usually s3://MY-BUCKET. Defaults to local registry.",
+        type=str,
+        required=False,
+    )
+    diff_p.set_defaults(func=cmd_diff)
+
+    # cache
+    shorthelp = "Show statistics of the local cache of objects shared by packages, or prune it"
+    cache_p = subparsers.add_parser("cache", description=shorthelp, help=shorthelp, allow_abbrev=False)
+    cache_p.add_argument(
+        "--prune",
+        help="Remove the least recently used objects until the cache is no bigger than MAX_SIZE bytes. "
+        "Without MAX_SIZE, remove all objects.",
+        metavar="MAX_SIZE",
+        type=parse_non_negative_int,
+        nargs="?",
+        const=0,
+    )
+    cache_p.set_defaults(func=cmd_cache)
+
     # push
     shorthelp = "Pushes the new package to the remote registry"
     push_p = subparsers.add_parser("push", description=shorthelp, help=shorthelp, allow_abbrev=False, add_help=False)
@@ -0,0 +1,1052 @@
+"""
+Compact storage for package manifests.
+
+`ManifestTable` keeps manifest rows in a handful of contiguous arrays instead of a tree of
+`Package`/`PackageEntry`/`PhysicalKey` objects, which makes it possible to hold packages with
+millions of entries in memory. Rows are kept sorted in package walk order, i.e. logical keys are
+compared segment by segment, so that a directory is a contiguous range of rows which can be
+found with binary search.
+
+Directory-level metadata is stored as rows with a logical key ending in '/'. These rows sort
+before any entries of the directory.
+"""
+
+import base64
+import bisect
+import functools
+import json
+import logging
+import mmap
+import os
+import pathlib
+import re
+import sys
+import zlib
+from array import array
+from urllib.parse import unquote
+
+from . import checksums
+from .exceptions import PackageException
+from .util import PhysicalKey, URLParseError, validate_key
+
+logger = logging.getLogger(__name__)
+
+NO_SIZE = -1
+
+# Hash codecs: how hash values are packed.
+_HEX = 'hex'  # raw digest of a lowercase hex string
+_BASE64 = 'base64'  # raw digest of a base64 string
+_STR = 'str'  # UTF-8 encoded string
+_JSON = 'json'  # JSON-encoded hash object, for anything unusual
+
+_HASH_CODECS = {
+    checksums.SHA256_HASH_NAME: _HEX,
+    checksums.SHA256_CHUNKED_HASH_NAME: _BASE64,
+    checksums.CRC64NVME_HASH_NAME: _BASE64,
+}
+
+ARROW_FORMAT_VERSION = 1
+
+# Special hash type IDs.
+_NO_HASH = 255
+_DIR_ROW = 254
+_MAX_HASH_TYPES = 254
+
+
+def tree_key(logical_key: str) -> bytes:
+    """
+    Sort key that orders logical keys the same way `Package.walk()` does:
+    segment by segment, so 'a/b' sorts before 'a.b'.
+    """
+    return logical_key.encode().replace(b'/', b'\x00')
+
+
+class PackedBytes:
+    """
+    A sequence of byte strings stored in a single buffer.
+    """
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, data=None, offsets=None):
+        self.data = bytearray() if data is None else data
+        self.offsets = array('q', [0]) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+        return bytes(self.data[offsets[i] : offsets[i + 1]])
+
+    def append(self, value: bytes):
+        self.data += value
+        self.offsets.append(len(self.data))
+
+    def freeze(self):
+        if isinstance(self.data, bytearray):
+            self.data = bytes(self.data)
+
+    def permuted(self, order):
+        result = PackedBytes()
+        for i in order:
+            result.append(self[i])
+        result.freeze()
+        return result
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+def _split_url(url: str):
+    """
+    Splits a physical key URL into a directory-like prefix shared by many entries
+    and the rest (base name, version ID).
+    """
+    base, _, _ = url.partition('?')
+    cut = base.rfind('/') + 1
+    return url[:cut], url[cut:]
+
+
+def entry_arrow_schema():
+    """
+    Schema of package entries exported to Arrow.
+
+    `size`, `hash_type`, `hash_value` and `meta` are null when missing. `meta` is JSON-encoded.
+    Hash objects other than a `type` and a `value` string have a null `hash_type`
+    and are JSON-encoded in `hash_value`.
+    """
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ('logical_key', pa.large_string()),
+            ('physical_key', pa.large_string()),
+            ('size', pa.int64()),
+            ('hash_type', pa.string()),
+            ('hash_value', pa.large_string()),
+            ('meta', pa.large_string()),
+        ]
+    )
+
+
+def _encode_hashes(values, codec):
+    """
+    Encodes packed hash values of a single codec, a `pyarrow.LargeBinaryArray` without nulls,
+    into strings, in bulk where possible.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    n = len(values)
+    if codec in (_STR, _JSON):
+        return values.view(pa.large_string())
+    if codec == _HEX:
+        # Hex encoding of concatenated values is the concatenation of their hex encodings.
+        offsets = pa.Array.from_buffers(pa.int64(), n + 1, [None, values.buffers()[1]], offset=values.offset)
+        start, end = offsets[0].as_py(), offsets[n].as_py()
+        data = memoryview(values.buffers()[2])[start:end].hex().encode()
+        offsets = pc.multiply(pc.subtract(offsets, start), 2)
+        return pa.Array.from_buffers(pa.large_string(), n, [None, offsets.buffers()[1], pa.py_buffer(data)])
+
+    length = pc.min_max(pc.binary_length(values)).as_py()
+    if n and length['min'] == length['max'] and length['min']:
+        # Digests of the same length can be encoded at once if each one is padded
+        # to a whole number of 3-byte groups, then the padding is replaced with '='.
+        size = length['min']
+        pad = -size % 3
+        if pad:
+            values = pc.binary_join_element_wise(
+                values, pa.scalar(b'\0' * pad, pa.large_binary()), pa.scalar(b'', pa.large_binary())
+            )
+        _, offsets, data = values.buffers()
+        start = pa.Array.from_buffers(pa.int64(), 1, [None, offsets], offset=values.offset)[0].as_py()
+        data = base64.b64encode(memoryview(data)[start : start + n * (size + pad)])
+        width = (size + pad) // 3 * 4
+        offsets = array('q', range(0, (n + 1) * width, width))
+        encoded = pa.Array.from_buffers(pa.large_string(), n, [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+        if pad:
+            encoded = pc.binary_join_element_wise(
+                pc.utf8_slice_codeunits(encoded, 0, width - pad),
+                pa.scalar('=' * pad, pa.large_string()),
+                pa.scalar('', pa.large_string()),
+            )
+        return encoded
+    return pa.array([base64.b64encode(value).decode() for value in values.to_pylist()], pa.large_string())
+
+
+class _SortedRows:
+    """
+    Range queries over manifest rows sorted in walk order.
+
+    Subclasses provide `_keys` (`PackedBytes` of logical keys), `is_dir()` and `record()`.
+    """
+
+    _keys: PackedBytes
+
+    def __len__(self):
+        return len(self._keys)
+
+    def logical_key(self, i: int) -> str:
+        return self._keys[i].decode()
+
+    def _tree_key_at(self, i):
+        return self._keys[i].replace(b'/', b'\x00')
+
+    def _bisect(self, target: bytes, lo: int, hi: int) -> int:
+        return bisect.bisect_left(range(len(self)), target, lo, hi, key=self._tree_key_at)
+
+    def find(self, logical_key: str, lo: int = 0, hi: int | None = None):
+        """
+        Looks up `logical_key` within rows `lo:hi`.
+
+        Returns:
+            the row index of a matching entry, `(start, stop)` row range of a matching directory
+            or `None`.
+        """
+        if hi is None:
+            hi = len(self)
+        target = tree_key(logical_key)
+        i = self._bisect(target, lo, hi)
+        if i == hi:
+            return None
+        key = self._keys[i]
+        if key == logical_key.encode() and not self.is_dir(i):
+            return i
+        if key.startswith(logical_key.encode() + b'/'):
+            return i, self._bisect(target + b'\x01', i, hi)
+        return None
+
+    def iter_level(self, lo: int, hi: int, prefix: str):
+        """
+        Iterates over the immediate children of the directory `prefix` which spans rows `lo:hi`.
+
+        Yields:
+            `(name, row, None)` for entries and `(name, start, stop)` for directories.
+        """
+        skip = len(prefix.encode())
+        i = lo
+        while i < hi:
+            rest = self._keys[i][skip:]
+            if not rest:
+                # Metadata of the directory itself.
+                i += 1
+                continue
+            name, sep, _ = rest.partition(b'/')
+            if not sep:
+                yield name.decode(), i, None
+                i += 1
+            else:
+                stop = self._bisect(tree_key(prefix) + name + b'\x01', i, hi)
+                yield name.decode(), i, stop
+                i = stop
+
+    def entry_fields(self, i: int) -> tuple:
+        """Returns `PackageEntry` arguments for the entry at row `i`."""
+        record = self.record(i)
+        return PhysicalKey.from_url(record['physical_keys'][0]), record['size'], record['hash'], record['meta']
+
+    def entry_rows(self, lo: int, hi: int):
+        return (i for i in range(lo, hi) if not self.is_dir(i))
+
+    def dir_rows(self, lo: int, hi: int):
+        return (i for i in range(lo, hi) if self.is_dir(i))
+
+
+def _find_redundant_rows(rows: _SortedRows) -> list[int]:
+    """
+    Validates sorted rows and returns the ones that should be dropped:
+    all but the last of repeated directory metadata rows.
+    """
+    keys = rows._keys
+    drop = []
+    for i in range(1, len(rows)):
+        prev, key = keys[i - 1], keys[i]
+        if prev == key:
+            if rows.is_dir(i) and rows.is_dir(i - 1):
+                # Last one wins, same as repeated `set_meta()`.
+                drop.append(i - 1)
+                continue
+            raise PackageException(f"Duplicate logical key {key.decode()!r} while loading package entry")
+        if not rows.is_dir(i - 1) and key.startswith(prev + b'/'):
+            raise PackageException(f"Logical key {prev.decode()!r} is both an entry and a directory")
+    return drop
+
+
+class ManifestTable(_SortedRows):
+    """
+    Columnar, read-only representation of manifest rows sorted in walk order.
+    """
+
+    def __init__(self):
+        self.meta = {'version': 'v0'}
+        self._keys = PackedBytes()
+        self._pk_prefix_ids = array('I')
+        self._pk_prefixes = []
+        self._pk_rests = PackedBytes()
+        self._sizes = array('q')
+        self._hash_type_ids = array('B')
+        self._hash_types = []  # (hash type, codec)
+        self._hash_values = PackedBytes()
+        self._metas = PackedBytes()
+        self._meta_decode = _make_decoder()
+        self._parsed_prefixes = {}
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @classmethod
+    def from_records(cls, meta: dict, records) -> 'ManifestTable':
+        """
+        Builds a table from the package metadata and an iterable of manifest rows,
+        as they are stored in a JSONL manifest.
+        """
+        table = cls()
+        table.meta = meta
+        builder = _TableBuilder(table)
+        for obj in records:
+            builder.add(obj)
+        builder.finish()
+        return table
+
+    @classmethod
+    def from_entries_arrow(cls, meta: dict, arrow_table) -> 'ManifestTable':
+        """
+        Builds a table from the package metadata and a `pyarrow.Table` of entries with the columns
+        of `entry_arrow_schema()`, as returned by `entries_to_arrow()`, in any order.
+        Only `logical_key` and `physical_key` columns are required.
+
+        Raises:
+            ImportError: when pyarrow isn't installed.
+        """
+        import pyarrow as pa
+
+        n = arrow_table.num_rows
+        columns = []
+        for field in entry_arrow_schema():
+            if field.name in arrow_table.column_names:
+                column = arrow_table.column(field.name).cast(field.type)
+                if column.null_count and field.name in ('logical_key', 'physical_key'):
+                    raise PackageException(f"Column {field.name!r} can't contain nulls")
+                columns.append(column.to_pylist())
+            elif field.name in ('logical_key', 'physical_key'):
+                raise PackageException(f"Missing {field.name!r} column")
+            else:
+                columns.append(pa.nulls(n, field.type).to_pylist())
+
+        table = cls()
+        table.meta = meta
+        builder = _TableBuilder(table)
+        for logical_key, url, size, hash_type, hash_value, entry_meta in zip(*columns, strict=True):
+            validate_key(logical_key)
+            if hash_type is not None:
+                hash_obj = {'type': hash_type, 'value': hash_value}
+            else:
+                hash_obj = None if hash_value is None else json.loads(hash_value)
+            entry_meta = json.loads(entry_meta) if entry_meta is not None else {}
+            if not isinstance(entry_meta, dict):
+                raise PackageException(f"Metadata of {logical_key!r} must be a JSON object")
+            builder.add(
+                {
+                    'logical_key': logical_key,
+                    'physical_keys': [url],
+                    'size': size,
+                    'hash': hash_obj,
+                    'meta': entry_meta,
+                }
+            )
+        builder.finish()
+        return table
+
+    @property
+    def nbytes(self):
+        """Approximate amount of memory used by the columns."""
+        return (
+            self._keys.nbytes
+            + self._pk_rests.nbytes
+            + self._hash_values.nbytes
+            + self._metas.nbytes
+            + sum(a.itemsize * len(a) for a in (self._pk_prefix_ids, self._sizes, self._hash_type_ids))
+            + sum(len(p) for p in self._pk_prefixes)
+        )
+
+    # Row accessors.
+
+    def is_dir(self, i: int) -> bool:
+        return self._hash_type_ids[i] == _DIR_ROW
+
+    def url(self, i: int) -> str:
+        return self._pk_prefixes[self._pk_prefix_ids[i]] + self._pk_rests[i].decode()
+
+    def physical_key(self, i: int) -> PhysicalKey:
+        """
+        Same as `PhysicalKey.from_url(self.url(i))`, but parses the shared URL prefix only once.
+        """
+        prefix_id = self._pk_prefix_ids[i]
+        base = self._parsed_prefixes.get(prefix_id, ...)
+        if base is ...:
+            base = None
+            prefix = self._pk_prefixes[prefix_id]
+            if prefix.startswith('s3://'):
+                try:
+                    base = PhysicalKey.from_url(prefix)
+                except URLParseError:
+                    pass
+            self._parsed_prefixes[prefix_id] = base
+        rest = self._pk_rests[i].decode()
+        if base is not None and '#' not in rest:
+            name, _, query = rest.partition('?')
+            version_id = query.removeprefix('versionId=')
+            # Anything unusual in the query string goes through the full parser below.
+            if not query or (version_id != query and not any(c in version_id for c in '&%+=')):
+                if '%' in name:
+                    name = unquote(name)
+                return PhysicalKey(base.bucket, base.path + name, version_id or None)
+        return PhysicalKey.from_url(self._pk_prefixes[prefix_id] + rest)
+
+    def size(self, i: int):
+        size = self._sizes[i]
+        return None if size == NO_SIZE else size
+
+    def hash(self, i: int):
+        type_id = self._hash_type_ids[i]
+        if type_id == _NO_HASH:
+            return None
+        hash_type, codec = self._hash_types[type_id]
+        value = self._hash_values[i]
+        if codec == _HEX:
+            return {'type': hash_type, 'value': value.hex()}
+        if codec == _BASE64:
+            return {'type': hash_type, 'value': base64.b64encode(value).decode()}
+        if codec == _STR:
+            return {'type': hash_type, 'value': value.decode()}
+        return json.loads(value)
+
+    def meta_at(self, i: int) -> dict:
+        data = self._metas[i]
+        return self._meta_decode(data.decode()) if data else {}
+
+    def record(self, i: int) -> dict:
+        """Returns row `i` as it appears in a JSONL manifest."""
+        if self.is_dir(i):
+            return {'logical_key': self.logical_key(i), 'meta': self.meta_at(i)}
+        return {
+            'logical_key': self.logical_key(i),
+            'physical_keys': [self.url(i)],
+            'size': self.size(i),
+            'hash': self.hash(i),
+            'meta': self.meta_at(i),
+        }
+
+    def entry_fields(self, i: int) -> tuple:
+        return self.physical_key(i), self.size(i), self.hash(i), self.meta_at(i)
+
+    def entry_rows(self, lo: int, hi: int):
+        type_ids = self._hash_type_ids
+        return (i for i in range(lo, hi) if type_ids[i] != _DIR_ROW)
+
+    def dir_rows(self, lo: int, hi: int):
+        type_ids = self._hash_type_ids
+        return (i for i in range(lo, hi) if type_ids[i] == _DIR_ROW)
+
+    # Arrow export.
+
+    def entries_to_arrow(self, lo: int, hi: int, strip: int = 0, prefix: str = ''):
+        """
+        Returns the entries in rows `lo:hi` as a `pyarrow.Table` with `entry_arrow_schema()`,
+        with the first `strip` characters of logical keys replaced with `prefix`.
+
+        Columns are computed from the buffers of the table, without decoding rows one by one,
+        except for hash values that can't be encoded in bulk.
+
+        Raises:
+            ImportError: when pyarrow isn't installed.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        n = len(self)
+        views = self._buffers()
+
+        def packed(name, arrow_type):
+            offsets, data = views[name]
+            array = pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+            return array.slice(lo, hi - lo)
+
+        def fixed(name, arrow_type):
+            return pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(views[name][0])]).slice(lo, hi - lo)
+
+        type_ids = fixed('_hash_type_ids', pa.uint8())
+        is_entry = pc.not_equal(type_ids, _DIR_ROW)
+        type_ids = type_ids.filter(is_entry)
+
+        keys = packed('_keys', pa.large_string()).filter(is_entry)
+        if strip:
+            keys = pc.utf8_slice_codeunits(keys, strip)
+        if prefix:
+            keys = pc.binary_join_element_wise(
+                pa.scalar(prefix, pa.large_string()), keys, pa.scalar('', pa.large_string())
+            )
+
+        pk_prefixes = pa.DictionaryArray.from_arrays(
+            fixed('_pk_prefix_ids', pa.int32()).filter(is_entry),
+            pa.array(self._pk_prefixes, pa.large_string()),
+        ).dictionary_decode()
+        physical_keys = pc.binary_join_element_wise(
+            pk_prefixes, packed('_pk_rests', pa.large_string()).filter(is_entry), pa.scalar('', pa.large_string())
+        )
+
+        sizes = fixed('_sizes', pa.int64()).filter(is_entry)
+        sizes = pc.if_else(pc.equal(sizes, NO_SIZE), pa.scalar(None, pa.int64()), sizes)
+
+        metas = packed('_metas', pa.large_string()).filter(is_entry)
+        metas = pc.if_else(pc.equal(pc.binary_length(metas), 0), pa.scalar(None, pa.large_string()), metas)
+
+        hash_types, hash_values = self._hashes_to_arrow(
+            type_ids, packed('_hash_values', pa.large_binary()).filter(is_entry)
+        )
+        return pa.Table.from_arrays(
+            [keys, physical_keys, sizes, hash_types, hash_values, metas], schema=entry_arrow_schema()
+        )
+
+    def _hashes_to_arrow(self, type_ids, values):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        hash_types = pa.nulls(len(type_ids), pa.string())
+        hash_values = pa.nulls(len(type_ids), pa.large_string())
+        for type_id in pc.unique(type_ids).to_pylist():
+            if type_id == _NO_HASH:
+                continue
+            hash_type, codec = self._hash_types[type_id]
+            is_type = pc.equal(type_ids, type_id)
+            selected = values.filter(is_type)
+            hash_types = pc.replace_with_mask(
+                hash_types, is_type, pa.repeat(pa.scalar(hash_type, pa.string()), len(selected))
+            )
+            hash_values = pc.replace_with_mask(hash_values, is_type, _encode_hashes(selected, codec))
+        return hash_types, hash_values
+
+    # Arrow cache.
+
+    def _buffers(self):
+        """
+        Column buffers, trimmed to their exact size, in the order used by the Arrow cache checksum.
+        """
+        n = len(self)
+        views = {}
+        for name in ('_keys', '_pk_rests', '_hash_values', '_metas'):
+            column = getattr(self, name)
+            offsets = memoryview(column.offsets).cast('B')[: 8 * (n + 1)]
+            views[name] = (offsets, memoryview(column.data)[: column.offsets[n]])
+        for name in ('_pk_prefix_ids', '_sizes', '_hash_type_ids'):
+            column = memoryview(getattr(self, name))
+            views[name] = (column.cast('B')[: n * column.itemsize],)
+        return views
+
+    @staticmethod
+    def _checksum(views) -> int:
+        crc = 0
+        for name in sorted(views):
+            for view in views[name]:
+                crc = zlib.crc32(view, crc)
+        return crc
+
+    def write_arrow(self, path, validity: dict):
+        """
+        Saves the table to an Arrow IPC file at `path`.
+
+        `validity` is stored along with the table and must match on `read_arrow()`;
+        it's used to tie the cache to the state of the source manifest.
+
+        Raises:
+            ImportError: when pyarrow isn't installed.
+        """
+        import pyarrow as pa
+
+        n = len(self)
+        views = self._buffers()
+
+        def packed(name, arrow_type):
+            offsets, data = views[name]
+            return pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+
+        def fixed(name, arrow_type):
+            return pa.Array.from_buffers(arrow_type, n, [None, pa.py_buffer(views[name][0])])
+
+        arrow_table = pa.table(
+            {
+                'logical_key': packed('_keys', pa.large_string()),
+                'physical_key_prefix': pa.DictionaryArray.from_arrays(
+                    fixed('_pk_prefix_ids', pa.int32()),
+                    pa.array(self._pk_prefixes, pa.string()),
+                ),
+                'physical_key_rest': packed('_pk_rests', pa.large_string()),
+                'size': fixed('_sizes', pa.int64()),
+                'hash_type': fixed('_hash_type_ids', pa.uint8()),
+                'hash_value': packed('_hash_values', pa.large_binary()),
+                'meta': packed('_metas', pa.large_string()),
+            }
+        ).replace_schema_metadata(
+            {
+                'quilt_format_version': str(ARROW_FORMAT_VERSION),
+                'quilt_checksum': str(self._checksum(views)),
+                'quilt_meta': json.dumps(self.meta),
+                'quilt_hash_types': json.dumps(self._hash_types),
+                'quilt_validity': json.dumps(validity, sort_keys=True),
+            }
+        )
+
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            with pa.OSFile(str(tmp_path), 'wb') as sink:
+                with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                    writer.write_table(arrow_table)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    @classmethod
+    def read_arrow(cls, path, validity: dict) -> 'ManifestTable':
+        """
+        Memory-maps a table saved with `write_arrow()`.
+
+        Raises:
+            ImportError: when pyarrow isn't installed.
+            ValueError: when the file was written by an incompatible version, for a different `validity`,
+                or doesn't match its checksum.
+        """
+        import pyarrow as pa
+
+        arrow_table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        metadata = arrow_table.schema.metadata or {}
+        if metadata.get(b'quilt_format_version') != str(ARROW_FORMAT_VERSION).encode():
+            raise ValueError("Unsupported manifest cache format")
+        if metadata.get(b'quilt_validity') != json.dumps(validity, sort_keys=True).encode():
+            raise ValueError("Stale manifest cache")
+
+        n = arrow_table.num_rows
+
+        def column(name):
+            chunks = arrow_table.column(name).chunks
+            array = chunks[0] if len(chunks) == 1 else pa.concat_arrays(chunks)
+            if array.offset or array.null_count:
+                raise ValueError(f"Unexpected layout of {name!r} column")
+            return array
+
+        def buffer(arrow_buffer, size):
+            view = memoryview(arrow_buffer if arrow_buffer is not None else b'').cast('B')
+            if len(view) < size:
+                raise ValueError("Truncated manifest cache")
+            return view[:size]
+
+        def packed(name):
+            _, offsets, data = column(name).buffers()
+            offsets = buffer(offsets, 8 * (n + 1))
+            return offsets, buffer(data, offsets.cast('q')[n] if n else 0)
+
+        def fixed(array, itemsize):
+            return (buffer(array.buffers()[1], n * itemsize),)
+
+        prefixes = column('physical_key_prefix')
+        views = {
+            '_keys': packed('logical_key'),
+            '_pk_rests': packed('physical_key_rest'),
+            '_hash_values': packed('hash_value'),
+            '_metas': packed('meta'),
+            '_pk_prefix_ids': fixed(prefixes.indices, 4),
+            '_sizes': fixed(column('size'), 8),
+            '_hash_type_ids': fixed(column('hash_type'), 1),
+        }
+        if metadata.get(b'quilt_checksum') != str(cls._checksum(views)).encode():
+            raise ValueError("Manifest cache checksum mismatch")
+
+        table = cls()
+        table.meta = json.loads(metadata[b'quilt_meta'])
+        table._hash_types = [tuple(t) for t in json.loads(metadata[b'quilt_hash_types'])]
+        table._pk_prefixes = prefixes.dictionary.to_pylist()
+        for name in ('_keys', '_pk_rests', '_hash_values', '_metas'):
+            offsets, data = views[name]
+            setattr(table, name, PackedBytes(data, offsets.cast('q')))
+        table._pk_prefix_ids = views['_pk_prefix_ids'][0].cast('i')
+        table._sizes = views['_sizes'][0].cast('q')
+        table._hash_type_ids = views['_hash_type_ids'][0]
+        return table
+
+
+def _make_decoder():
+    @functools.cache
+    def memoize_key(s):
+        return s
+
+    def object_pairs_hook(items):
+        return {memoize_key(k): v for k, v in items}
+
+    return json.JSONDecoder(object_pairs_hook=object_pairs_hook).decode
+
+
+class _TableBuilder:
+    def __init__(self, table: ManifestTable):
+        self.table = table
+        self.prefix_ids = {}
+        self.hash_type_ids = {}
+        self.meta_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        self.is_sorted = True
+        self.last_tree_key = b''
+
+    def _intern_prefix(self, prefix):
+        prefix_id = self.prefix_ids.get(prefix)
+        if prefix_id is None:
+            prefix_id = self.prefix_ids[prefix] = len(self.table._pk_prefixes)
+            self.table._pk_prefixes.append(prefix)
+        return prefix_id
+
+    def _intern_hash_type(self, hash_type, codec):
+        type_id = self.hash_type_ids.get((hash_type, codec))
+        if type_id is None:
+            if len(self.table._hash_types) == _MAX_HASH_TYPES:
+                raise PackageException("Too many distinct hash types in manifest")
+            type_id = self.hash_type_ids[(hash_type, codec)] = len(self.table._hash_types)
+            self.table._hash_types.append((hash_type, codec))
+        return type_id
+
+    def _pack_hash(self, hash_obj):
+        if hash_obj is None:
+            return _NO_HASH, b''
+        if isinstance(hash_obj, dict) and hash_obj.keys() == {'type', 'value'}:
+            hash_type, value = hash_obj['type'], hash_obj['value']
+            if isinstance(hash_type, str) and isinstance(value, str):
+                codec = _HASH_CODECS.get(hash_type)
+                try:
+                    if codec == _HEX:
+                        packed = bytes.fromhex(value)
+                        if packed.hex() != value:
+                            raise ValueError
+                    elif codec == _BASE64:
+                        packed = base64.b64decode(value, validate=True)
+                        if base64.b64encode(packed).decode() != value:
+                            raise ValueError
+                    else:
+                        raise ValueError
+                except ValueError:
+                    codec, packed = _STR, value.encode()
+                return self._intern_hash_type(hash_type, codec), packed
+        return self._intern_hash_type(None, _JSON), json.dumps(hash_obj).encode()
+
+    def _append(self, key: str, url: str, size, type_id: int, hash_value: bytes, meta):
+        table = self.table
+        key_bytes = key.encode()
+        tk = key_bytes.replace(b'/', b'\x00')
+        if tk < self.last_tree_key:
+            self.is_sorted = False
+        self.last_tree_key = tk
+        table._keys.append(key_bytes)
+        prefix, rest = _split_url(url)
+        table._pk_prefix_ids.append(self._intern_prefix(prefix))
+        table._pk_rests.append(rest.encode())
+        table._sizes.append(NO_SIZE if size is None else size)
+        table._hash_type_ids.append(type_id)
+        table._hash_values.append(hash_value)
+        table._metas.append(self.meta_encode(meta).encode() if meta else b'')
+
+    def add(self, obj: dict):
+        logical_key = obj['logical_key']
+        if not obj.get('physical_keys', None):
+            # Directory-level metadata. Like `Package._load()`, the last segment of the key is ignored.
+            dir_key, sep, _ = logical_key.rpartition('/')
+            if not sep:
+                self.table.meta['user_meta'] = obj['meta']
+                return
+            self._append(dir_key + '/', '', None, _DIR_ROW, b'', obj['meta'])
+            return
+        size = obj['size']
+        if size is not None and not isinstance(size, int):
+            raise PackageException(f"Invalid size {size!r} of package entry: {obj!r}")
+        type_id, hash_value = self._pack_hash(obj['hash'])
+        self._append(logical_key, obj['physical_keys'][0], size, type_id, hash_value, obj['meta'])
+
+    def finish(self):
+        table = self.table
+        if not self.is_sorted:
+            self._sort()
+        self._check()
+        for column in (table._keys, table._pk_rests, table._hash_values, table._metas):
+            column.freeze()
+
+    def _sort(self):
+        # Stable sort keeps the last of duplicated directory metadata rows last.
+        self._reorder(sorted(range(len(self.table)), key=self.table._tree_key_at))
+
+    def _reorder(self, order):
+        table = self.table
+        for name in ('_keys', '_pk_rests', '_hash_values', '_metas'):
+            setattr(table, name, getattr(table, name).permuted(order))
+        for name in ('_pk_prefix_ids', '_sizes', '_hash_type_ids'):
+            column = getattr(table, name)
+            setattr(table, name, array(column.typecode, (column[i] for i in order)))
+
+    def _check(self):
+        drop = _find_redundant_rows(self.table)
+        if drop:
+            dropped = set(drop)
+            self._reorder([i for i in range(len(self.table)) if i not in dropped])
+
+
+INDEX_FORMAT_VERSION = 1
+_INDEX_MAGIC = b'QUILTIDX'
+_INDEX_ALIGNMENT = 8
+
+# Manifests written by quilt3 start entry lines with the logical key followed by physical keys,
+# which lets us pick the key out of the line without decoding the whole line.
+_LINE_RE = re.compile(rb'(?m)^(?:\{"logical_key": "([^"\\\r\n]*)"(, "physical_keys": \[")?)?[^\n]*')
+
+
+def _pad(size: int) -> int:
+    return -size % _INDEX_ALIGNMENT
+
+
+class ManifestIndex(_SortedRows):
+    """
+    Sorted index of logical keys and line offsets over a JSONL manifest.
+
+    The manifest is memory-mapped and rows are only decoded when they are accessed.
+    """
+
+    def __init__(self, data, meta: dict, keys: PackedBytes, line_offsets, flags):
+        self._data = data
+        self.meta = meta
+        self._keys = keys
+        self._line_offsets = line_offsets
+        self._flags = flags
+        self._decode = _make_decoder()
+
+    def __len__(self):
+        return len(self._line_offsets)
+
+    @classmethod
+    def open(cls, manifest_path, index_path=None) -> 'ManifestIndex':
+        """
+        Opens the manifest at `manifest_path`.
+
+        If `index_path` is given, the manifest is memory-mapped, and the index is loaded from there
+        or, if it's missing or stale, built and saved there. Otherwise, the manifest is read into memory
+        and the index is built.
+        """
+        with open(manifest_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if index_path is None:
+                data = f.read()
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+
+        validity = {'manifest_size': st.st_size, 'manifest_mtime_ns': st.st_mtime_ns}
+        if index_path is not None:
+            try:
+                return cls(data, *_read_index(index_path, validity))
+            except (OSError, ValueError, KeyError):
+                pass
+
+        meta, keys, line_offsets, flags = _build_index(data)
+        if index_path is not None:
+            try:
+                _write_index(index_path, validity, meta, keys, line_offsets, flags)
+            except OSError:
+                logger.debug("Failed to write manifest index to %s", index_path, exc_info=True)
+        return cls(data, meta, keys, line_offsets, flags)
+
+    def is_dir(self, i: int) -> bool:
+        return self._flags[i] == _DIR_ROW
+
+    def _line(self, i: int) -> bytes:
+        start = self._line_offsets[i]
+        end = self._data.find(b'\n', start)
+        return self._data[start : None if end == -1 else end]
+
+    def record(self, i: int) -> dict:
+        """Returns row `i` as it appears in a JSONL manifest."""
+        obj = self._decode(self._line(i).decode())
+        if self.is_dir(i):
+            return {'logical_key': self.logical_key(i), 'meta': obj['meta']}
+        return obj
+
+    def meta_at(self, i: int) -> dict:
+        return self.record(i)['meta']
+
+
+def _build_index(data):
+    header_end = data.find(b'\n')
+    if header_end == -1:
+        header_end = len(data)
+    meta = json.loads(data[:header_end])
+    meta.pop('top_hash', None)  # Obsolete as of PR #130
+
+    keys = PackedBytes()
+    line_offsets = array('q')
+    flags = bytearray()
+    is_sorted = True
+    last_tree_key = b''
+    for m in _LINE_RE.finditer(data, header_end + 1):
+        start, stop = m.span()
+        if start == stop:
+            continue
+        key, has_physical_keys = m.groups()
+        flag = 0
+        if key is None or has_physical_keys is None:
+            obj = json.loads(data[start:stop])
+            logical_key = obj['logical_key']
+            if obj.get('physical_keys', None):
+                key = logical_key.encode()
+            else:
+                # Directory-level metadata. Like `Package._load()`, the last segment of the key is ignored.
+                dir_key, sep, _ = logical_key.rpartition('/')
+                if not sep:
+                    meta['user_meta'] = obj['meta']
+                    continue
+                key = (dir_key + '/').encode()
+                flag = _DIR_ROW
+        tk = key.replace(b'/', b'\x00')
+        if tk < last_tree_key:
+            is_sorted = False
+        last_tree_key = tk
+        keys.append(key)
+        line_offsets.append(start)
+        flags.append(flag)
+
+    def reorder(order):
+        return keys.permuted(order), array('q', (line_offsets[i] for i in order)), bytearray(flags[i] for i in order)
+
+    if not is_sorted:
+        index = ManifestIndex(data, meta, keys, line_offsets, flags)
+        keys, line_offsets, flags = reorder(sorted(range(len(index)), key=index._tree_key_at))
+    drop = _find_redundant_rows(ManifestIndex(data, meta, keys, line_offsets, flags))
+    if drop:
+        dropped = set(drop)
+        keys, line_offsets, flags = reorder([i for i in range(len(line_offsets)) if i not in dropped])
+    keys.freeze()
+    return meta, keys, line_offsets, bytes(flags)
+
+
+def _write_index(path, validity, meta, keys, line_offsets, flags):
+    header = json.dumps(
+        {
+            'version': INDEX_FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'count': len(line_offsets),
+            'keys_size': len(keys.data),
+            'meta': meta,
+            **validity,
+        }
+    ).encode()
+    header += b' ' * _pad(len(header))
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(_INDEX_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        f.write(line_offsets.tobytes())
+        f.write(keys.offsets.tobytes())
+        f.write(flags)
+        f.write(b'\0' * _pad(len(flags)))
+        f.write(keys.data)
+    os.replace(tmp_path, path)
+
+
+def _read_index(path, validity):
+    with open(path, 'rb') as f:
+        if f.read(len(_INDEX_MAGIC)) != _INDEX_MAGIC:
+            raise ValueError("Not a manifest index")
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+        if (
+            header['version'] != INDEX_FORMAT_VERSION
+            or header['byteorder'] != sys.byteorder
+            or any(header[k] != v for k, v in validity.items())
+        ):
+            raise ValueError("Stale manifest index")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    count = header['count']
+    pos = len(_INDEX_MAGIC) + 8 + header_size
+    sections = {}
+    for name, size in (
+        ('line_offsets', 8 * count),
+        ('key_offsets', 8 * (count + 1)),
+        ('flags', count + _pad(count)),
+        ('keys', header['keys_size']),
+    ):
+        sections[name] = memoryview(mm)[pos : pos + size]
+        pos += size
+    if pos != len(mm):
+        raise ValueError("Truncated manifest index")
+
+    keys = PackedBytes(sections['keys'], sections['key_offsets'].cast('q'))
+    return header['meta'], keys, sections['line_offsets'].cast('q'), sections['flags'][:count]
+
+
+def _iter_entry_lines(file, name):
+    """
+    Yields `(tree_key, logical_key, line)` for the entry rows of a JSONL manifest opened in binary mode,
+    skipping package and directory-level metadata rows.
+
+    Raises `PackageException` if entries aren't in walk order, as written by `Package.dump()`.
+    """
+    file.readline()  # Package metadata.
+    last_tree_key = None
+    for line in file:
+        key, has_physical_keys = _LINE_RE.match(line).groups()
+        if key is None or has_physical_keys is None:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if not obj.get('physical_keys', None):
+                continue
+            key = obj['logical_key'].encode()
+        tk = key.replace(b'/', b'\x00')
+        if last_tree_key is not None and tk <= last_tree_key:
+            raise PackageException(
+                f"Entries of {name} are not sorted by logical key, so it can't be diffed without loading it. "
+                "Use Package.diff() instead."
+            )
+        last_tree_key = tk
+        yield tk, key, line
+
+
+def _entries_differ(line_a: bytes, line_b: bytes) -> bool:
+    # Same as `PackageEntry.__eq__()`: physical keys aren't compared.
+    if line_a.rstrip() == line_b.rstrip():
+        return False
+    a = json.loads(line_a)
+    b = json.loads(line_b)
+    return a['size'] != b['size'] or a['hash'] != b['hash'] or a['meta'] != b['meta']
+
+
+def diff_manifests(file_a, file_b, names=('manifest A', 'manifest B')):
+    """
+    Compares entries of two JSONL manifests opened in binary mode with a sorted merge,
+    reading each one line by line, so memory use doesn't depend on the size of the manifests.
+
+    Yields `('added' | 'modified' | 'deleted', logical_key)` in walk order of logical keys,
+    where added entries are only present in `file_b` and deleted ones only in `file_a`.
+    """
+    entries_a = _iter_entry_lines(file_a, names[0])
+    entries_b = _iter_entry_lines(file_b, names[1])
+    a = next(entries_a, None)
+    b = next(entries_b, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield 'deleted', a[1].decode()
+            a = next(entries_a, None)
+        elif a is None or b[0] < a[0]:
+            yield 'added', b[1].decode()
+            b = next(entries_b, None)
+        else:
+            if _entries_differ(a[2], b[2]):
+                yield 'modified', a[1].decode()
+            a = next(entries_a, None)
+            b = next(entries_b, None)
@@ -2,12 +2,13 @@ import contextlib
 import functools
 import gc
 import hashlib
-import io
+import itertools
 import json
 import logging
 import os
 import pathlib
 import shutil
+import stat
 import sys
 import tempfile
 import textwrap
@@ -21,7 +22,7 @@ import botocore.exceptions
 import jsonlines
 from tqdm import tqdm
 
-from . import checksums, util, workflows
+from . import cache, checksums, util, workflows
 from .backends import get_package_registry
 from .data_transfer import (
     FileChecksumTask,
@@ -30,14 +31,18 @@ from .data_transfer import (
     copy_file_list,
     get_bytes,
     get_size_and_version,
+    get_sizes_and_versions,
+    iter_object_versions,
+    iter_objects,
     legacy_calculate_checksum,
-    list_object_versions,
-    list_objects,
     list_url,
+    open_writer,
     put_bytes,
+    scan_local_dir,
 )
 from .exceptions import PackageException
 from .formats import CompressionRegistry, FormatRegistry
+from .manifest import ManifestIndex, ManifestTable, diff_manifests, entry_arrow_schema
 from .telemetry import ApiTelemetry
 from .util import (
     CACHE_PATH,
@@ -52,7 +57,7 @@ from .util import (
     fix_url,
     get_from_config,
     get_install_location,
-    quiltignore_filter,
+    quiltignore_matcher,
     user_is_configured_to_custom_stack,
     validate_key,
     validate_package_name,
@@ -70,6 +75,9 @@ MANIFEST_MAX_RECORD_SIZE = util.get_pos_int_from_env('QUILT_MANIFEST_MAX_RECORD_
 if MANIFEST_MAX_RECORD_SIZE is None:
     MANIFEST_MAX_RECORD_SIZE = DEFAULT_MANIFEST_MAX_RECORD_SIZE
 
+# The content cache is disabled unless its maximum size is set, see `ContentCache`.
+CONTENT_CACHE_MAX_SIZE = util.get_pos_int_from_env('QUILT_CONTENT_CACHE_MAX_SIZE') or 0
+
 
 SUPPORTED_HASH_TYPES = (
     checksums.SHA256_HASH_NAME,
@@ -109,6 +117,129 @@ def _filesystem_safe_encode(key):
     return hashlib.sha256(key.encode()).hexdigest()
 
 
+@contextlib.contextmanager
+def _local_manifest(pkg_manifest):
+    """
+    Yields the path of a local copy of the manifest at `pkg_manifest`, downloading it
+    to the cache, or to a temporary file removed on exit if the cache is disabled.
+    """
+
+    def download_manifest(dst):
+        copy_file(pkg_manifest, PhysicalKey.from_path(dst), message="Downloading manifest")
+
+    if pkg_manifest.is_local():
+        yield pkg_manifest.path
+    elif util.IS_CACHE_ENABLED:
+        local_pkg_manifest = CACHE_PATH / "manifest" / _filesystem_safe_encode(str(pkg_manifest))
+        if not local_pkg_manifest.exists():
+            # Copy to a temporary file first, to make sure we don't cache a truncated file
+            # if the download gets interrupted.
+            tmp_path = local_pkg_manifest.with_suffix('.tmp')
+            download_manifest(tmp_path)
+            tmp_path.rename(local_pkg_manifest)
+        yield local_pkg_manifest
+    else:
+        # This tmp file has to closed before downloading, because on Windows it can't be
+        # opened for concurrent access.
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            local_pkg_manifest = tmp_file.name
+        try:
+            download_manifest(local_pkg_manifest)
+            yield local_pkg_manifest
+        finally:
+            os.unlink(local_pkg_manifest)
+
+
+MANIFEST_READ_CHUNK_SIZE = 1024 * 1024
+# Browsed manifests at least this large are also cached in a binary form,
+# which is memory-mapped instead of parsing JSONL again, see `Package._from_cached_table()`.
+MANIFEST_ARROW_CACHE_MIN_SIZE = 16 * 1024 * 1024
+
+_top_hash_json_encode = json.JSONEncoder(sort_keys=True, separators=(',', ':')).encode
+
+
+def _encode_top_hash_part(logical_key, entry) -> bytes:
+    if entry.hash is None or entry.size is None:
+        raise QuiltException("PackageEntry missing hash and/or size: %r" % entry.physical_key)
+    return _top_hash_json_encode(
+        {
+            'hash': entry.hash,
+            'logical_key': logical_key,
+            'meta': entry._meta,
+            'size': entry.size,
+        }
+    ).encode()
+
+
+_arrow_meta_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def _arrow_row(logical_key, entry) -> dict:
+    """Converts an entry to a row of `Package.to_arrow()`, the same way `ManifestTable` does."""
+    hash_obj = entry.hash
+    if hash_obj is None:
+        hash_type = hash_value = None
+    elif (
+        isinstance(hash_obj, dict)
+        and hash_obj.keys() == {'type', 'value'}
+        and isinstance(hash_obj['type'], str)
+        and isinstance(hash_obj['value'], str)
+    ):
+        hash_type, hash_value = hash_obj['type'], hash_obj['value']
+    else:
+        hash_type, hash_value = None, json.dumps(hash_obj)
+    meta = entry._meta
+    return {
+        'logical_key': logical_key,
+        'physical_key': str(entry.physical_key),
+        'size': entry.size,
+        'hash_type': hash_type,
+        'hash_value': hash_value,
+        'meta': _arrow_meta_encode(meta) if meta else None,
+    }
+
+
+def _get_remaining_size(readable_file) -> int | None:
+    """
+    Returns the number of bytes left to read from `readable_file` if it's backed by a regular file,
+    `None` otherwise (pipes, sockets, HTTP response bodies, in-memory buffers, etc.).
+    """
+    try:
+        st = os.fstat(readable_file.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return max(st.st_size - readable_file.tell(), 0)
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is a subclass of both OSError and ValueError.
+        return None
+
+
+def _iter_manifest_lines(readable_file, on_read: T.Callable[[int], T.Any]):
+    """
+    Yields lines (without line terminators) from a text or binary file-like object in a single pass,
+    reporting the amount of data consumed to `on_read`. Doesn't require the file to be seekable,
+    so it works with pipes and streaming HTTP bodies such as boto3's `StreamingBody`.
+    """
+    read = getattr(readable_file, 'read', None)
+    if read is None:
+        # Plain iterable of lines.
+        for line in readable_file:
+            on_read(len(line))
+            yield line
+        return
+
+    tail = None
+    while chunk := read(MANIFEST_READ_CHUNK_SIZE):
+        on_read(len(chunk))
+        lines = chunk.split('\n' if isinstance(chunk, str) else b'\n')
+        if tail:
+            lines[0] = tail + lines[0]
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
 def _check_hash_type_support(hash_type: str) -> None:
     if hash_type not in SUPPORTED_HASH_TYPES:
         raise QuiltException(
@@ -119,51 +250,477 @@ def _check_hash_type_support(hash_type: str) -> None:
 
 
 class ObjectPathCache:
+    """
+    Local paths of downloaded objects, keyed by object URL, in the cache database.
+
+    A path is only returned while the device, inode and modification time of the file are unchanged.
+    """
+
+    # Cache paths whose per-URL JSON files of older versions were imported by this process.
+    _migrated: T.ClassVar[set] = set()
+
+    @classmethod
+    def _legacy_cache_files(cls):
+        for cache_dir in CACHE_PATH.glob('[0-9a-f][0-9a-f]'):
+            for cache_file in cache_dir.iterdir():
+                if len(cache_file.name) == 62:
+                    yield cache_file
+
     @classmethod
-    def _cache_path(cls, url):
-        url_hash = _filesystem_safe_encode(url)
-        return CACHE_PATH / url_hash[0:2] / url_hash[2:]
+    def _migrate(cls, db):
+        """Imports paths cached as a JSON file per URL by older versions, then removes those files."""
+        if CACHE_PATH in cls._migrated:
+            return
+        with db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM migration WHERE name = 'object_path_files'").fetchone() is None:
+                legacy_files = list(cls._legacy_cache_files())
+                rows = []
+                for cache_file in legacy_files:
+                    try:
+                        with open(cache_file, encoding='utf-8') as fd:
+                            path, dev, ino, mtime = json.load(fd)
+                    except (OSError, TypeError, ValueError):
+                        continue
+                    rows.append((cache_file.parent.name + cache_file.name, path, dev, ino, mtime))
+                conn.executemany('INSERT OR IGNORE INTO object_path VALUES (?, ?, ?, ?, ?)', rows)
+                conn.execute("INSERT INTO migration VALUES ('object_path_files')")
+            else:
+                legacy_files = []
+        for cache_file in legacy_files:
+            with contextlib.suppress(OSError):
+                cache_file.unlink()
+        for cache_dir in {cache_file.parent for cache_file in legacy_files}:
+            with contextlib.suppress(OSError):
+                cache_dir.rmdir()
+        cls._migrated.add(CACHE_PATH)
 
     @classmethod
     def get(cls, url):
-        cache_path = cls._cache_path(url)
-        try:
-            with open(cache_path, encoding='utf-8') as fd:
-                path, dev, ino, mtime = json.load(fd)
-        except (FileNotFoundError, ValueError):
-            return None
+        return cls.get_many([url]).get(url)
 
+    @classmethod
+    def get_many(cls, urls):
+        """
+        Returns a dict of cached paths of `urls`, which only includes the URLs with a valid cache entry.
+        """
+        keys = {_filesystem_safe_encode(url): url for url in urls}
+        rows = []
         try:
-            stat = pathlib.Path(path).stat()
-        except FileNotFoundError:
-            return None
+            db = cache.connection(CACHE_PATH)
+            cls._migrate(db)
+            for chunk in cache.chunked(list(keys)):
+                rows += db.query(
+                    'SELECT key, path, dev, ino, mtime_ns FROM object_path WHERE key IN (%s)'
+                    % ', '.join('?' * len(chunk)),
+                    chunk,
+                )
+        except cache.ERRORS as e:
+            logger.debug("Failed to read object path cache: %s", e)
 
-        # check if device, file, and timestamp are unchanged => cache hit
-        # see also https://docs.python.org/3/library/os.html#os.stat_result
-        if stat.st_dev == dev and stat.st_ino == ino and stat.st_mtime_ns == mtime:
-            return path
-        else:
-            return None
+        results = {}
+        for key, path, dev, ino, mtime in rows:
+            try:
+                stat = pathlib.Path(path).stat()
+            except FileNotFoundError:
+                continue
+            # check if device, file, and timestamp are unchanged => cache hit
+            # see also https://docs.python.org/3/library/os.html#os.stat_result
+            if stat.st_dev == dev and stat.st_ino == ino and stat.st_mtime_ns == mtime:
+                results[keys[key]] = path
+        return results
 
     @classmethod
     def set(cls, url, path):
-        stat = pathlib.Path(path).stat()
-        cache_path = cls._cache_path(url)
-        cache_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(cache_path, 'w', encoding='utf-8') as fd:
-            json.dump([path, stat.st_dev, stat.st_ino, stat.st_mtime_ns], fd)
+        cls.set_many([(url, path)])
+
+    @classmethod
+    def set_many(cls, items):
+        """
+        Caches paths of URLs, given as `(url, path)` pairs.
+        """
+        rows = []
+        for url, path in items:
+            stat = pathlib.Path(path).stat()
+            rows.append((_filesystem_safe_encode(url), path, stat.st_dev, stat.st_ino, stat.st_mtime_ns))
+        if not rows:
+            return
+        try:
+            db = cache.connection(CACHE_PATH)
+            cls._migrate(db)
+            with db.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO object_path VALUES (?, ?, ?, ?, ?)', rows)
+        except cache.ERRORS as e:
+            logger.debug("Failed to write object path cache: %s", e)
 
     @classmethod
     def clear(cls):
+        cache.close(CACHE_PATH)
         shutil.rmtree(CACHE_PATH)
 
 
+class ContentCache:
+    """
+    Local copies of objects keyed by their hash, shared by all packages, in the cache database.
+
+    The cache is only used if `CONTENT_CACHE_MAX_SIZE` is set. Objects are hard-linked into the cache
+    from where they were installed, and not cached if that's not possible, so the cache takes no extra
+    disk space. Like `ObjectPathCache`, an object is only used while the device, inode, size
+    and modification time of its file are unchanged, so modifying an installed file in place
+    invalidates it. The least recently used objects are removed when the total size
+    exceeds `CONTENT_CACHE_MAX_SIZE`.
+    """
+
+    @staticmethod
+    def _path(key):
+        hash_type, hash_value = key
+        value_hash = _filesystem_safe_encode(hash_value)
+        return CACHE_PATH / 'objects' / _filesystem_safe_encode(hash_type)[:8] / value_hash[0:2] / value_hash[2:]
+
+    @classmethod
+    def get(cls, key):
+        return cls.get_many([key]).get(key)
+
+    @classmethod
+    def get_many(cls, keys):
+        """
+        Returns a dict of cached paths of objects with hashes in `keys`, given as `(hash type, hash value)`.
+        """
+        if not CONTENT_CACHE_MAX_SIZE:
+            return {}
+        keys = list(dict.fromkeys(keys))
+        rows = []
+        try:
+            db = cache.connection(CACHE_PATH)
+            for chunk in cache.chunked(keys, cache.MAX_PARAMS // 2):
+                rows += db.query(
+                    'SELECT hash_type, hash_value, size, dev, ino, mtime_ns FROM content WHERE %s'
+                    % ' OR '.join(['(hash_type = ? AND hash_value = ?)'] * len(chunk)),
+                    [v for key in chunk for v in key],
+                )
+        except cache.ERRORS as e:
+            logger.debug("Failed to read content cache: %s", e)
+            return {}
+
+        results = {}
+        stale = []
+        for hash_type, hash_value, size, dev, ino, mtime in rows:
+            key = (hash_type, hash_value)
+            path = cls._path(key)
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stale.append(key)
+                continue
+            if (stat.st_size, stat.st_dev, stat.st_ino, stat.st_mtime_ns) == (size, dev, ino, mtime):
+                results[key] = str(path)
+            else:
+                stale.append(key)
+
+        if results or stale:
+            try:
+                with db.transaction() as conn:
+                    conn.executemany(
+                        'UPDATE content SET last_access = ? WHERE hash_type = ? AND hash_value = ?',
+                        [(time.time_ns(), *key) for key in results],
+                    )
+                    cls._remove_rows(conn, stale)
+            except cache.ERRORS as e:
+                logger.debug("Failed to write content cache: %s", e)
+            else:
+                cls._remove_files(stale)
+        return results
+
+    @classmethod
+    def add_many(cls, items, *, verified=False):
+        """
+        Adds local files to the cache, given as `(key, path)` pairs, then removes the least recently used
+        objects if the cache is too big.
+
+        Unless `verified` is set, files are hashed first and skipped if they don't match their key.
+        Files that are already cached or can't be hard-linked are skipped, and so are files after
+        the total size of the added ones would exceed the size of the cache.
+        """
+        if not CONTENT_CACHE_MAX_SIZE:
+            return
+        items = dict(items)
+        cached = cls.get_many(items)
+        candidates = {}
+        total_size = 0
+        for key, path in items.items():
+            if key in cached:
+                continue
+            size = os.stat(path).st_size
+            if total_size + size > CONTENT_CACHE_MAX_SIZE:
+                break
+            candidates[key] = path
+            total_size += size
+
+        rows = []
+        for key, path in candidates.items() if verified else _matching_local_files(candidates.items()):
+            cache_path = cls._path(key)
+            tmp_path = cache_path.with_name(f'{cache_path.name}.{uuid.uuid4().hex}')
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                os.link(path, tmp_path)
+                os.replace(tmp_path, cache_path)
+                stat = cache_path.stat()
+            except OSError as e:
+                # Different filesystems, no support for hard links, or an unusable cache directory.
+                logger.debug("Failed to add %s to content cache: %s", path, e)
+                with contextlib.suppress(OSError):
+                    tmp_path.unlink()
+                continue
+            rows.append((*key, stat.st_size, stat.st_dev, stat.st_ino, stat.st_mtime_ns, time.time_ns()))
+        if not rows:
+            return
+        try:
+            with cache.connection(CACHE_PATH).transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                evicted = cls._evict(conn, CONTENT_CACHE_MAX_SIZE)
+        except cache.ERRORS as e:
+            logger.debug("Failed to write content cache: %s", e)
+            return
+        cls._remove_files(evicted)
+
+    @staticmethod
+    def _remove_rows(conn, keys):
+        conn.executemany('DELETE FROM content WHERE hash_type = ? AND hash_value = ?', keys)
+
+    @classmethod
+    def _remove_files(cls, keys):
+        for key in keys:
+            with contextlib.suppress(FileNotFoundError):
+                cls._path(key).unlink()
+
+    @classmethod
+    def _evict(cls, conn, max_size):
+        """Removes the rows of the least recently used objects and returns their keys."""
+        (total_size,) = conn.execute('SELECT coalesce(sum(size), 0) FROM content').fetchone()
+        evicted = []
+        for hash_type, hash_value, size in conn.execute(
+            'SELECT hash_type, hash_value, size FROM content ORDER BY last_access'
+        ).fetchall():
+            if total_size <= max_size:
+                break
+            evicted.append((hash_type, hash_value))
+            total_size -= size
+        cls._remove_rows(conn, evicted)
+        return evicted
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns the number of cached objects and their total size.
+        """
+        [(count, size)] = cache.connection(CACHE_PATH).query('SELECT count(*), coalesce(sum(size), 0) FROM content')
+        return count, size
+
+    @classmethod
+    def prune(cls, max_size=0):
+        """
+        Removes the least recently used objects until the cache is no bigger than `max_size`,
+        and returns the number of removed objects.
+        """
+        with cache.connection(CACHE_PATH).transaction() as conn:
+            evicted = cls._evict(conn, max_size)
+        cls._remove_files(evicted)
+        return len(evicted)
+
+
+def _matching_local_files(files):
+    """
+    Returns the set of `(key, path)` pairs in `files` whose local file at `path` matches `key`,
+    a `(hash type, hash value)` pair.
+    """
+    checksum_tasks = {}
+    legacy_files = {}
+    for key, path in files:
+        hash_type, _ = key
+        if hash_type == checksums.SHA256_HASH_NAME:
+            legacy_files[key, path] = PhysicalKey.from_path(path)
+        elif hash_type in SUPPORTED_HASH_TYPES:
+            checksum_tasks[key, path] = FileChecksumTask.create(
+                PhysicalKey.from_path(path), os.stat(path).st_size, hash_type
+            )
+
+    results = zip(checksum_tasks, calculate_multipart_checksum(list(checksum_tasks.values())), strict=True)
+    if legacy_files:
+        legacy_results = legacy_calculate_checksum(
+            list(legacy_files.values()), [os.stat(pk.path).st_size for pk in legacy_files.values()]
+        )
+        results = itertools.chain(results, zip(legacy_files, legacy_results, strict=True))
+    return {(key, path) for (key, path), checksum in results if checksum == key[1]}
+
+
+def _print_summary(msg):
+    """Prints `msg`, or only logs it if stdout is minimized with `QUILT_MINIMIZE_STDOUT`."""
+    if DISABLE_TQDM:
+        logger.info(msg)
+    else:
+        print(msg)
+
+
+def _skip_unchanged_entries(entries, dest):
+    """
+    Returns `(logical_key, entry)` pairs whose files under `dest` are missing or don't match
+    their size and hash, and prints the number and size of the others.
+    """
+    candidates = {}
+    for logical_key, entry in entries:
+        path = dest.join(logical_key).path
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            continue
+        if entry.hash is not None and stat.S_ISREG(file_stat.st_mode) and file_stat.st_size == entry.size:
+            candidates[logical_key] = (_content_key(entry), path)
+
+    unchanged = _matching_local_files(candidates.values())
+    changed = []
+    skipped_size = 0
+    for logical_key, entry in entries:
+        if candidates.get(logical_key) in unchanged:
+            skipped_size += entry.size
+        else:
+            changed.append((logical_key, entry))
+    _print_summary(f"Skipped {len(entries) - len(changed)} unchanged objects ({skipped_size} B)")
+    return changed
+
+
+def _delete_extra_files(dest, logical_keys):
+    """
+    Deletes files under `dest` whose logical keys aren't in `logical_keys`, and directories left empty.
+    """
+    if not pathlib.Path(dest.path).is_dir():
+        return
+    deleted = 0
+    parents = set()
+    for logical_key, _ in list(list_url(dest)):
+        if logical_key not in logical_keys:
+            path = pathlib.Path(dest.join(logical_key).path)
+            path.unlink()
+            deleted += 1
+            parents.update(path.parents[: logical_key.count('/')])
+    for parent in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+        with contextlib.suppress(OSError):
+            parent.rmdir()
+    _print_summary(f"Deleted {deleted} files that are not in the package")
+
+
+def _known_checksum(entry):
+    """Returns the `sha2-256-chunked` checksum of the entry, if it's known."""
+    if entry.hash is None or entry.hash['type'] != checksums.SHA256_CHUNKED_HASH_NAME:
+        return None
+    return entry.hash['value']
+
+
+def _content_key(entry):
+    return None if entry.hash is None else (entry.hash['type'], entry.hash['value'])
+
+
+def _copy_entries(entries, dest, message, *, incremental=False, delete_extra=False):
+    """
+    Copies `(logical_key, entry)` pairs to `dest`, using the local caches where possible.
+
+    Objects with the same hash are only downloaded once, and then copied locally.
+    Downloaded objects are added to the caches.
+    See `Package.install()` for `incremental` and `delete_extra`.
+    """
+    if incremental or delete_extra:
+        if not dest.is_local():
+            raise QuiltException("'incremental' and 'delete_extra' require a local destination.")
+        entries = list(entries)
+        logical_keys = {logical_key for logical_key, _ in entries}
+        if incremental:
+            entries = _skip_unchanged_entries(entries, dest)
+
+    file_list = []
+    # Objects to copy locally once downloaded, as (hash, URL, destination, size).
+    duplicates = []
+    # Destinations of objects being downloaded, by hash.
+    downloads = {}
+
+    entries = iter(entries)
+    while batch := list(itertools.islice(entries, cache.MAX_PARAMS)):
+        cached_files = cached_objects = {}
+        if util.IS_CACHE_ENABLED:
+            # Try a local cache.
+            remote_entries = [entry for _, entry in batch if not entry.physical_key.is_local()]
+            cached_files = ObjectPathCache.get_many(str(entry.physical_key) for entry in remote_entries)
+            cached_objects = ContentCache.get_many(
+                _content_key(entry)
+                for entry in remote_entries
+                if entry.hash is not None and str(entry.physical_key) not in cached_files
+            )
+        for logical_key, entry in batch:
+            physical_key = entry.physical_key
+            new_physical_key = dest.join(logical_key)
+            if not physical_key.is_local():
+                key = _content_key(entry)
+                cached_file = cached_files.get(str(physical_key)) or cached_objects.get(key)
+                if cached_file is not None:
+                    physical_key = PhysicalKey.from_path(cached_file)
+                elif key is not None and new_physical_key.is_local():
+                    if key in downloads:
+                        duplicates.append((key, physical_key, new_physical_key, entry.size))
+                        continue
+                    downloads[key] = new_physical_key
+
+            if physical_key != new_physical_key:
+                file_list.append((physical_key, new_physical_key, entry.size))
+
+    def _copy(file_list, message):
+        downloaded = []
+
+        def _maybe_add_to_cache(old: PhysicalKey, new: PhysicalKey, _):
+            if not old.is_local() and new.is_local():
+                downloaded.append((str(old), new.path))
+
+        try:
+            copy_file_list(
+                file_list,
+                callback=_maybe_add_to_cache if util.IS_CACHE_ENABLED else None,
+                message=message,
+            )
+        finally:
+            # Objects downloaded before a failure are cached too.
+            if downloaded:
+                ObjectPathCache.set_many(downloaded)
+
+    _copy(file_list, message)
+
+    # Hashes in the manifest are trusted only after checking the downloaded files, which are hashed
+    # once for both the content cache and the copies of duplicate objects.
+    use_content_cache = util.IS_CACHE_ENABLED and CONTENT_CACHE_MAX_SIZE
+    to_verify = downloads.keys() if use_content_cache else {key for key, *_ in duplicates}
+    verified = set()
+    if to_verify:
+        verified = {key for key, _ in _matching_local_files([(key, downloads[key].path) for key in to_verify])}
+    if use_content_cache and verified:
+        ContentCache.add_many(((key, downloads[key].path) for key in verified), verified=True)
+
+    if duplicates:
+        _copy(
+            [(downloads[key] if key in verified else old, new, size) for key, old, new, size in duplicates],
+            "Copying duplicate objects",
+        )
+        if util.IS_CACHE_ENABLED:
+            ObjectPathCache.set_many((str(old), new.path) for key, old, new, _ in duplicates if key in verified)
+
+    if delete_extra:
+        _delete_extra_files(dest, logical_keys)
+
+
 class PackageEntry:
     """
     Represents an entry at a logical key inside a package.
     """
 
-    __slots__ = ('physical_key', 'size', 'hash', '_meta')
+    __slots__ = ('physical_key', '_size', '_hash', '_meta', '_top_hash_part')
+
+    # Bumped whenever an entry changes after its top hash part was serialized,
+    # which invalidates the cached top hash segments of all packages.
+    _top_hash_version = 0
 
     def __init__(self, physical_key, size, hash_obj, meta):
         """
@@ -181,9 +738,46 @@ class PackageEntry:
         """
         assert isinstance(physical_key, PhysicalKey)
         self.physical_key = physical_key
-        self.size = size
-        self.hash = hash_obj
+        self._size = size
+        self._hash = hash_obj
         self._meta = meta or {}
+        self._top_hash_part = None
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        self._size = size
+        self._invalidate_top_hash_part()
+
+    @property
+    def hash(self):
+        return self._hash
+
+    @hash.setter
+    def hash(self, hash_obj):
+        self._hash = hash_obj
+        self._invalidate_top_hash_part()
+
+    def _invalidate_top_hash_part(self):
+        if self._top_hash_part is not None:
+            self._top_hash_part = None
+            PackageEntry._top_hash_version += 1
+
+    def _get_top_hash_part(self, logical_key) -> bytes:
+        """
+        Returns the serialized contribution of this entry to the top hash when placed at `logical_key`.
+
+        Parts of entries with metadata are not cached because metadata can be mutated in place.
+        """
+        if self._meta:
+            return _encode_top_hash_part(logical_key, self)
+        part = self._top_hash_part
+        if part is None or part[0] != logical_key:
+            part = self._top_hash_part = (logical_key, _encode_top_hash_part(logical_key, self))
+        return part[1]
 
     def __eq__(self, other):
         return (
@@ -214,6 +808,9 @@ class PackageEntry:
         Sets the user_meta for this PackageEntry.
         """
         self._meta['user_meta'] = meta
+        self._invalidate_top_hash_part()
+        # The dict might be shared with other entries, e.g. created by `with_physical_key()`.
+        PackageEntry._top_hash_version += 1
 
     def _verify_hash(self, read_bytes):
         """
@@ -268,7 +865,10 @@ class PackageEntry:
         Returns a locally cached physical key, if available.
         """
         if util.IS_CACHE_ENABLED and not self.physical_key.is_local():
-            return ObjectPathCache.get(str(self.physical_key))
+            cached_path = ObjectPathCache.get(str(self.physical_key))
+            if cached_path is None and self.hash is not None:
+                cached_path = ContentCache.get(_content_key(self))
+            return cached_path
         return None
 
     def get_bytes(self, use_cache_if_available=True):
@@ -320,7 +920,7 @@ class PackageEntry:
             hash verification fail
             when deserialization metadata is not present
         """
-        data = get_bytes(self.physical_key)
+        data = self.get_bytes()
 
         if func is not None:
             return func(data)
@@ -361,7 +961,8 @@ class PackageEntry:
         else:
             dest = PhysicalKey.from_url(fix_url(dest))
 
-        copy_file(self.physical_key, dest)
+        cached_path = self.get_cached_path()
+        copy_file(self.physical_key if cached_path is None else PhysicalKey.from_path(cached_path), dest)
 
         # return a package reroot package physical keys after the copy operation succeeds
         # see GH#388 for context
@@ -374,7 +975,71 @@ class PackageEntry:
         return self.deserialize(func=func, **kwargs)
 
     def with_physical_key(self, key):
-        return self.__class__(key, self.size, self.hash, self._meta)
+        entry = self.__class__(key, self.size, self.hash, self._meta)
+        # Physical keys are not hashed.
+        entry._top_hash_part = self._top_hash_part
+        return entry
+
+
+class _StoredEntry:
+    """
+    Read-only view of a manifest row, used instead of `PackageEntry` by internal traversals
+    of subtrees that are still backed by a manifest store.
+    """
+
+    __slots__ = ('_record',)
+
+    def __init__(self, record):
+        self._record = record
+
+    @property
+    def physical_key(self):
+        return PhysicalKey.from_url(self._record['physical_keys'][0])
+
+    @property
+    def size(self):
+        return self._record['size']
+
+    @property
+    def hash(self):
+        return self._record['hash']
+
+    @property
+    def _meta(self):
+        return self._record['meta'] or {}
+
+    def _get_top_hash_part(self, logical_key) -> bytes:
+        return _encode_top_hash_part(logical_key, self)
+
+    def as_dict(self):
+        return {
+            'physical_keys': self._record['physical_keys'][:1],
+            'size': self.size,
+            'hash': self.hash,
+            'meta': self._meta,
+        }
+
+
+class _StoredRange(T.NamedTuple):
+    """
+    Rows `lo:hi` of a manifest store, whose logical keys have their first `skip` characters
+    replaced with `prefix` in the package.
+    """
+
+    store: T.Any
+    lo: int
+    hi: int
+    skip: int
+    prefix: str
+
+    def extends(self, other: '_StoredRange') -> bool:
+        """Whether this range directly follows `other`, so both can be read as one."""
+        return (
+            self.store is other.store
+            and self.lo == other.hi
+            and self.skip == other.skip
+            and self.prefix == other.prefix
+        )
 
 
 class ManifestJSONDecoder(json.JSONDecoder):
@@ -398,6 +1063,13 @@ class ManifestJSONDecoder(json.JSONDecoder):
 class Package:
     """In-memory representation of a package"""
 
+    # Manifest store backing this directory level until its children are created, see `_from_store()`.
+    _store = None
+    # `(name, child)` pairs of `_children` in walk order, see `_sorted_items()`.
+    _sorted_children = None
+    # `(prefix, PackageEntry._top_hash_version, segments)`, see `_get_top_hash_segments()`.
+    _top_hash_cache = None
+
     def __init__(self):
         self._children = {}
         self._meta = {'version': 'v0'}
@@ -411,6 +1083,59 @@ class Package:
         """Remember `top_hash` as a revision of `name` that this package is a valid successor to."""
         self._parent_top_hashes.setdefault(name, set()).add(top_hash)
 
+    @classmethod
+    def _from_store(cls, store, lo, hi, prefix):
+        """
+        Creates a directory level backed by rows `lo:hi` of a manifest store, e.g. `ManifestTable`.
+        Its `_children` are only created when accessed; until then, lookups of single keys are
+        answered by the store and create only the objects that were asked for.
+        """
+        pkg = cls()
+        del pkg._children
+        pkg._store = store
+        pkg._store_range = (lo, hi)
+        pkg._store_prefix = prefix
+        pkg._stored_children = {}
+        if lo < hi and store.is_dir(lo) and store.logical_key(lo) == prefix:
+            pkg.set_meta(store.meta_at(lo))
+        return pkg
+
+    def __getattr__(self, name):
+        if name == '_children' and self._store is not None:
+            self._materialize()
+            return self._children
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def _materialize(self):
+        children = {}
+        lo, hi = self._store_range
+        for name, start, stop in self._store.iter_level(lo, hi, self._store_prefix):
+            child = self._stored_children.get(name)
+            if child is None:
+                child = self._create_stored_child(name, start, stop)
+            children[name] = child
+        self._children = children
+        del self._store, self._store_range, self._store_prefix, self._stored_children
+
+    def _create_stored_child(self, name, start, stop):
+        if stop is None:
+            return PackageEntry(*self._store.entry_fields(start))
+        return Package._from_store(self._store, start, stop, f'{self._store_prefix}{name}/')
+
+    def _iter_stored_names(self):
+        lo, hi = self._store_range
+        return (name for name, _, _ in self._store.iter_level(lo, hi, self._store_prefix))
+
+    def _get_stored_child(self, name):
+        child = self._stored_children.get(name)
+        if child is None:
+            found = self._store.find(self._store_prefix + name, *self._store_range)
+            if found is None:
+                raise KeyError(name)
+            start, stop = found if isinstance(found, tuple) else (found, None)
+            child = self._stored_children[name] = self._create_stored_child(name, start, stop)
+        return child
+
     @ApiTelemetry("package.__repr__")
     def __repr__(self, max_lines=20):
         """
@@ -498,7 +1223,18 @@ class Package:
 
     @classmethod
     @ApiTelemetry("package.install")
-    def install(cls, name, registry=None, top_hash=None, dest=None, dest_registry=None, *, path=None):
+    def install(
+        cls,
+        name,
+        registry=None,
+        top_hash=None,
+        dest=None,
+        dest_registry=None,
+        *,
+        path=None,
+        incremental=False,
+        delete_extra=False,
+    ):
         """
         Installs a named package to the local registry and downloads its files.
 
@@ -510,7 +1246,13 @@ class Package:
             dest(str): Local path to download files to.
             dest_registry(str): Registry to install package to. Defaults to local registry.
             path(str): If specified, downloads only `path` or its children.
+            incremental(bool): Skip files that already exist in `dest` with the size and hash of their entries.
+            delete_extra(bool): Delete files in `dest` that are not in the package.
+                Can't be combined with `path`.
         """
+        if path and delete_extra:
+            # Every file in `dest` outside of `path` would be deleted.
+            raise QuiltException("'delete_extra' can't be combined with 'path'.")
         if registry is None:
             registry = get_from_config('default_remote_registry')
             if registry is None:
@@ -545,45 +1287,31 @@ class Package:
         else:
             subpkg_key = None
 
-        pkg = cls._browse(name=name, registry=registry, top_hash=top_hash)
-        message = pkg._meta.get('message', None)  # propagate the package message
-
-        file_list = []
-
-        if subpkg_key is not None:
-            if subpkg_key not in pkg:
-                raise QuiltException(f"Package {name!r} doesn't contain {subpkg_key!r}.")
-            entry = pkg[subpkg_key]
-            entries = entry.walk() if isinstance(entry, Package) else ((subpkg_key.split('/')[-1], entry),)
-        else:
-            entries = pkg.walk()
-        for logical_key, entry in entries:
-            # Copy the datafiles in the package.
-            physical_key = entry.physical_key
-
-            if util.IS_CACHE_ENABLED:
-                # Try a local cache.
-                cached_file = ObjectPathCache.get(str(physical_key))
-                if cached_file is not None:
-                    physical_key = PhysicalKey.from_path(cached_file)
-
-            new_physical_key = dest_parsed.join(logical_key)
-            if physical_key != new_physical_key:
-                file_list.append((physical_key, new_physical_key, entry.size))
-
-        def _maybe_add_to_cache(old: PhysicalKey, new: PhysicalKey, _):
-            if not old.is_local() and new.is_local():
-                ObjectPathCache.set(str(old), new.path)
-
-        copy_file_list(
-            file_list,
-            callback=_maybe_add_to_cache if util.IS_CACHE_ENABLED else None,
-            message="Copying objects",
-        )
-
-        pkg._build(name, registry=dest_registry, message=message)
-        if top_hash is None:
-            top_hash = pkg.top_hash
+        with contextlib.ExitStack() as stack:
+            if subpkg_key is not None:
+                # Only the manifest index and the entries under `path` are loaded.
+                src_registry = get_package_registry(registry)
+                top_hash, src_manifest = cls._resolve_manifest(src_registry, name, top_hash)
+                local_manifest = stack.enter_context(_local_manifest(src_manifest))
+                pkg = cls._from_index(local_manifest, src_manifest)
+                entry = cls._get_path(pkg, name, subpkg_key, lazy=True)
+                entries = entry.walk() if isinstance(entry, Package) else ((subpkg_key.split('/')[-1], entry),)
+            else:
+                pkg = cls._browse(name=name, registry=registry, top_hash=top_hash)
+                message = pkg._meta.get('message', None)  # propagate the package message
+                entries = pkg.walk()
+            _copy_entries(entries, dest_parsed, "Copying objects", incremental=incremental, delete_extra=delete_extra)
+
+            if subpkg_key is not None:
+                # The manifest is copied as is: serializing it again would require decoding all of it.
+                with open(local_manifest, 'rb') as manifest_file:
+                    dest_registry.push_manifest_stream(
+                        name, top_hash, functools.partial(shutil.copyfileobj, manifest_file)
+                    )
+            else:
+                pkg._build(name, registry=dest_registry, message=message)
+                if top_hash is None:
+                    top_hash = pkg.top_hash
         short_top_hash = dest_registry.shorten_top_hash(name, top_hash)
         print(f"Successfully installed package '{name}', tophash={short_top_hash} from {registry}")
 
@@ -602,7 +1330,7 @@ class Package:
 
     @classmethod
     @ApiTelemetry("package.browse")
-    def browse(cls, name, registry=None, top_hash=None):
+    def browse(cls, name, registry=None, top_hash=None, *, compact=False, lazy=False, path=None):
         """
         Load a package into memory from a registry without making a local copy of
         the manifest.
@@ -611,52 +1339,130 @@ class Package:
             name(string): name of package to load
             registry(string): location of registry to load package from
             top_hash(string): top hash of package version to load
-        """
-        return cls._browse(name=name, registry=registry, top_hash=top_hash)
+            compact(bool): keep the manifest in a compact columnar form and only create
+                `PackageEntry` objects for the entries that are accessed.
+                Uses a fraction of the memory for packages with millions of entries.
+                If pyarrow is installed, the parsed manifest is cached, so subsequent browsing of
+                the same package version doesn't parse it again. Large manifests are cached regardless of this option.
+            lazy(bool): don't parse the manifest, but index it by logical key and only decode
+                the entries that are accessed. The index is cached, so subsequent browsing of
+                the same package version returns almost immediately, regardless of its size.
+            path(string): if specified, returns only the directory (or entry) at `path`, same as
+                `Package.browse(...)[path]`. The manifest is indexed as with `lazy`, and only the entries
+                under `path` are decoded, so it takes time proportional to the size of `path`
+                rather than of the package.
+        """
+        return cls._browse(name=name, registry=registry, top_hash=top_hash, compact=compact, lazy=lazy, path=path)
 
     @classmethod
-    def _browse(cls, name, registry=None, top_hash=None):
+    def _browse(cls, name, registry=None, top_hash=None, *, compact=False, lazy=False, path=None):
+        if compact and lazy:
+            raise QuiltException("'compact' and 'lazy' can't be used together.")
+        if compact and path is not None:
+            raise QuiltException("'compact' and 'path' can't be used together.")
         validate_package_name(name)
         registry = get_package_registry(registry)
+        top_hash, pkg_manifest = cls._resolve_manifest(registry, name, top_hash)
+
+        with _local_manifest(pkg_manifest) as local_pkg_manifest:
+            if lazy or path is not None:
+                pkg = cls._from_index(local_pkg_manifest, pkg_manifest)
+            elif util.IS_CACHE_ENABLED and (
+                compact or os.path.getsize(local_pkg_manifest) >= MANIFEST_ARROW_CACHE_MIN_SIZE
+            ):
+                cache_path = CACHE_PATH / "manifest" / f"{_filesystem_safe_encode(str(pkg_manifest))}.arrow"
+                pkg = cls._from_cached_table(local_pkg_manifest, cache_path, str(pkg_manifest), compact=compact)
+            else:
+                pkg = cls._from_path(local_pkg_manifest, compact=compact)
+            pkg._record_revision(name, top_hash)
+        if path is None:
+            return pkg
+        return cls._get_path(pkg, name, path, lazy=lazy)
 
+    @staticmethod
+    def _resolve_manifest(registry, name, top_hash):
+        """
+        Returns the full top hash of package `name` at `top_hash`, or of its latest revision
+        if `top_hash` is None, and the physical key of its manifest.
+        """
         top_hash = (
             get_bytes(registry.pointer_latest_pk(name)).decode()
             if top_hash is None
             else registry.resolve_top_hash(name, top_hash)
         )
-        pkg_manifest = registry.manifest_pk(name, top_hash)
+        return top_hash, registry.manifest_pk(name, top_hash)
 
-        def download_manifest(dst):
-            copy_file(pkg_manifest, PhysicalKey.from_path(dst), message="Downloading manifest")
+    @classmethod
+    def _from_index(cls, path, pkg_manifest):
+        """
+        Returns a package backed by a `ManifestIndex` of the manifest at `path`, which is a local copy of
+        `pkg_manifest`. The index is saved to the cache, if enabled, and reused by subsequent calls.
+        """
+        index_path = None
+        if util.IS_CACHE_ENABLED:
+            index_path = CACHE_PATH / "manifest" / f"{_filesystem_safe_encode(str(pkg_manifest))}.index"
+        index = ManifestIndex.open(path, index_path)
+        pkg = cls._from_store(index, 0, len(index), '')
+        pkg._meta = index.meta
+        return pkg
 
-        with contextlib.ExitStack() as stack:
-            if pkg_manifest.is_local():
-                local_pkg_manifest = pkg_manifest.path
-            elif util.IS_CACHE_ENABLED:
-                local_pkg_manifest = CACHE_PATH / "manifest" / _filesystem_safe_encode(str(pkg_manifest))
-                if not local_pkg_manifest.exists():
-                    # Copy to a temporary file first, to make sure we don't cache a truncated file
-                    # if the download gets interrupted.
-                    tmp_path = local_pkg_manifest.with_suffix('.tmp')
-                    download_manifest(tmp_path)
-                    tmp_path.rename(local_pkg_manifest)
-            else:
-                # This tmp file has to closed before downloading, because on Windows it can't be
-                # opened for concurrent access.
-                with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                    local_pkg_manifest = tmp_file.name
-                    stack.callback(os.unlink, local_pkg_manifest)
-                download_manifest(local_pkg_manifest)
-
-            pkg = cls._from_path(local_pkg_manifest)
-            pkg._record_revision(name, top_hash)
-            return pkg
+    @staticmethod
+    def _get_path(pkg, name, path, *, lazy):
+        """
+        Returns the directory or entry at `path` of `pkg`, which is package `name`.
+        Unless `lazy`, the children of a store-backed directory are created.
+        """
+        validate_key(path)
+        if path not in pkg:
+            raise QuiltException(f"Package {name!r} doesn't contain {path!r}.")
+        subpkg = pkg[path]
+        if not lazy and isinstance(subpkg, Package):
+            # Walking creates the children of every level under `path`.
+            deque(subpkg.walk(), maxlen=0)
+        return subpkg
 
     @classmethod
-    def _from_path(cls, path):
+    def _from_cached_table(cls, path, cache_path, manifest_key, *, compact=False):
+        """
+        Loads a package from the Arrow cache of the manifest at `path`, or from the manifest itself,
+        saving the cache for the next time. Unless `compact`, the children of every level are created
+        from the table, which is still faster than parsing the manifest.
+        Falls back to `_from_path()` if pyarrow isn't installed.
+        """
+        stat_result = os.stat(path)
+        validity = {
+            'manifest': manifest_key,
+            'size': stat_result.st_size,
+            'mtime_ns': stat_result.st_mtime_ns,
+        }
+        try:
+            table = ManifestTable.read_arrow(cache_path, validity)
+        except ImportError:
+            return cls._from_path(path, compact=compact)
+        except FileNotFoundError:
+            table = None
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug("Ignoring manifest cache %s: %s", cache_path, e)
+            table = None
+
+        if table is None:
+            pkg = cls._from_path(path, compact=True)
+            try:
+                pkg._store.write_arrow(cache_path, validity)
+            except OSError as e:
+                logger.warning("Failed to save manifest cache %s: %s", cache_path, e)
+        else:
+            pkg = cls._from_store(table, 0, len(table), '')
+            pkg._meta = table.meta
+        if not compact:
+            deque(pkg.walk(), maxlen=0)
+        return pkg
+
+    @classmethod
+    def _from_path(cls, path, *, compact=False):
         """Takes a path and returns a package loaded from that path"""
-        with open(path, encoding='utf-8') as open_file:
-            pkg = cls._load(open_file)
+        with open(path, 'rb') as open_file:
+            pkg = cls._load(open_file, compact=compact)
         return pkg
 
     @classmethod
@@ -700,38 +1506,45 @@ class Package:
         """
         pkg = self
         for key_fragment in self._split_key(logical_key):
-            pkg = pkg._children[key_fragment]
+            if getattr(pkg, '_store', None) is None:
+                pkg = pkg._children[key_fragment]
+            else:
+                pkg = pkg._get_stored_child(key_fragment)
         return pkg
 
     @ApiTelemetry("package.fetch")
-    def fetch(self, dest='./'):
+    def fetch(self, dest=None, *, incremental=False, delete_extra=False):
         """
         Copy all descendants to `dest`. Descendants are written under their logical
         names _relative_ to self.
 
         Args:
             dest: where to put the files (locally)
+                Defaults to the current directory
+            incremental(bool): Skip files that already exist in `dest` with the size and hash of their entries.
+            delete_extra(bool): Delete files in `dest` that are not in the package.
+                Requires `dest` to be set explicitly.
 
         Returns:
             A new Package object with entries from self, but with physical keys
                 pointing to files in `dest`.
         """
+        if dest is None:
+            if delete_extra:
+                # Every file in the current directory that isn't in the package would be deleted.
+                raise QuiltException("'delete_extra' requires 'dest' to be set.")
+            dest = './'
         nice_dest = PhysicalKey.from_url(fix_url(dest))
-        file_list = []
+        entries = list(self.walk())
         pkg = Package()
 
-        for logical_key, entry in self.walk():
-            physical_key = entry.physical_key
-            new_physical_key = nice_dest.join(logical_key)
-
-            file_list.append((physical_key, new_physical_key, entry.size))
-
+        for logical_key, entry in entries:
             # return a package reroot package physical keys after the copy operation succeeds
             # see GH#388 for context
-            new_entry = entry.with_physical_key(new_physical_key)
+            new_entry = entry.with_physical_key(nice_dest.join(logical_key))
             pkg._set(logical_key, new_entry)
 
-        copy_file_list(file_list, message="Copying objects")
+        _copy_entries(entries, nice_dest, "Copying objects", incremental=incremental, delete_extra=delete_extra)
 
         return pkg
 
@@ -739,39 +1552,147 @@ class Package:
         """
         Returns logical keys in the package.
         """
+        if self._store is not None:
+            return dict.fromkeys(self._iter_stored_names()).keys()
         return self._children.keys()
 
     def __iter__(self):
+        if self._store is not None:
+            return self._iter_stored_names()
         return iter(self._children)
 
     def __len__(self):
+        if self._store is not None:
+            return sum(1 for _ in self._iter_stored_names())
         return len(self._children)
 
+    def _sorted_items(self):
+        """
+        Returns `(name, child)` pairs of this directory level sorted by name.
+
+        The list is kept until the children of this level are changed, so traversals after
+        the first one don't sort every directory again.
+        """
+        items = self._sorted_children
+        if items is None:
+            items = self._sorted_children = sorted(self._children.items())
+        return items
+
+    def _children_changed(self):
+        """Drops what is cached about the children of this directory level."""
+        self._sorted_children = None
+        self._top_hash_cache = None
+
     def walk(self):
         """
         Generator that traverses all entries in the package tree and returns tuples of (key, entry),
         with keys in alphabetical order.
         """
-        for name, child in sorted(self._children.items()):
+        for name, child in self._sorted_items():
             if isinstance(child, PackageEntry):
                 yield name, child
             else:
                 yield from child._walk(f'{name}/')
 
     def _walk(self, prefix):
-        for name, child in sorted(self._children.items()):
+        for name, child in self._sorted_items():
             if isinstance(child, PackageEntry):
                 yield f'{prefix}{name}', child
             else:
                 yield from child._walk(f'{prefix}{name}/')
 
+    def _walk_rows(self, prefix):
+        """
+        Same as `_walk()`, but doesn't create `PackageEntry` objects for subtrees that are
+        still backed by a manifest store, read-only `_StoredEntry` views are yielded instead.
+        """
+        store = self._store
+        if store is None:
+            for name, child in self._sorted_items():
+                if isinstance(child, PackageEntry):
+                    yield f'{prefix}{name}', child
+                else:
+                    yield from child._walk_rows(f'{prefix}{name}/')
+            return
+
+        skip = len(self._store_prefix)
+        lo, hi = self._store_range
+        if not self._stored_children:
+            for i in store.entry_rows(lo, hi):
+                record = store.record(i)
+                yield prefix + record['logical_key'][skip:], _StoredEntry(record)
+            return
+
+        for name, start, stop in store.iter_level(lo, hi, self._store_prefix):
+            child = self._stored_children.get(name)
+            if isinstance(child, PackageEntry):
+                yield f'{prefix}{name}', child
+            elif child is not None:
+                yield from child._walk_rows(f'{prefix}{name}/')
+            elif stop is None:
+                yield f'{prefix}{name}', _StoredEntry(store.record(start))
+            else:
+                for i in store.entry_rows(start, stop):
+                    record = store.record(i)
+                    yield prefix + record['logical_key'][skip:], _StoredEntry(record)
+
+    def _walk_stored_ranges(self, prefix):
+        """
+        Same as `_walk_rows()`, but rows of subtrees that are still backed by a manifest store
+        are yielded as `_StoredRange`s instead of one by one.
+        """
+        store = self._store
+        if store is None:
+            for name, child in self._sorted_items():
+                if isinstance(child, PackageEntry):
+                    yield f'{prefix}{name}', child
+                else:
+                    yield from child._walk_stored_ranges(f'{prefix}{name}/')
+            return
+
+        skip = len(self._store_prefix)
+        lo, hi = self._store_range
+        if not self._stored_children:
+            yield _StoredRange(store, lo, hi, skip, prefix)
+            return
+
+        for name, start, stop in store.iter_level(lo, hi, self._store_prefix):
+            child = self._stored_children.get(name)
+            if isinstance(child, PackageEntry):
+                yield f'{prefix}{name}', child
+            elif child is not None:
+                yield from child._walk_stored_ranges(f'{prefix}{name}/')
+            else:
+                yield _StoredRange(store, start, start + 1 if stop is None else stop, skip, prefix)
+
     def _walk_dir_meta(self):
         """
         Generator that traverses all entries in the package tree and returns
             tuples of (key, meta) for each directory with metadata.
         Keys will all end in '/' to indicate that they are directories.
         """
-        for key, child in sorted(self._children.items()):
+        store = self._store
+        if store is not None:
+            skip = len(self._store_prefix)
+            lo, hi = self._store_range
+            for name, start, stop in store.iter_level(lo, hi, self._store_prefix):
+                if stop is None:
+                    continue
+                child = self._stored_children.get(name)
+                if child is not None:
+                    meta = child.meta
+                    if meta:
+                        yield name + '/', meta
+                    for child_key, child_meta in child._walk_dir_meta():
+                        yield name + '/' + child_key, child_meta
+                    continue
+                for i in store.dir_rows(start, stop):
+                    meta = store.meta_at(i)
+                    if meta:
+                        yield store.logical_key(i)[skip:], meta
+            return
+
+        for key, child in self._sorted_items():
             if isinstance(child, PackageEntry):
                 continue
             meta = child.meta
@@ -780,14 +1701,27 @@ class Package:
             for child_key, child_meta in child._walk_dir_meta():
                 yield key + '/' + child_key, child_meta
 
+    def _walk_into(self, *visitors):
+        """
+        Traverses all entries in the package tree once, in the order of `walk()`,
+        and calls each of `visitors` with `(logical_key, entry)` for every entry.
+
+        Lets code that needs several passes over the entries share a single traversal.
+        """
+        for logical_key, entry in self.walk():
+            for visitor in visitors:
+                visitor(logical_key, entry)
+
     @classmethod
     @ApiTelemetry("package.load")
-    def load(cls, readable_file):
+    def load(cls, readable_file, *, compact=False):
         """
         Loads a package from a readable file-like object.
 
         Args:
             readable_file: readable file-like object to deserialize package from
+            compact(bool): keep the manifest in a compact columnar form and only create
+                `PackageEntry` objects for the entries that are accessed.
 
         Returns:
             A new Package object
@@ -797,56 +1731,66 @@ class Package:
             json decode error
             invalid package exception
         """
-        return cls._load(readable_file=readable_file)
+        return cls._load(readable_file=readable_file, compact=compact)
 
     @classmethod
-    def _load(cls, readable_file):
+    def _load(cls, readable_file, *, compact=False):
         gc.disable()  # Experiments with COCO (650MB manifest) show disabling GC gives us ~2x performance improvement
 
         try:
-            line_count = 0
-            for _ in readable_file:
-                line_count += 1
-            readable_file.seek(0)
-
-            reader = jsonlines.Reader(
-                tqdm(
-                    readable_file,
-                    desc="Loading manifest",
-                    total=line_count,
-                    unit="",
-                    unit_scale=True,
-                    disable=DISABLE_TQDM,
-                    bar_format='{l_bar}{bar}| {n}/{total} [{elapsed}<{remaining}, {rate_fmt}]',
-                ),
-                loads=ManifestJSONDecoder().decode,
-            )
-            meta = reader.read()
-            meta.pop('top_hash', None)  # Obsolete as of PR #130
-            pkg = cls()
-            pkg._meta = meta
-
-            for obj in reader:
-                path = cls._split_key(obj.pop('logical_key'))
-                subpkg = pkg._ensure_subpackage(path[:-1])
-                key = path[-1]
-                if not obj.get('physical_keys', None):
-                    # directory-level metadata
-                    subpkg.set_meta(obj['meta'])
-                    continue
-                if key in subpkg._children:
-                    raise PackageException(f"Duplicate logical key {key!r} while loading package entry: {obj!r}")
-                subpkg._children[key] = PackageEntry(
-                    PhysicalKey.from_url(obj['physical_keys'][0]),
-                    obj['size'],
-                    obj['hash'],
-                    obj['meta'],
+            with tqdm(
+                desc="Loading manifest",
+                total=_get_remaining_size(readable_file),
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+                disable=DISABLE_TQDM,
+            ) as progress:
+                reader = jsonlines.Reader(
+                    _iter_manifest_lines(readable_file, progress.update),
+                    loads=ManifestJSONDecoder().decode,
                 )
+                meta = reader.read()
+                meta.pop('top_hash', None)  # Obsolete as of PR #130
+                if compact:
+                    table = ManifestTable.from_records(meta, reader)
+                    pkg = cls._from_store(table, 0, len(table), '')
+                    pkg._meta = table.meta
+                    return pkg
+
+                pkg = cls()
+                pkg._meta = meta
+
+                for obj in reader:
+                    path = cls._split_key(obj.pop('logical_key'))
+                    subpkg = pkg._ensure_subpackage(path[:-1])
+                    key = path[-1]
+                    if not obj.get('physical_keys', None):
+                        # directory-level metadata
+                        subpkg.set_meta(obj['meta'])
+                        continue
+                    if key in subpkg._children:
+                        raise PackageException(f"Duplicate logical key {key!r} while loading package entry: {obj!r}")
+                    subpkg._children[key] = PackageEntry(
+                        PhysicalKey.from_url(obj['physical_keys'][0]),
+                        obj['size'],
+                        obj['hash'],
+                        obj['meta'],
+                    )
         finally:
             gc.enable()
         return pkg
 
-    def set_dir(self, lkey, path=None, meta=None, update_policy="incoming", unversioned: bool = False):
+    def set_dir(
+        self,
+        lkey,
+        path=None,
+        meta=None,
+        update_policy="incoming",
+        unversioned: bool = False,
+        *,
+        parallel: bool = False,
+    ):
         """
         Adds all files from `path` to the package.
 
@@ -864,6 +1808,9 @@ class Package:
                 If 'existing', whenever logical keys match, retain existing entries
                 and ignore new entries from set_dir.
             unversioned(bool): when True, do not retrieve VersionId for S3 physical keys.
+            parallel(bool): when True, list sub-prefixes of an S3 `path` concurrently,
+                in a pool of `QUILT_TRANSFER_MAX_CONCURRENCY` threads. This takes more requests
+                and connections, but is faster for prefixes with many objects.
 
         Returns:
             self
@@ -896,20 +1843,21 @@ class Package:
             if not src_path.is_dir():
                 raise PackageException(f"The specified directory {src_path!r} doesn't exist")
 
-            files = src_path.rglob('*')
             ignore = src_path / '.quiltignore'
-            if ignore.exists():
-                files = quiltignore_filter(files, ignore, 'file')
-
-            for f in files:
-                if not f.is_file():
-                    continue
-                logical_key = f.relative_to(src_path).as_posix()
-                # check update policy
-                if update_policy == 'existing' and logical_key in root:
-                    continue
-                entry = PackageEntry(PhysicalKey.from_path(f), f.stat().st_size, None, None)
-                root._set(logical_key, entry)
+            ignore = quiltignore_matcher(ignore) if ignore.exists() else None
+
+            # Files are added a directory at a time, file names are always valid logical key segments.
+            for dir_key, files in scan_local_dir(src.path, ignore):
+                pkg = root._ensure_subpackage(dir_key, ensure_no_entry=True)
+                for name, path, size in files:
+                    child = pkg._children.get(name)
+                    # check update policy
+                    if update_policy == 'existing' and child is not None:
+                        continue
+                    if isinstance(child, Package):
+                        raise QuiltException(f"Cannot overwrite directory {name!r} with PackageEntry")
+                    pkg._children[name] = PackageEntry(PhysicalKey(None, path, None), size, None, None)
+                pkg._children_changed()
         else:
             if src.version_id is not None:
                 raise PackageException("Directories cannot have versions")
@@ -917,10 +1865,10 @@ class Package:
             if src.basename() != '':
                 src_path += '/'
             if not unversioned:
-                objects, _ = list_object_versions(src.bucket, src_path)
+                objects = iter_object_versions(src.bucket, src_path, parallel=parallel)
                 objects = filter(lambda obj: obj["IsLatest"], objects)
             else:
-                objects = list_objects(src.bucket, src_path, recursive=True)
+                objects = iter_objects(src.bucket, src_path, parallel=parallel)
 
             for obj in objects:
                 # Skip S3 pseduo directory files and Keys that end in /
@@ -986,7 +1934,11 @@ class Package:
         """
         logger.debug('fix package hashes: started')
 
-        self._incomplete_entries = [entry for key, entry in self.walk() if entry.hash is None]
+        # Views of stored rows are replaced with real entries, so the hashes can be set on them.
+        incomplete = [(key, entry) for key, entry in self._walk_rows('') if entry.hash is None]
+        self._incomplete_entries = [
+            entry if isinstance(entry, PackageEntry) else self[key] for key, entry in incomplete
+        ]
 
         physical_keys = []
         sizes = []
@@ -1039,9 +1991,8 @@ class Package:
         registry_parsed = PhysicalKey.from_url(registry)
         pkg_manifest_file = registry_parsed.join("scratch").join(str(int(time.time())))
 
-        manifest = io.BytesIO()
-        self._dump(manifest)
-        put_bytes(manifest.getvalue(), pkg_manifest_file)
+        with open_writer(pkg_manifest_file) as manifest_file:
+            self._dump(manifest_file)
         return pkg_manifest_file.path
 
     @property
@@ -1090,9 +2041,7 @@ class Package:
         return top_hash
 
     def _push_manifest(self, name, registry, top_hash):
-        manifest = io.BytesIO()
-        self._dump(manifest)
-        registry.push_manifest(name, top_hash, manifest.getvalue())
+        registry.push_manifest_stream(name, top_hash, self._dump)
 
     @ApiTelemetry("package.dump")
     def dump(self, writable_file):
@@ -1143,9 +2092,108 @@ class Package:
         yield self._meta
         for dir_key, meta in self._walk_dir_meta():
             yield {'logical_key': dir_key, 'meta': meta}
-        for logical_key, entry in self.walk():
+        for logical_key, entry in self._walk_rows(''):
             yield {'logical_key': logical_key, **entry.as_dict()}
 
+    @ApiTelemetry("package.to_arrow")
+    def to_arrow(self):
+        """
+        Returns the entries of the package as a `pyarrow.Table`, one row per entry in `walk()` order,
+        with `logical_key`, `physical_key`, `size`, `hash_type`, `hash_value` and `meta` columns.
+        `meta` is JSON-encoded; missing values are null.
+        Package metadata is saved JSON-encoded in the `quilt_meta` key of the schema metadata.
+        Directory-level metadata isn't included.
+
+        For packages loaded with `compact=True` or browsed with `lazy=True`, entries that weren't
+        accessed are exported directly from the manifest, without creating `PackageEntry` objects.
+
+        Use `to_arrow().to_pandas()` to get a `pandas.DataFrame`.
+
+        Returns:
+            pyarrow.Table
+
+        Raises:
+            QuiltException: when pyarrow isn't installed.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise QuiltException("Please install pyarrow")
+
+        schema = entry_arrow_schema()
+        tables = []
+        rows = []
+        stored_range = None
+
+        def flush():
+            nonlocal stored_range
+            if stored_range is not None:
+                store, lo, hi, skip, prefix = stored_range
+                if isinstance(store, ManifestTable):
+                    tables.append(store.entries_to_arrow(lo, hi, skip, prefix))
+                else:
+                    for i in store.entry_rows(lo, hi):
+                        record = store.record(i)
+                        rows.append(_arrow_row(prefix + record['logical_key'][skip:], _StoredEntry(record)))
+                stored_range = None
+            if rows:
+                tables.append(pa.Table.from_pylist(rows, schema=schema))
+                rows.clear()
+
+        for item in self._walk_stored_ranges(''):
+            if isinstance(item, _StoredRange):
+                if stored_range is not None and item.extends(stored_range):
+                    stored_range = stored_range._replace(hi=item.hi)
+                    continue
+                flush()
+                stored_range = item
+            else:
+                if stored_range is not None:
+                    flush()
+                rows.append(_arrow_row(*item))
+        flush()
+
+        table = pa.concat_tables(tables) if tables else schema.empty_table()
+        return table.replace_schema_metadata({'quilt_meta': json.dumps(self._meta)})
+
+    @classmethod
+    @ApiTelemetry("package.from_arrow")
+    def from_arrow(cls, table, meta=None):
+        """
+        Creates a package from a table of entries with the columns returned by `to_arrow()`.
+        Only `logical_key` and `physical_key` columns are required, rows can be in any order.
+
+        The package is kept in a compact columnar form, like with `load(..., compact=True)`,
+        and `PackageEntry` objects are only created for the entries that are accessed.
+
+        Args:
+            table(pyarrow.Table or pandas.DataFrame): package entries
+            meta(dict): package metadata to set with `set_meta()`. If not given, the package metadata
+                saved by `to_arrow()` is restored, if any.
+
+        Returns:
+            A new Package object
+
+        Raises:
+            QuiltException: when pyarrow isn't installed.
+            PackageException: when entries are invalid.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise QuiltException("Please install pyarrow")
+
+        if not isinstance(table, pa.Table):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        saved_meta = (table.schema.metadata or {}).get(b'quilt_meta')
+        pkg_meta = json.loads(saved_meta) if saved_meta is not None and meta is None else {'version': 'v0'}
+        store = ManifestTable.from_entries_arrow(pkg_meta, table)
+        pkg = cls._from_store(store, 0, len(store), '')
+        pkg._meta = store.meta
+        if meta is not None:
+            pkg.set_meta(meta)
+        return pkg
+
     def set(
         self,
         logical_key,
@@ -1287,9 +2335,101 @@ class Package:
         if path[-1] in pkg and isinstance(pkg[path[-1]], Package):
             raise QuiltException(f"Cannot overwrite directory {path[-1]!r} with PackageEntry")
         pkg._children[path[-1]] = entry
+        pkg._children_changed()
+
+        return self
+
+    def set_many(self, entries, meta=None, unversioned: bool = False):
+        """
+        Returns self with many entries set at once, like calling `set()` for each of them.
+
+        All logical keys are validated before anything is requested, and sizes and versions
+        of S3 objects are requested concurrently. If any entry can't be set, `QuiltException`
+        listing the failed entries is raised and the package isn't changed.
+
+        Args:
+            entries(dict OR iterable): `{logical_key: entry}` or `(logical_key, entry)` pairs, where
+                entry is a `PackageEntry`, a URL string or `None`, as in `set()`.
+            meta(dict): user level metadata dict to attach to entries
+            unversioned(bool): when True, do not retrieve VersionId for S3 physical keys.
+
+        Returns:
+            self
+        """
+        # Later entries replace earlier ones with the same logical key, as with `set()`.
+        entries = dict(entries)
+
+        errors = []
+        srcs = {}
+        dirs = set()
+        for logical_key, entry in entries.items():
+            try:
+                if not logical_key or logical_key.endswith('/'):
+                    raise QuiltException(f"A package entry logical key {logical_key!r} must be a file.")
+                validate_key(logical_key)
+                if entry is None:
+                    entry = pathlib.Path(logical_key).resolve().as_uri()
+                if isinstance(entry, (str, os.PathLike)):
+                    srcs[logical_key] = PhysicalKey.from_url(fix_url(str(entry)))
+                elif not isinstance(entry, PackageEntry):
+                    raise TypeError(f"Expected a string for entry, but got an instance of {type(entry)}.")
+                self._check_can_set(logical_key)
+            except (QuiltException, TypeError, ValueError) as ex:
+                errors.append((logical_key, ex))
+                continue
+            path = self._split_key(logical_key)
+            dirs.update('/'.join(path[:i]) for i in range(1, len(path)))
+
+        errors.extend(
+            (logical_key, QuiltException(f"Cannot set both {logical_key!r} and entries under it."))
+            for logical_key in entries
+            if logical_key in dirs
+        )
+        if not errors:
+            results = get_sizes_and_versions(list(srcs.values()))
+            for (logical_key, src), result in zip(srcs.items(), results, strict=True):
+                if isinstance(result, Exception):
+                    errors.append((logical_key, result))
+                    continue
+                size, version_id = result
+                if not src.is_local() and src.version_id is None and version_id is not None and not unversioned:
+                    src.version_id = version_id
+                entries[logical_key] = PackageEntry(src, size, None, None)
+
+        if errors:
+            details = ''.join(f"\n  {logical_key!r}: {ex}" for logical_key, ex in errors[:10])
+            if len(errors) > 10:
+                details += f"\n  and {len(errors) - 10} more"
+            raise QuiltException(f"Failed to set {len(errors)} entries:{details}")
+
+        changed = {}
+        for logical_key, entry in entries.items():
+            if meta is not None:
+                entry.set_meta(meta)
+            *dir_path, name = self._split_key(logical_key)
+            pkg = self._ensure_subpackage(dir_path, ensure_no_entry=True)
+            pkg._children[name] = entry
+            changed[id(pkg)] = pkg
+        for pkg in changed.values():
+            pkg._children_changed()
 
         return self
 
+    def _check_can_set(self, logical_key):
+        """Raises `QuiltException` if an entry can't be set at `logical_key` because of existing entries."""
+        *dir_path, name = self._split_key(logical_key)
+        pkg = self
+        for key_fragment in dir_path:
+            pkg = pkg._children.get(key_fragment)
+            if pkg is None:
+                return
+            if isinstance(pkg, PackageEntry):
+                raise QuiltException(
+                    f"Already a PackageEntry for {key_fragment!r} along the path {dir_path!r}: {pkg.physical_key!r}",
+                )
+        if isinstance(pkg._children.get(name), Package):
+            raise QuiltException(f"Cannot overwrite directory {name!r} with PackageEntry")
+
     def _ensure_subpackage(self, path, ensure_no_entry=False):
         """
         Creates a package and any intermediate packages at the given path.
@@ -1309,7 +2449,10 @@ class Package:
                     f"Already a PackageEntry for {key_fragment!r} "
                     f"along the path {path!r}: {pkg[key_fragment].physical_key!r}",
                 )
-            pkg = pkg._children.setdefault(key_fragment, Package())
+            if key_fragment not in pkg._children:
+                pkg._children[key_fragment] = Package()
+                pkg._children_changed()
+            pkg = pkg._children[key_fragment]
         return pkg
 
     def delete(self, logical_key):
@@ -1325,6 +2468,7 @@ class Package:
         path = self._split_key(logical_key)
         pkg = self[path[:-1]]
         del pkg._children[path[-1]]
+        pkg._children_changed()
         return self
 
     @property
@@ -1338,32 +2482,77 @@ class Package:
         Returns:
             A string that represents the top hash of the package
         """
-        return self._calculate_top_hash(self._meta, self.walk())
+        return self._calculate_top_hash(self._meta, self._iter_top_hash_parts(''))
 
     @classmethod
-    def _calculate_top_hash(cls, meta, entries):
-        top_hash = hashlib.sha256()
-
-        json_encode = json.JSONEncoder(sort_keys=True, separators=(',', ':')).encode
-        for part in cls._get_top_hash_parts(meta, entries):
-            top_hash.update(json_encode(part).encode())
+    def _calculate_top_hash(cls, meta, parts):
+        """
+        Args:
+            meta: package metadata
+            parts: serialized entries in walk order, see `_iter_top_hash_parts()`
+        """
+        assert 'top_hash' not in meta
+        top_hash = hashlib.sha256(_top_hash_json_encode(meta).encode())
+        # TODO: dir-level metadata should affect top hash as well.
+        gc.disable()  # Serialized parts are cached, so GC would be triggered repeatedly, see `_load()`.
+        try:
+            for part in parts:
+                top_hash.update(part)
+        finally:
+            gc.enable()
 
         return top_hash.hexdigest()
 
-    @classmethod
-    def _get_top_hash_parts(cls, meta, entries):
-        assert 'top_hash' not in meta
-        yield meta
-        # TODO: dir-level metadata should affect top hash as well.
-        for logical_key, entry in entries:
-            if entry.hash is None or entry.size is None:
-                raise QuiltException("PackageEntry missing hash and/or size: %r" % entry.physical_key)
-            yield {
-                'hash': entry.hash,
-                'logical_key': logical_key,
-                'meta': entry._meta,
-                'size': entry.size,
-            }
+    def _iter_top_hash_parts(self, prefix):
+        for segment in self._get_top_hash_segments(prefix):
+            if isinstance(segment, tuple):
+                name, child = segment
+                yield from child._iter_top_hash_parts(f'{prefix}{name}/')
+            else:
+                for part in segment:
+                    yield part if part.__class__ is bytes else _encode_top_hash_part(*part)
+
+    def _get_top_hash_segments(self, prefix):
+        """
+        Returns the serialized top hash parts of the entries under this directory level in walk order.
+
+        Consecutive entries are grouped into lists of serialized parts; subdirectories are
+        represented by `(name, Package)` and serialized by their own segments, so changing them
+        doesn't require serializing this level again. Entries with metadata are represented by
+        `(logical_key, PackageEntry)` and serialized on every read, because their metadata can be
+        mutated in place. The result is cached until the children of this level are changed
+        or any serialized entry is modified.
+        """
+        if self._store is not None:
+            # Children are created on access, so there's nothing to cache.
+            return [(entry._get_top_hash_part(lk) for lk, entry in self._walk_rows(prefix))]
+
+        cache = self._top_hash_cache
+        if cache is not None and cache[0] == prefix and cache[1] == PackageEntry._top_hash_version:
+            return cache[2]
+
+        segments = []
+        parts = []
+        for name, child in self._sorted_items():
+            if isinstance(child, PackageEntry):
+                logical_key = f'{prefix}{name}'
+                if child._meta:
+                    parts.append((logical_key, child))
+                    continue
+                # Same as `child._get_top_hash_part()`, inlined because this is a hot loop.
+                part = child._top_hash_part
+                if part is None or part[0] != logical_key:
+                    part = child._top_hash_part = (logical_key, _encode_top_hash_part(logical_key, child))
+                parts.append(part[1])
+            else:
+                if parts:
+                    segments.append(parts)
+                    parts = []
+                segments.append((name, child))
+        if parts:
+            segments.append(parts)
+        self._top_hash_cache = (prefix, PackageEntry._top_hash_version, segments)
+        return segments
 
     @ApiTelemetry("package.push")
     @_fix_docstring(workflow=_WORKFLOW_PARAM_DOCSTRING)
@@ -1450,6 +2639,7 @@ class Package:
             dest: where to copy the objects in the package. Must be either an S3 URI prefix (e.g., s3://$bucket/$key)
                 in the registry bucket, or a callable that takes logical_key and package_entry, and returns an S3 URI.
                 (Changed in 6.0.0a1) previously top_hash was passed to the callable dest as a third argument.
+                Objects with the same hash are copied once, to the destination of the first of their entries.
             registry: registry where to create the new package
             message: the commit message for the new package
             selector_fn: An optional function that determines which package entries should be copied to S3.
@@ -1491,8 +2681,12 @@ class Package:
         dedupe: bool,
         copy_file_list_fn: CopyFileListFn | None = None,
     ):
+        # Known checksums of remote sources let `copy_file_list()` skip copies to destinations
+        # that already have the same content. Other copiers don't take them.
+        src_checksums = None
         if copy_file_list_fn is None:
             copy_file_list_fn = copy_file_list
+            src_checksums = []
 
         validate_package_name(name)
 
@@ -1608,11 +2802,16 @@ class Package:
         # Since all that is modified is physical keys, pkg will have the same top hash
         file_list = []
         entries = []
+        # Objects with the same known hash are copied once: other entries with that hash point at the copy.
+        first_copies = {}
+        shared_copies = []
+        temp_file_logical_keys = []
+        temp_file_dir = APP_DIR_TEMPFILE_DIR.resolve()
 
-        for logical_key, entry in self.walk():
+        def select_entry(logical_key, entry):
             if not selector_fn(logical_key, entry):
                 pkg._set(logical_key, entry)
-                continue
+                return
 
             # Copy the datafiles in the package.
             physical_key = entry.physical_key
@@ -1622,10 +2821,32 @@ class Package:
                 # No need to copy - re-use the original physical key.
                 pkg._set(logical_key, entry)
             else:
+                content_key = _content_key(entry)
+                idx = first_copies.get(content_key)
+                if idx is not None:
+                    shared_copies.append((logical_key, entry, idx))
+                    return
+                if content_key is not None:
+                    first_copies[content_key] = len(file_list)
                 entries.append((logical_key, entry))
                 file_list.append((physical_key, new_physical_key, entry.size))
+                if src_checksums is not None:
+                    src_checksums.append(None if physical_key.is_local() else _known_checksum(entry))
+
+        def find_temp_file(logical_key, entry):
+            # Tmp files created by pkg.set('KEY', obj) are deleted once the push succeeds.
+            pk = entry.physical_key
+            if pk.is_local() and pathlib.Path(pk.path).parent.resolve() == temp_file_dir:
+                temp_file_logical_keys.append(logical_key)
 
-        results = copy_file_list_fn(file_list, message="Copying objects")
+        self._walk_into(select_entry, find_temp_file)
+
+        copy_kwargs = {'src_checksums': src_checksums} if src_checksums and any(src_checksums) else {}
+        results = list(copy_file_list_fn(file_list, message="Copying objects", **copy_kwargs))
+
+        for logical_key, entry, idx in shared_copies:
+            entries.append((logical_key, entry))
+            results.append((results[idx][0], None))
 
         for (logical_key, entry), (versioned_key, checksum) in zip(entries, results, strict=True):
             # Create a new package entry pointing to the new remote key.
@@ -1638,7 +2859,7 @@ class Package:
         # Some entries may miss hash values (e.g because of selector_fn), so we need
         # to fix them before calculating the top hash.
         pkg._calculate_missing_hashes()
-        top_hash = pkg._calculate_top_hash(pkg._meta, pkg.walk())
+        top_hash = pkg._calculate_top_hash(pkg._meta, pkg._iter_top_hash_parts(''))
 
         if dedupe and top_hash == latest_hash:
             # Hashing and transfer may take long enough for another writer to update latest.
@@ -1658,13 +2879,6 @@ class Package:
                     )
                 return self
 
-        def physical_key_is_temp_file(pk):
-            if not pk.is_local():
-                return False
-            return pathlib.Path(pk.path).parent.resolve() == APP_DIR_TEMPFILE_DIR.resolve()
-
-        # Materialized first: _set() below mutates what walk() iterates.
-        temp_file_logical_keys = [lk for lk, entry in self.walk() if physical_key_is_temp_file(entry.physical_key)]
         for lk in temp_file_logical_keys:
             # Delete tmp files created by pkg.set('KEY', obj). Cleanup is best-effort: a file we
             # cannot remove is a leaked scratch file, not a reason to fail a completed push.
@@ -1760,6 +2974,37 @@ class Package:
 
         return added, modified, deleted
 
+    @classmethod
+    @ApiTelemetry("package.diff_manifests")
+    def diff_manifests(cls, registry, name, hash_a, hash_b):
+        """
+        Compares two revisions of a package without loading either of them.
+
+        Manifests list entries sorted by logical key, so they are compared with a single
+        sorted merge that reads them line by line, and memory use doesn't depend on their size.
+        As in `Package.diff()`, entries are compared by size, hash and metadata.
+
+        Args:
+            registry: registry where the package is located, defaults to local registry
+            name: name of the package
+            hash_a: top hash of the revision to compare from
+            hash_b: top hash of the revision to compare to
+
+        Returns:
+            A generator of `(change, logical_key)` tuples in alphabetical order of logical keys, where
+            `change` is 'added' (only present in `hash_b`), 'modified' or 'deleted' (only present in `hash_a`).
+        """
+        validate_package_name(name)
+        registry = get_package_registry(registry)
+        manifests = [registry.manifest_pk(name, registry.resolve_top_hash(name, h)) for h in (hash_a, hash_b)]
+        return cls._diff_manifests(manifests)
+
+    @staticmethod
+    def _diff_manifests(manifests):
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(stack.enter_context(_local_manifest(pk)), 'rb')) for pk in manifests]
+            yield from diff_manifests(*files, names=[str(pk) for pk in manifests])
+
     @ApiTelemetry("package.map")
     def map(self, f, include_directories=False):
         """
@@ -21,7 +21,7 @@ from botocore.credentials import (
     RefreshableCredentials,
 )
 
-from .util import BASE_PATH, QuiltException, get_from_config
+from .util import BASE_PATH, CONFIG_PATH, QuiltException, get_from_config
 
 AUTH_PATH = BASE_PATH / 'auth.json'
 CREDENTIALS_PATH = BASE_PATH / 'credentials.json'
@@ -339,6 +339,50 @@ def create_botocore_session(*, credentials: dict | None = None) -> botocore.sess
     return botocore_session
 
 
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+# (stamp, key) of the last `get_boto3_session_key()`.
+_boto3_session_key = (None, None)
+
+
+def get_boto3_session_key():
+    """
+    Returns a hashable key that changes whenever `get_boto3_session()` would return a session
+    with other credentials or region, so clients built with a session can be shared until then.
+
+    The key is the access key and region the session resolves to, and `AWS_*` environment variables,
+    e.g. endpoints. It's only resolved again when the files or environment variables that the session
+    is configured with change.
+    """
+    global _boto3_session_key
+    aws_env = tuple(sorted((name, value) for name, value in os.environ.items() if name.startswith('AWS_')))
+    stamp = (
+        _file_stamp(CREDENTIALS_PATH),
+        aws_env,
+        _file_stamp(os.path.expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))),
+        _file_stamp(os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))),
+    )
+    if stamp[0] is not None:
+        # The region of sessions with Quilt credentials comes from the Quilt config.
+        stamp += (_file_stamp(CONFIG_PATH),)
+    cached_stamp, key = _boto3_session_key
+    if stamp != cached_stamp:
+        if credentials := _load_credentials():
+            key = (credentials.get('access_key'), get_from_config('region'), aws_env)
+        else:
+            session = boto3.Session()
+            aws_credentials = session.get_credentials()
+            key = (None if aws_credentials is None else aws_credentials.access_key, session.region_name, aws_env)
+        _boto3_session_key = (stamp, key)
+    return key
+
+
 def get_boto3_session(*, fallback: bool = True) -> boto3.Session:
     """
     Return a Boto3 session with Quilt stack credentials and AWS region.
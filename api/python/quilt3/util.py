@@ -454,6 +454,40 @@ def set_config_value(key, value):
     write_yaml(local_config, CONFIG_PATH)
 
 
+def _compile_quiltignore(ignore):
+    """
+    Compiles the rules in the file `ignore`, in Unix shell style wildcard format, into a single
+    regular expression, which matches paths the same way `fnmatch.fnmatch()` matches each rule.
+    """
+    from fnmatch import translate
+
+    ignore_rules = ignore.read_text('utf-8').split("\n")
+    patterns = [translate(os.path.normcase('*/' + rule)) for rule in ignore_rules if rule]
+    return re.compile('|'.join(patterns) if patterns else '(?!)')
+
+
+def quiltignore_matcher(ignore):
+    """
+    Returns a function `(path, is_dir) -> bool` which tells if a local path is captured by
+    the ignore rules in the file `ignore`, so paths can be filtered while a directory is being
+    scanned, without descending into ignored directories. Files of ignored directories
+    should be ignored by the caller.
+
+    Rules are compiled once. Like with git, both `foo` and `foo/` match the rule `foo`,
+    but only `foo/` matches the rule `foo/`.
+    """
+    match = _compile_quiltignore(ignore).match
+    normcase = os.path.normcase
+
+    def matches(path, is_dir):
+        path = normcase(path)
+        if is_dir:
+            return match(path) is not None or match(normcase(path + '/')) is not None
+        return match(path) is not None
+
+    return matches
+
+
 def quiltignore_filter(paths, ignore, url_scheme):
     """Given a list of paths, filter out the paths which are captured by the
     given ignore rules.
@@ -465,11 +499,8 @@ def quiltignore_filter(paths, ignore, url_scheme):
         url_scheme (str): the URL scheme, only the "file" scheme is currently
             supported
     """
-    ignore_rules = ignore.read_text('utf-8').split("\n")
-    ignore_rules = ['*/' + rule for rule in ignore_rules if rule]
-
     if url_scheme == 'file':
-        from fnmatch import fnmatch
+        matches = quiltignore_matcher(ignore)
 
         files, dirs = set(), set()
         for path in paths:
@@ -478,19 +509,9 @@ def quiltignore_filter(paths, ignore, url_scheme):
             else:
                 dirs.add(path)
 
-        filtered_dirs = dirs.copy()
-        for ignore_rule in ignore_rules:
-            for pkg_dir in filtered_dirs.copy():
-                # copy git behavior --- git matches paths and directories equivalently.
-                # e.g. both foo and foo/ will match the ignore rule "foo"
-                # but only foo/ will match the ignore rule "foo/"
-                if fnmatch(pkg_dir.as_posix() + "/", ignore_rule) or fnmatch(pkg_dir.as_posix(), ignore_rule):
-                    files = {n for n in files if pkg_dir not in n.parents}
-                    dirs = dirs - {pkg_dir}
-
-            files = {n for n in files if not fnmatch(n, ignore_rule)}
-
-        return files.union(dirs)
+        ignored_dirs = {pkg_dir for pkg_dir in dirs if matches(os.fspath(pkg_dir), True)}
+        files = {n for n in files if not matches(os.fspath(n), False) and ignored_dirs.isdisjoint(n.parents)}
+        return files.union(dirs - ignored_dirs)
     else:
         raise NotImplementedError
 
@@ -90,6 +90,13 @@ def set_temporary_working_dir(request, tmpdir):
     request.addfinalizer(teardown)
 
 
+@pytest.fixture
+def fixed_transfer_concurrency():
+    # For tests that expect stubbed S3 responses to be requested in order: the concurrency they set must not grow.
+    with mock.patch('quilt3.data_transfer.MAX_ADAPTIVE_CONCURRENCY', 0):
+        yield
+
+
 @pytest.fixture
 def isolate_packages_cache(tmp_path):
     with mock.patch('quilt3.packages.CACHE_PATH', tmp_path):
@@ -1,11 +1,15 @@
 """Integration tests for Quilt Packages."""
 
+import hashlib
 import io
+import json
 import locale
 import math
 import os
 import pathlib
+import random
 import shutil
+import sqlite3
 import tempfile
 from collections import Counter
 from contextlib import redirect_stderr
@@ -31,7 +35,7 @@ from quilt3.backends.local import (
 from quilt3.backends.s3 import S3PackageRegistryV1, S3PackageRegistryV2
 from quilt3.data_transfer import FileChecksumTask
 from quilt3.exceptions import PackageException
-from quilt3.packages import PackageEntry
+from quilt3.packages import ContentCache, ObjectPathCache, PackageEntry
 from quilt3.util import (
     PhysicalKey,
     QuiltConflictException,
@@ -51,7 +55,7 @@ SERIALIZATION_DIR = Path('serialization_dir')
 LOCAL_REGISTRY = Path('local_registry')  # Set by QuiltTestCase
 
 
-def _mock_copy_file_list(file_list, callback=None, message=None):
+def _mock_copy_file_list(file_list, callback=None, message=None, src_checksums=None):
     return [(key, None) for _, key, _ in file_list]
 
 
@@ -869,6 +873,13 @@ def test_repush_preservation_failure_origin_atomicity(repush_registry_stub, monk
     assert len(published) == publications_before
 
 
+def _load_pushed_manifest(push_manifest_stream_mock):
+    manifest = BytesIO()
+    push_manifest_stream_mock.call_args[0][2](manifest)
+    manifest.seek(0)
+    return Package.load(manifest)
+
+
 class PackageTest(QuiltTestCase):
     default_registry_version = 1
     S3PackageRegistryDefault = S3PackageRegistryV1
@@ -1268,6 +1279,7 @@ class PackageTest(QuiltTestCase):
             filepath = os.path.join(os.path.dirname(__file__), 'data', 'foo.txt')
             copy_mock.assert_called_once_with(PhysicalKey.from_path(filepath), PhysicalKey.from_path('foo.txt'))
 
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     @patch('quilt3.workflows.validate', mock.MagicMock(return_value=None))
     def test_load_into_quilt(self):
         """Verify loading local manifest and data into S3."""
@@ -1416,17 +1428,14 @@ class PackageTest(QuiltTestCase):
 
     def test_s3_set_dir(self):
         """Verify building a package from an S3 directory."""
-        with patch('quilt3.packages.list_object_versions') as list_object_versions_mock:
+        with patch('quilt3.packages.iter_object_versions') as iter_object_versions_mock:
             pkg = Package()
 
-            list_object_versions_mock.return_value = (
-                [
-                    dict(Key='foo/a.txt', VersionId='xyz', IsLatest=True, Size=10),
-                    dict(Key='foo/x/y.txt', VersionId='null', IsLatest=True, Size=10),
-                    dict(Key='foo/z.txt', VersionId='123', IsLatest=False, Size=10),
-                ],
-                [],
-            )
+            iter_object_versions_mock.return_value = [
+                dict(Key='foo/a.txt', VersionId='xyz', IsLatest=True, Size=10),
+                dict(Key='foo/x/y.txt', VersionId='null', IsLatest=True, Size=10),
+                dict(Key='foo/z.txt', VersionId='123', IsLatest=False, Size=10),
+            ]
 
             pkg.set_dir('', 's3://bucket/foo/', meta='test_meta')
 
@@ -1435,31 +1444,47 @@ class PackageTest(QuiltTestCase):
             assert pkg.meta == "test_meta"
             assert pkg['x']['y.txt'].size == 10  # GH368
 
-            list_object_versions_mock.assert_called_with('bucket', 'foo/')
+            iter_object_versions_mock.assert_called_with('bucket', 'foo/', parallel=False)
 
-            list_object_versions_mock.reset_mock()
+            iter_object_versions_mock.reset_mock()
 
-            pkg.set_dir('bar', 's3://bucket/foo')
+            pkg.set_dir('bar', 's3://bucket/foo', parallel=True)
 
             assert pkg['bar']['a.txt'].get() == 's3://bucket/foo/a.txt?versionId=xyz'
             assert pkg['bar']['x']['y.txt'].get() == 's3://bucket/foo/x/y.txt?versionId=null'
             assert pkg['bar']['a.txt'].size == 10  # GH368
 
-            list_object_versions_mock.assert_called_with('bucket', 'foo/')
+            iter_object_versions_mock.assert_called_with('bucket', 'foo/', parallel=True)
 
-    @patch("quilt3.packages.list_object_versions")
-    def test_set_dir_root_folder_named_slash(self, list_object_versions_mock):
-        list_object_versions_mock.return_value = (
-            [dict(Key="/foo/a.txt", VersionId="xyz", IsLatest=True, Size=10)],
-            [],
+    def test_s3_set_dir_sequential(self):
+        """Verify building a package from an S3 directory takes one paginated listing by default."""
+        self.s3_stubber.add_response(
+            'list_object_versions',
+            {
+                'IsTruncated': False,
+                'Versions': [
+                    {'Key': 'foo/a.txt', 'VersionId': 'xyz', 'IsLatest': True, 'Size': 10},
+                    {'Key': 'foo/x/y.txt', 'VersionId': 'null', 'IsLatest': True, 'Size': 10},
+                ],
+            },
+            {'Bucket': 'bucket', 'Prefix': 'foo/'},
         )
+
+        pkg = Package().set_dir('', 's3://bucket/foo/')
+
+        assert pkg['a.txt'].get() == 's3://bucket/foo/a.txt?versionId=xyz'
+        assert pkg['x/y.txt'].get() == 's3://bucket/foo/x/y.txt?versionId=null'
+
+    @patch("quilt3.packages.iter_object_versions")
+    def test_set_dir_root_folder_named_slash(self, iter_object_versions_mock):
+        iter_object_versions_mock.return_value = [dict(Key="/foo/a.txt", VersionId="xyz", IsLatest=True, Size=10)]
         pkg = Package()
         pkg.set_dir("bar", "s3://bucket//foo")  # top-level '/' folder
 
         assert pkg["bar"]["a.txt"].get() == "s3://bucket//foo/a.txt?versionId=xyz"
         assert pkg["bar"]["a.txt"].size == 10
 
-        list_object_versions_mock.assert_called_once_with("bucket", "/foo/")
+        iter_object_versions_mock.assert_called_once_with("bucket", "/foo/", parallel=False)
 
     @patch("quilt3.packages.get_size_and_version", return_value=(123, "v1"))
     def test_set_file_root_folder_named_slash(self, get_size_and_version_mock):
@@ -1479,10 +1504,10 @@ class PackageTest(QuiltTestCase):
             pkg.set_dir("nested", DATA_DIR, update_policy='invalid_policy')
         assert expected_err in str(e.value)
 
-    @mock.patch("quilt3.packages.list_objects")
-    @mock.patch("quilt3.packages.list_object_versions")
-    def test_set_dir_unversioned(self, list_object_versions_mock, list_objects_mock):
-        list_objects_mock.return_value = [
+    @mock.patch("quilt3.packages.iter_objects")
+    @mock.patch("quilt3.packages.iter_object_versions")
+    def test_set_dir_unversioned(self, iter_object_versions_mock, iter_objects_mock):
+        iter_objects_mock.return_value = [
             {
                 "Key": "foo/bar.txt",
                 "Size": 123,
@@ -1491,8 +1516,8 @@ class PackageTest(QuiltTestCase):
 
         pkg = Package().set_dir(".", "s3://bucket/foo", unversioned=True)
 
-        list_object_versions_mock.assert_not_called()
-        list_objects_mock.assert_called_once_with("bucket", "foo/", recursive=True)
+        iter_object_versions_mock.assert_not_called()
+        iter_objects_mock.assert_called_once_with("bucket", "foo/", parallel=False)
         assert [(lk, e.get()) for lk, e in pkg.walk()] == [("bar.txt", "s3://bucket/foo/bar.txt")]
 
     def test_package_entry_meta(self):
@@ -1689,6 +1714,72 @@ class PackageTest(QuiltTestCase):
                 pkg.set("bar", "s3://bucket/bar", unversioned=flag_value)
                 assert pkg["bar"].physical_key == PhysicalKey("bucket", "bar", version_id)
 
+    @patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
+    def test_set_many(self):
+        for params, version_id in (
+            ({'Key': 'a'}, 'v1'),
+            ({'Key': 'b/c'}, None),
+            ({'Key': 'a', 'VersionId': 'v0'}, 'v0'),
+        ):
+            self.s3_stubber.add_response(
+                method='head_object',
+                service_response={'ContentLength': 10, **({'VersionId': version_id} if version_id else {})},
+                expected_params={'Bucket': 'bucket', **params},
+            )
+        entry = PackageEntry(PhysicalKey('bucket', 'e', 'v2'), 5, None, {'foo': 'bar'})
+
+        pkg = Package().set('b/d', DATA_DIR / 'foo.txt')
+        pkg.set_many(
+            {
+                'a': 's3://bucket/a',
+                'b/c': 's3://bucket/b/c',
+                'b/d': 's3://bucket/a?versionId=v0',
+                'e': entry,
+                'f': DATA_DIR / 'foo.txt',
+            },
+            meta={'baz': 1},
+        )
+        assert pkg['a'].physical_key == PhysicalKey('bucket', 'a', 'v1')
+        assert pkg['a'].size == 10
+        assert pkg['a'].meta == {'baz': 1}
+        assert pkg['b/c'].physical_key == PhysicalKey('bucket', 'b/c', None)
+        assert pkg['b/d'].physical_key == PhysicalKey('bucket', 'a', 'v0')
+        assert pkg['b/d'].size == 10
+        assert pkg['e'] is entry
+        # Metadata is attached to entries too, as with `set()`.
+        assert pkg['e'].meta == {'baz': 1}
+        assert pkg['e']._meta == {'foo': 'bar', 'user_meta': {'baz': 1}}
+        assert pkg['f'].size == (DATA_DIR / 'foo.txt').stat().st_size
+        assert pkg['f'].meta == {'baz': 1}
+
+        # Errors of all entries are reported, and the package isn't changed.
+        entries = list(pkg.walk())
+        with pytest.raises(QuiltException) as excinfo:
+            pkg.set_many(
+                [
+                    ('b', 's3://bucket/b'),
+                    ('a/x', 's3://bucket/x'),
+                    ('g/', 's3://bucket/g'),
+                    ('h', 1),
+                    ('i/j', 's3://bucket/j'),
+                    ('i', 's3://bucket/i'),
+                ]
+            )
+        message = str(excinfo.value)
+        assert message.startswith('Failed to set 5 entries:')
+        for logical_key in ('b', 'a/x', 'g/', 'h', 'i'):
+            assert repr(logical_key) in message
+        assert list(pkg.walk()) == entries
+
+        self.s3_stubber.add_client_error(
+            method='head_object',
+            http_status_code=404,
+            expected_params={'Bucket': 'bucket', 'Key': 'missing'},
+        )
+        with pytest.raises(QuiltException, match="Failed to set 1 entries:\n  'x': .*HeadObject"):
+            pkg.set_many([('x', 's3://bucket/missing'), ('y', DATA_DIR / 'foo.txt')])
+        assert 'y' not in pkg
+
     def test_tophash_changes(self):
         test_file = Path('test.txt')
         test_file.write_text('asdf', 'utf-8')
@@ -1855,6 +1946,174 @@ class PackageTest(QuiltTestCase):
         p2 = Package.browse('Quilt/Test')
         assert p1.diff(p2) == ([], [], [])
 
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    def test_browse_lazy(self):
+        pkg = Package()
+        pkg.set('a/b/c', LOCAL_MANIFEST, meta={'c': True})
+        pkg.set('a/d', LOCAL_MANIFEST)
+        pkg.set('a.txt', LOCAL_MANIFEST)
+        pkg['a/b'].set_meta({'dir': True})
+        top_hash = pkg.build('Quilt/Test')
+
+        record = quilt3.manifest.ManifestIndex.record
+        for _ in range(2):  # The second time the cached index is used.
+            with patch.object(
+                quilt3.manifest.ManifestIndex, 'record', autospec=True, side_effect=record
+            ) as record_mock:
+                lazy = Package.browse('Quilt/Test', lazy=True)
+
+                assert list(lazy.keys()) == ['a', 'a.txt']
+                assert len(lazy) == 2
+                assert lazy['a/b'].meta == {'dir': True}
+                record_mock.assert_called_once()
+                assert lazy['a/b/c'].meta == {'c': True}
+                assert 'a/b/nope' not in lazy
+                assert 'a/d' in lazy
+            assert lazy.top_hash == top_hash
+            assert list(lazy.manifest) == list(pkg.manifest)
+            assert len(list(quilt3.packages.CACHE_PATH.glob('manifest/*.index'))) == 1
+
+        with pytest.raises(QuiltException, match="can't be used together"):
+            Package.browse('Quilt/Test', lazy=True, compact=True)
+
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    def test_browse_path(self):
+        pkg = Package()
+        pkg.set('a/b/c', LOCAL_MANIFEST, meta={'c': True})
+        pkg.set('a/d', LOCAL_MANIFEST)
+        pkg.set('a-b', LOCAL_MANIFEST)
+        pkg.set('e', LOCAL_MANIFEST)
+        pkg['a/b'].set_meta({'dir': True})
+        pkg.build('Quilt/Test')
+
+        record = quilt3.manifest.ManifestIndex.record
+        with patch.object(quilt3.manifest.ManifestIndex, 'record', autospec=True, side_effect=record) as record_mock:
+            subpkg = Package.browse('Quilt/Test', path='a')
+            # Only the directory row and the entries under 'a' are decoded.
+            assert record_mock.call_count == 3
+
+        assert subpkg._store is None
+        assert list(subpkg.walk()) == list(pkg['a'].walk())
+        assert subpkg['b'].meta == {'dir': True}
+        assert subpkg['b/c'].meta == {'c': True}
+        assert Package.browse('Quilt/Test', path='a/b/c') == pkg['a/b/c']
+        assert Package.browse('Quilt/Test', path='a', lazy=True)._store is not None
+
+        with pytest.raises(QuiltException, match="doesn't contain 'a/x'"):
+            Package.browse('Quilt/Test', path='a/x')
+        with pytest.raises(QuiltException, match="'compact' and 'path' can't be used together"):
+            Package.browse('Quilt/Test', path='a', compact=True)
+
+    def test_diff_manifests(self):
+        pkg = Package().set('a/b', LOCAL_MANIFEST).set('c', LOCAL_MANIFEST).set('d', LOCAL_MANIFEST)
+        hash_a = pkg.build('Quilt/Test')
+        pkg.set('a/b', LOCAL_MANIFEST, meta={'changed': True})
+        pkg.delete('c')
+        pkg.set('e', LOCAL_MANIFEST)
+        hash_b = pkg.build('Quilt/Test')
+
+        changes = list(Package.diff_manifests(None, 'Quilt/Test', hash_a[:10], hash_b))
+
+        assert changes == [('modified', 'a/b'), ('deleted', 'c'), ('added', 'e')]
+        added, modified, deleted = Package.browse('Quilt/Test', top_hash=hash_a).diff(pkg)
+        assert changes == [
+            *(('modified', lk) for lk in modified),
+            *(('deleted', lk) for lk in deleted),
+            *(('added', lk) for lk in added),
+        ]
+        assert list(Package.diff_manifests(None, 'Quilt/Test', hash_b, hash_b)) == []
+
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    def test_browse_cached(self):
+        pytest.importorskip('pyarrow')
+        pkg = Package()
+        pkg.set('a/b', LOCAL_MANIFEST, meta={'b': True})
+        pkg.set('c', LOCAL_MANIFEST)
+        pkg['a'].set_meta({'dir': True})
+        top_hash = pkg.build('Quilt/Test')
+
+        def browse(**kwargs):
+            loaded = Package.browse('Quilt/Test', **kwargs)
+            assert loaded.top_hash == top_hash
+            assert list(loaded.manifest) == list(pkg.manifest)
+            assert loaded['a/b'].physical_key == pkg['a/b'].physical_key
+            return loaded
+
+        from_records = quilt3.manifest.ManifestTable.from_records
+        with patch.object(quilt3.manifest.ManifestTable, 'from_records', wraps=from_records) as mock:
+            browse(compact=True)
+            mock.assert_called_once()
+            [cache_path] = quilt3.packages.CACHE_PATH.glob('manifest/*.arrow')
+
+            browse(compact=True)
+            mock.assert_called_once()
+
+            # Small manifests are parsed as usual unless `compact` is requested.
+            assert browse()._store is None
+            # Large ones are loaded from the cache, but aren't compact unless requested.
+            with patch('quilt3.packages.MANIFEST_ARROW_CACHE_MIN_SIZE', 0):
+                loaded = browse()
+                assert loaded._store is None
+                assert loaded['a']._store is None
+                assert loaded['a'].meta == {'dir': True}
+            mock.assert_called_once()
+
+            # Corrupted cache is replaced.
+            cache_path.write_bytes(cache_path.read_bytes()[:-100])
+            browse(compact=True)
+            assert mock.call_count == 2
+            browse(compact=True)
+            assert mock.call_count == 2
+
+    def test_arrow(self):
+        pytest.importorskip('pyarrow')
+        pkg = Package()
+        pkg.set('a/b', LOCAL_MANIFEST, meta={'b': 'ü'})
+        pkg.set('a/c/d', LOCAL_MANIFEST)
+        pkg.set('e', LOCAL_MANIFEST)
+        pkg['a'].set_meta({'dir': True})
+        pkg.set_meta({'pkg': True})
+        pkg.build('Quilt/Test')
+        pkg['e'].hash = None
+        pkg['e'].size = None
+        table = pkg.to_arrow()
+
+        assert table.column_names == ['logical_key', 'physical_key', 'size', 'hash_type', 'hash_value', 'meta']
+        assert table.column('logical_key').to_pylist() == ['a/b', 'a/c/d', 'e']
+        assert table.column('meta').to_pylist() == ['{"user_meta":{"b":"ü"}}', None, None]
+        assert table.slice(2).to_pylist() == [
+            {
+                'logical_key': 'e',
+                'physical_key': str(pkg['e'].physical_key),
+                'size': None,
+                'hash_type': None,
+                'hash_value': None,
+                'meta': None,
+            }
+        ]
+
+        buf = io.StringIO()
+        pkg.dump(buf)
+        buf.seek(0)
+        compact = Package.load(buf, compact=True)
+        assert compact.to_arrow().equals(table)
+        assert compact._store is not None
+
+        # Changed parts of a compact package are exported from objects, the rest from the manifest.
+        compact.set('a/c/f', LOCAL_MANIFEST)
+        compact.delete('a/b')
+        assert compact.to_arrow().column('logical_key').to_pylist() == [lk for lk, _ in compact.walk()]
+
+        loaded = Package.from_arrow(table)
+        assert loaded._store is not None
+        assert loaded._meta == pkg._meta
+        assert list(loaded.walk()) == list(pkg.walk())
+        assert loaded.to_arrow().equals(table)
+        assert Package.from_arrow(table, meta={'new': True}).meta == {'new': True}
+
+        pytest.importorskip('pandas')
+        assert list(Package.from_arrow(table.to_pandas()).walk()) == list(pkg.walk())
+
     def test_dir_meta(self):
         test_meta = {'test': 'meta'}
         pkg = Package()
@@ -2433,6 +2692,7 @@ class PackageTest(QuiltTestCase):
 
     @pytest.mark.usefixtures('clear_data_modules_cache')
     @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     def test_install(self):
         self.patch_local_registry('shorten_top_hash', return_value='7a67ff4')
         registry = 's3://my-test-bucket'
@@ -2541,6 +2801,7 @@ class PackageTest(QuiltTestCase):
             )
 
     @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     @patch('quilt3.util.IS_CACHE_ENABLED', False)
     @patch('quilt3.packages.ObjectPathCache')
     def test_install_disabled_cache(self, object_path_cache_mock):
@@ -2563,7 +2824,9 @@ class PackageTest(QuiltTestCase):
             with patch('quilt3.data_transfer.MAX_CONCURRENCY', 1):
                 Package.install(pkg_name, registry=registry, dest='package')
             object_path_cache_mock.get.assert_not_called()
+            object_path_cache_mock.get_many.assert_not_called()
             object_path_cache_mock.set.assert_not_called()
+            object_path_cache_mock.set_many.assert_not_called()
 
     @pytest.mark.usefixtures('isolate_packages_cache')
     @patch('quilt3.util.IS_CACHE_ENABLED', False)
@@ -2584,8 +2847,9 @@ class PackageTest(QuiltTestCase):
             object_path_cache_mock.get.assert_not_called()
 
     @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     @patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
-    @patch('quilt3.packages.ObjectPathCache.set')
+    @patch('quilt3.packages.ObjectPathCache.set_many')
     def test_install_subpackage(self, mocked_cache_set):
         registry = 's3://my-test-bucket'
         pkg_registry = self.S3PackageRegistryDefault(PhysicalKey.from_url(registry))
@@ -2605,15 +2869,16 @@ class PackageTest(QuiltTestCase):
         Package.install(pkg_name, registry=registry, dest=dest, path=path)
 
         path = pathlib.Path.cwd() / dest / 'bat'
-        mocked_cache_set.assert_called_once_with(
-            entry_url,
-            PhysicalKey.from_path(path).path,
-        )
+        mocked_cache_set.assert_called_once_with([(entry_url, PhysicalKey.from_path(path).path)])
         assert path.read_bytes() == entry_content
+        # The manifest is installed as is, rather than loaded and serialized again.
+        local_manifest = quilt3.packages.get_package_registry().manifest_pk(pkg_name, self.default_test_top_hash)
+        assert pathlib.Path(local_manifest.path).read_bytes() == REMOTE_MANIFEST.read_bytes()
 
     @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     @patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
-    @patch('quilt3.packages.ObjectPathCache.set')
+    @patch('quilt3.packages.ObjectPathCache.set_many')
     def test_install_entry(self, mocked_cache_set):
         registry = 's3://my-test-bucket'
         pkg_registry = self.S3PackageRegistryDefault(PhysicalKey.from_url(registry))
@@ -2633,12 +2898,232 @@ class PackageTest(QuiltTestCase):
         Package.install(pkg_name, registry=registry, dest=dest, path=path)
 
         path = pathlib.Path.cwd() / dest / 'bat'
-        mocked_cache_set.assert_called_once_with(
-            entry_url,
-            PhysicalKey.from_path(path).path,
-        )
+        mocked_cache_set.assert_called_once_with([(entry_url, PhysicalKey.from_path(path).path)])
         assert path.read_bytes() == entry_content
 
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    def test_object_path_cache(self):
+        files = [pathlib.Path(name).resolve() for name in ('a', 'b', 'legacy')]
+        for file in files:
+            file.write_bytes(b'42')
+        urls = [f's3://bucket/{file.name}' for file in files]
+
+        # A JSON file per URL, as cached by older versions.
+        legacy_key = quilt3.packages._filesystem_safe_encode(urls[2])
+        legacy_cache_file = quilt3.packages.CACHE_PATH / legacy_key[:2] / legacy_key[2:]
+        legacy_cache_file.parent.mkdir(parents=True)
+        stat = files[2].stat()
+        legacy_cache_file.write_text(json.dumps([str(files[2]), stat.st_dev, stat.st_ino, stat.st_mtime_ns]))
+
+        ObjectPathCache.set_many([(urls[0], str(files[0])), (urls[1], str(files[1]))])
+        assert not legacy_cache_file.exists()
+        assert ObjectPathCache.get_many(urls + ['s3://bucket/missing']) == {
+            url: str(file) for url, file in zip(urls, files, strict=True)
+        }
+
+        # Changed files are not returned.
+        os.utime(files[0], ns=(0, 0))
+        files[1].unlink()
+        assert ObjectPathCache.get_many(urls) == {urls[2]: str(files[2])}
+        assert ObjectPathCache.get(urls[0]) is None
+
+        ObjectPathCache.set(urls[0], str(files[0]))
+        assert ObjectPathCache.get(urls[0]) == str(files[0])
+
+    def test_object_path_cache_unusable(self):
+        file = pathlib.Path('a').resolve()
+        file.write_bytes(b'42')
+
+        # The cache directory can't be created under a regular file.
+        with patch('quilt3.packages.CACHE_PATH', file / 'cache'):
+            ObjectPathCache.set('s3://bucket/a', str(file))
+            assert ObjectPathCache.get('s3://bucket/a') is None
+
+        locked = sqlite3.OperationalError('database is locked')
+        with (
+            patch('quilt3.packages.CACHE_PATH', pathlib.Path('cache').resolve()),
+            patch.object(quilt3.cache.Database, 'query', side_effect=locked),
+            patch.object(quilt3.cache.Database, 'transaction', side_effect=locked),
+        ):
+            ObjectPathCache.set('s3://bucket/a', str(file))
+            assert ObjectPathCache.get('s3://bucket/a') is None
+
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    def test_content_cache(self):
+        def key(data):
+            return checksums.SHA256_CHUNKED_HASH_NAME, checksums.calculate_multipart_checksum_bytes(
+                data, checksum_type=checksums.SHA256_CHUNKED_HASH_NAME
+            )
+
+        paths = {}
+        for name in ('a', 'b', 'c'):
+            paths[name] = pathlib.Path(name).resolve()
+            paths[name].write_bytes(name.encode() * 10)
+
+        # The cache is disabled by default.
+        ContentCache.add_many([(key(b'a' * 10), str(paths['a']))])
+        assert ContentCache.stats() == (0, 0)
+
+        with patch('quilt3.packages.CONTENT_CACHE_MAX_SIZE', 25):
+            # Files that don't match their hash are not added.
+            ContentCache.add_many([(key(b'a' * 10), str(paths['a'])), (key(b'x' * 10), str(paths['b']))])
+            assert ContentCache.stats() == (1, 10)
+            cached_a = ContentCache.get(key(b'a' * 10))
+            assert pathlib.Path(cached_a).read_bytes() == b'a' * 10
+            assert ContentCache.get(key(b'x' * 10)) is None
+
+            # Files that can't be hard-linked are not copied.
+            with patch('os.link', side_effect=OSError('Invalid cross-device link')):
+                ContentCache.add_many([(key(b'b' * 10), str(paths['b']))])
+            assert ContentCache.get(key(b'b' * 10)) is None
+            assert ContentCache.stats() == (1, 10)
+
+            # The least recently used object is removed.
+            ContentCache.add_many([(key(b'b' * 10), str(paths['b']))])
+            assert ContentCache.get(key(b'a' * 10)) == cached_a
+            ContentCache.add_many([(key(b'c' * 10), str(paths['c']))])
+            assert ContentCache.stats() == (2, 20)
+            assert ContentCache.get_many([key(b'a' * 10), key(b'b' * 10), key(b'c' * 10)]).keys() == {
+                key(b'a' * 10),
+                key(b'c' * 10),
+            }
+
+            # Modified objects are not returned.
+            with open(cached_a, 'ab') as f:
+                f.write(b'a')
+            assert ContentCache.get(key(b'a' * 10)) is None
+            assert ContentCache.stats() == (1, 10)
+
+        assert ContentCache.prune() == 1
+        assert ContentCache.stats() == (0, 0)
+
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
+    @patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
+    @patch('quilt3.packages.CONTENT_CACHE_MAX_SIZE', 1024)
+    def test_install_duplicates(self):
+        registry = 's3://my-test-bucket'
+        pkg_registry = self.S3PackageRegistryDefault(PhysicalKey.from_url(registry))
+        pkg_name = 'Quilt/Foo'
+
+        def manifest(entries):
+            lines = [{'version': 'v0'}]
+            for lk, url, data in entries:
+                hash_value = checksums.calculate_multipart_checksum_bytes(
+                    data, checksum_type=checksums.SHA256_CHUNKED_HASH_NAME
+                )
+                lines.append(
+                    {
+                        'logical_key': lk,
+                        'physical_keys': [url],
+                        'size': len(data),
+                        'hash': {'type': checksums.SHA256_CHUNKED_HASH_NAME, 'value': hash_value},
+                        'meta': {},
+                    }
+                )
+            return b''.join(json.dumps(line).encode() + b'\n' for line in lines)
+
+        # Objects with the same hash are downloaded once.
+        self.setup_s3_stubber_pkg_install(
+            pkg_registry,
+            pkg_name,
+            manifest=manifest(
+                [
+                    ('a', 's3://bucket/a', b'42'),
+                    ('b', 's3://bucket/b', b'42'),
+                    ('c', 's3://bucket/c', b'43'),
+                ]
+            ),
+            entries=(('s3://bucket/a', b'42'), ('s3://bucket/c', b'43')),
+        )
+        with patch(
+            'quilt3.packages._matching_local_files', wraps=quilt3.packages._matching_local_files
+        ) as matching_mock:
+            Package.install(pkg_name, registry=registry, dest='package')
+        # Each downloaded file is hashed once, for both the content cache and the duplicates.
+        [[files], _] = matching_mock.call_args
+        assert sorted(pathlib.Path(path).name for _, path in files) == ['a', 'c']
+        matching_mock.assert_called_once()
+        for name, data in (('a', b'42'), ('b', b'42'), ('c', b'43')):
+            assert (pathlib.Path('package') / name).read_bytes() == data
+        assert ObjectPathCache.get('s3://bucket/b') == str((pathlib.Path('package') / 'b').resolve())
+
+        # Objects in the content cache are not downloaded again, even from another URL.
+        self.setup_s3_stubber_pkg_install(
+            pkg_registry,
+            pkg_name,
+            top_hash='0' * 64,
+            manifest=manifest([('d', 's3://other-bucket/d', b'43')]),
+        )
+        Package.install(pkg_name, registry=registry, dest='other')
+        assert (pathlib.Path('other') / 'd').read_bytes() == b'43'
+
+    @pytest.mark.usefixtures('isolate_packages_cache')
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
+    @patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
+    def test_install_incremental(self):
+        registry = 's3://my-test-bucket'
+        pkg_registry = self.S3PackageRegistryDefault(PhysicalKey.from_url(registry))
+        pkg_name = 'Quilt/Foo'
+        lines = [{'version': 'v0'}]
+        for lk, data in (('a', b'51'), ('b', b'52'), ('dir/c', b'531')):
+            lines.append(
+                {
+                    'logical_key': lk,
+                    'physical_keys': [f's3://bucket/{lk}'],
+                    'size': len(data),
+                    'hash': {
+                        'type': checksums.SHA256_CHUNKED_HASH_NAME,
+                        'value': checksums.calculate_multipart_checksum_bytes(
+                            data, checksum_type=checksums.SHA256_CHUNKED_HASH_NAME
+                        ),
+                    },
+                    'meta': {},
+                }
+            )
+        dest = pathlib.Path('package')
+        (dest / 'dir').mkdir(parents=True)
+        (dest / 'extra').mkdir()
+        (dest / 'a').write_bytes(b'51')
+        (dest / 'b').write_bytes(b'50')
+        (dest / 'dir' / 'c').write_bytes(b'53')
+        (dest / 'extra' / 'e').write_bytes(b'54')
+
+        # Only the changed and the truncated files are downloaded.
+        self.setup_s3_stubber_pkg_install(
+            pkg_registry,
+            pkg_name,
+            manifest=b''.join(json.dumps(line).encode() + b'\n' for line in lines),
+            entries=(('s3://bucket/b', b'52'), ('s3://bucket/dir/c', b'531')),
+        )
+        Package.install(pkg_name, registry=registry, dest=str(dest), incremental=True, delete_extra=True)
+        for name, data in (('a', b'51'), ('b', b'52'), ('dir/c', b'531')):
+            assert (dest / name).read_bytes() == data
+        assert not (dest / 'extra').exists()
+
+        # Files outside of the installed path are not deleted.
+        with pytest.raises(QuiltException, match="can't be combined with 'path'"):
+            Package.install(pkg_name, registry=registry, dest=str(dest), path='a', delete_extra=True)
+        assert (dest / 'b').read_bytes() == b'52'
+
+        with pytest.raises(QuiltException, match='local destination'):
+            Package().fetch('s3://bucket/dest', incremental=True)
+
+        # Files in the current directory aren't deleted unless it's the explicit destination.
+        pathlib.Path('not-in-package').write_bytes(b'')
+        with pytest.raises(QuiltException, match="requires 'dest'"):
+            Package().fetch(delete_extra=True)
+        assert pathlib.Path('not-in-package').exists()
+
+        with (
+            patch('quilt3.packages.DISABLE_TQDM', True),
+            patch('builtins.print') as print_mock,
+            self.assertLogs('quilt3.packages', 'INFO') as logs,
+        ):
+            quilt3.packages._skip_unchanged_entries([], PhysicalKey.from_path(str(dest)))
+        print_mock.assert_not_called()
+        assert logs.output == ['INFO:quilt3.packages:Skipped 0 unchanged objects (0 B)']
+
     def test_install_bad_name(self):
         with self.assertRaisesRegex(QuiltException, 'Invalid package name'):
             Package().install('?')
@@ -2971,13 +3456,13 @@ class PackageTest(QuiltTestCase):
                 'ChecksumAlgorithm': 'SHA256',
             },
         )
-        push_manifest_mock = self.patch_s3_registry('push_manifest')
+        push_manifest_mock = self.patch_s3_registry('push_manifest_stream')
         self.patch_s3_registry('shorten_top_hash', return_value='7a67ff4')
         pkg.push(pkg_name, registry='s3://test-bucket', dest=dest_fn, force=True)
 
         dest_fn.assert_called_once_with(lk, pkg[lk])
         push_manifest_mock.assert_called_once_with(pkg_name, mock.sentinel.top_hash, ANY)
-        assert Package.load(BytesIO(push_manifest_mock.call_args[0][2]))[lk].physical_key == PhysicalKey(
+        assert _load_pushed_manifest(push_manifest_mock)[lk].physical_key == PhysicalKey(
             dest_bucket, dest_key, version
         )
 
@@ -2995,7 +3480,7 @@ class PackageTest(QuiltTestCase):
             pkg.set(lk, f's3://{src_bucket}/{src_key}')
 
         selector_fn = mock.MagicMock(return_value=False)
-        push_manifest_mock = self.patch_s3_registry('push_manifest')
+        push_manifest_mock = self.patch_s3_registry('push_manifest_stream')
         self.patch_s3_registry('shorten_top_hash', return_value='7a67ff4')
         with patch('quilt3.packages.calculate_multipart_checksum', return_value=["a" * 64]) as calculate_checksum_mock:
             pkg.push(pkg_name, registry=f's3://{dst_bucket}', selector_fn=selector_fn, force=True)
@@ -3005,7 +3490,7 @@ class PackageTest(QuiltTestCase):
             [FileChecksumTask.create(PhysicalKey(src_bucket, src_key, src_version), 0, checksums.DEFAULT_HASH)]
         )
         push_manifest_mock.assert_called_once_with(pkg_name, mock.sentinel.top_hash, ANY)
-        assert Package.load(BytesIO(push_manifest_mock.call_args[0][2]))[lk].physical_key == PhysicalKey(
+        assert _load_pushed_manifest(push_manifest_mock)[lk].physical_key == PhysicalKey(
             src_bucket, src_key, src_version
         )
 
@@ -3044,7 +3529,7 @@ class PackageTest(QuiltTestCase):
                 'ChecksumAlgorithm': 'SHA256',
             },
         )
-        push_manifest_mock = self.patch_s3_registry('push_manifest')
+        push_manifest_mock = self.patch_s3_registry('push_manifest_stream')
         self.patch_s3_registry('shorten_top_hash', return_value='7a67ff4')
         with patch('quilt3.packages.calculate_multipart_checksum', return_value=[]) as calculate_checksum_mock:
             pkg.push(pkg_name, registry=f's3://{dst_bucket}', selector_fn=selector_fn, force=True)
@@ -3052,7 +3537,7 @@ class PackageTest(QuiltTestCase):
         selector_fn.assert_called_once_with(lk, pkg[lk])
         calculate_checksum_mock.assert_called_once_with([])
         push_manifest_mock.assert_called_once_with(pkg_name, mock.sentinel.top_hash, ANY)
-        assert Package.load(BytesIO(push_manifest_mock.call_args[0][2]))[lk].physical_key == PhysicalKey(
+        assert _load_pushed_manifest(push_manifest_mock)[lk].physical_key == PhysicalKey(
             dst_bucket, dst_key, dst_version
         )
 
@@ -3108,6 +3593,70 @@ class PackageTest(QuiltTestCase):
         copied_sources = {str(fk) for fk, _, _ in file_list}
         assert copied_sources == {local_file_uri}
 
+    @patch('quilt3.workflows.validate', mock.MagicMock(return_value=None))
+    @patch('quilt3.Package._push_manifest', mock.MagicMock())
+    @patch('quilt3.packages.copy_file_list')
+    def test_push_duplicate_hashes(self, copy_file_list_mock):
+        self.patch_s3_registry('shorten_top_hash', return_value='7a67ff4')
+        copy_file_list_mock.side_effect = lambda file_list, message=None, src_checksums=None: [
+            (PhysicalKey(dest.bucket, dest.path, 'v1'), None) for _, dest, _ in file_list
+        ]
+        hashes = {'a': 'a' * 64, 'b': 'a' * 64, 'c': 'c' * 64, 'd': 'a' * 64}
+
+        def package(physical_key):
+            pkg = Package()
+            for lk, hash_value in hashes.items():
+                pkg.set(
+                    lk,
+                    PackageEntry(
+                        physical_key(lk), 1, {'type': checksums.SHA256_CHUNKED_HASH_NAME, 'value': hash_value}, {}
+                    ),
+                )
+            return pkg
+
+        def dest_key(lk, version_id=None):
+            return PhysicalKey('dst-bucket', f'test/pkg/{lk}', version_id)
+
+        # Objects with the same hash are copied once, and their other entries point at that copy.
+        local_paths = {lk: str(pathlib.Path(lk).resolve()) for lk in hashes}
+        pkg = package(lambda lk: PhysicalKey.from_path(local_paths[lk]))
+        new_pkg = pkg.push('test/pkg', registry='s3://dst-bucket', force=True)
+        copy_file_list_mock.assert_called_once_with(
+            [
+                (PhysicalKey.from_path(local_paths['a']), dest_key('a'), 1),
+                (PhysicalKey.from_path(local_paths['c']), dest_key('c'), 1),
+            ],
+            message='Copying objects',
+        )
+        for lk in 'abd':
+            assert new_pkg[lk].physical_key == dest_key('a', 'v1')
+            assert new_pkg[lk].hash == pkg[lk].hash
+        assert new_pkg['c'].physical_key == dest_key('c', 'v1')
+
+        copy_file_list_mock.reset_mock()
+        pkg = package(lambda lk: PhysicalKey('src-bucket', lk, 'v0'))
+        new_pkg = pkg.push('test/pkg', registry='s3://dst-bucket', force=True)
+        copy_file_list_mock.assert_called_once_with(
+            [
+                (PhysicalKey('src-bucket', 'a', 'v0'), dest_key('a'), 1),
+                (PhysicalKey('src-bucket', 'c', 'v0'), dest_key('c'), 1),
+            ],
+            message='Copying objects',
+            src_checksums=['a' * 64, 'c' * 64],
+        )
+        for lk in 'abd':
+            assert new_pkg[lk].physical_key == dest_key('a', 'v1')
+        assert new_pkg['c'].physical_key == dest_key('c', 'v1')
+
+        # Entries copied to the same destination share the copy.
+        copy_file_list_mock.reset_mock()
+        new_pkg = pkg.push(
+            'test/pkg', registry='s3://dst-bucket', dest=lambda lk, entry: 's3://dst-bucket/x', force=True
+        )
+        copy_file_list_mock.assert_called_once()
+        for lk in 'abd':
+            assert new_pkg[lk].physical_key == PhysicalKey('dst-bucket', 'x', 'v1')
+
     def test_package_dump_file_mode(self):
         """
         Package.dump() works with both files opened in binary and text mode.
@@ -3172,13 +3721,13 @@ class PackageTestV2(PackageTest):
     LocalPackageRegistryDefault = LocalPackageRegistryV2
 
     def local_manifest_timestamp_fixer(self, timestamp):
-        wrapped = self.LocalPackageRegistryDefault.push_manifest
+        wrapped = self.LocalPackageRegistryDefault.push_manifest_stream
 
-        def wrapper(pkg_registry, pkg_name, top_hash, manifest_data):
-            wrapped(pkg_registry, pkg_name, top_hash, manifest_data)
+        def wrapper(pkg_registry, pkg_name, top_hash, write_manifest):
+            wrapped(pkg_registry, pkg_name, top_hash, write_manifest)
             os.utime(pkg_registry._manifest_parent_pk(pkg_name, top_hash).path, (timestamp, timestamp))
 
-        return patch.object(self.LocalPackageRegistryDefault, 'push_manifest', wrapper)
+        return patch.object(self.LocalPackageRegistryDefault, 'push_manifest_stream', wrapper)
 
     def _test_list_remote_packages_setup_stubber(self, pkg_registry, *, pkg_names):
         self.s3_stubber.add_response(
@@ -3351,33 +3900,27 @@ def test_set_dir_update_policy(
     ],
 )
 def test_set_dir_update_policy_s3(update_policy, expected_a_url, expected_xy_url):
-    with patch('quilt3.packages.list_object_versions') as list_object_versions_mock:
-        list_object_versions_mock.return_value = (
-            [
-                dict(Key='foo/a.txt', VersionId='xyz', IsLatest=True, Size=10),
-                dict(Key='foo/b.txt', VersionId='byc', IsLatest=True, Size=10),
-                dict(Key='foo/x/y.txt', VersionId='null', IsLatest=True, Size=10),
-                dict(Key='foo/z.txt', VersionId='123', IsLatest=False, Size=10),
-            ],
-            [],
-        )
+    with patch('quilt3.packages.iter_object_versions') as iter_object_versions_mock:
+        iter_object_versions_mock.return_value = [
+            dict(Key='foo/a.txt', VersionId='xyz', IsLatest=True, Size=10),
+            dict(Key='foo/b.txt', VersionId='byc', IsLatest=True, Size=10),
+            dict(Key='foo/x/y.txt', VersionId='null', IsLatest=True, Size=10),
+            dict(Key='foo/z.txt', VersionId='123', IsLatest=False, Size=10),
+        ]
         pkg = Package()
         pkg.set_dir('', 's3://bucket/foo/', meta={'name': 'test_meta'})
         assert 'c.txt' not in pkg.keys()
         assert pkg['a.txt'].get() == 's3://bucket/foo/a.txt?versionId=xyz'
         assert pkg['b.txt'].get() == 's3://bucket/foo/b.txt?versionId=byc'
         assert pkg['x/y.txt'].get() == 's3://bucket/foo/x/y.txt?versionId=null'
-        list_object_versions_mock.assert_called_once_with('bucket', 'foo/')
+        iter_object_versions_mock.assert_called_once_with('bucket', 'foo/', parallel=False)
 
-        list_object_versions_mock.return_value = (
-            [
-                dict(Key='bar/a.txt', VersionId='abc', IsLatest=True, Size=10),
-                dict(Key='bar/c.txt', VersionId='cyb', IsLatest=True, Size=10),
-                dict(Key='bar/x/y.txt', VersionId='null', IsLatest=True, Size=10),
-                dict(Key='bar/z.txt', VersionId='123', IsLatest=True, Size=10),
-            ],
-            [],
-        )
+        iter_object_versions_mock.return_value = [
+            dict(Key='bar/a.txt', VersionId='abc', IsLatest=True, Size=10),
+            dict(Key='bar/c.txt', VersionId='cyb', IsLatest=True, Size=10),
+            dict(Key='bar/x/y.txt', VersionId='null', IsLatest=True, Size=10),
+            dict(Key='bar/z.txt', VersionId='123', IsLatest=True, Size=10),
+        ]
         if update_policy:
             pkg.set_dir('', 's3://bucket/bar', update_policy=update_policy)
         else:
@@ -3387,8 +3930,10 @@ def test_set_dir_update_policy_s3(update_policy, expected_a_url, expected_xy_url
         assert pkg['c.txt'].get() == 's3://bucket/bar/c.txt?versionId=cyb'
         assert pkg['x/y.txt'].get() == expected_xy_url
         assert pkg['z.txt'].get() == 's3://bucket/bar/z.txt?versionId=123'
-        assert list_object_versions_mock.call_count == 2
-        list_object_versions_mock.assert_has_calls([call('bucket', 'foo/'), call('bucket', 'bar/')])
+        assert iter_object_versions_mock.call_count == 2
+        iter_object_versions_mock.assert_has_calls(
+            [call('bucket', 'foo/', parallel=False), call('bucket', 'bar/', parallel=False)]
+        )
 
 
 def create_test_file(filename):
@@ -3422,6 +3967,258 @@ def test_loading_duplicate_logical_key_error():
         Package.load(buf)
 
 
+class NonSeekableStream:
+    def __init__(self, data: bytes):
+        self._buf = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._buf.read(size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+@pytest.mark.parametrize("binary", [True, False])
+def test_load_non_seekable_stream(chunk_size, binary):
+    pkg = Package()
+    pkg.set_meta({"foo": "bar"})
+    pkg.set("a/b.txt", PackageEntry(PhysicalKey("bucket", "a/b.txt", "v1"), 1, None, {"user_meta": {"m": "ü"}}))
+    pkg.set("a.txt", PackageEntry(PhysicalKey("bucket", "a.txt", None), 2, None, None))
+    pkg["a"].set_meta({"dir": True})
+    buf = io.BytesIO()
+    pkg.dump(buf)
+    data = buf.getvalue()
+
+    with mock.patch("quilt3.packages.MANIFEST_READ_CHUNK_SIZE", chunk_size):
+        stream = NonSeekableStream(data) if binary else io.StringIO(data.decode())
+        loaded = Package.load(stream)
+
+    assert loaded.meta == {"foo": "bar"}
+    assert loaded["a"].meta == {"dir": True}
+    assert loaded["a/b.txt"].meta == {"m": "ü"}
+    assert loaded["a/b.txt"].physical_key == PhysicalKey("bucket", "a/b.txt", "v1")
+    assert loaded["a.txt"].size == 2
+    assert list(loaded.manifest) == list(pkg.manifest)
+
+
+def test_load_pipe():
+    pkg = Package()
+    pkg.set("foo", PackageEntry(PhysicalKey("bucket", "foo", None), 1, None, None))
+    buf = io.BytesIO()
+    pkg.dump(buf)
+
+    r, w = os.pipe()
+    with os.fdopen(r, "rb") as reader:
+        with os.fdopen(w, "wb") as writer:
+            writer.write(buf.getvalue())
+        loaded = Package.load(reader)
+
+    assert list(loaded.manifest) == list(pkg.manifest)
+
+
+def _make_test_package():
+    pkg = Package()
+    pkg.set_meta({"foo": "bar"})
+    for i, lk in enumerate(["a/b/c.txt", "a/b.txt", "a.b", "a-b/c", "d", "a/b/d/e.txt", "ü/x"]):
+        pkg.set(
+            lk,
+            PackageEntry(
+                PhysicalKey("bucket", lk, f"v{i}"),
+                i,
+                {"type": checksums.SHA256_HASH_NAME, "value": f"{i:064x}"},
+                {"user_meta": {"i": i}} if i % 2 else None,
+            ),
+        )
+    pkg["a/b"].set_meta({"dir": "a/b"})
+    pkg["a-b"].set_meta({"dir": "a-b"})
+    return pkg
+
+
+def test_load_compact():
+    pkg = _make_test_package()
+    buf = io.BytesIO()
+    pkg.dump(buf)
+
+    compact = Package.load(io.BytesIO(buf.getvalue()), compact=True)
+
+    assert compact.meta == {"foo": "bar"}
+    assert compact.top_hash == pkg.top_hash
+    assert list(compact.manifest) == list(pkg.manifest)
+    assert compact["a/b/c.txt"] == pkg["a/b/c.txt"]
+    assert compact["a/b/c.txt"].physical_key == PhysicalKey("bucket", "a/b/c.txt", "v0")
+    assert compact["a/b"].meta == {"dir": "a/b"}
+    assert "a/b/nope" not in compact
+    assert sorted(compact.keys()) == sorted(pkg.keys())
+    assert [lk for lk, _ in compact.walk()] == [lk for lk, _ in pkg.walk()]
+    assert [lk for lk, _ in compact["a"].walk()] == [lk for lk, _ in pkg["a"].walk()]
+    assert list(compact._walk_dir_meta()) == list(pkg._walk_dir_meta())
+
+
+def test_load_compact_mutations():
+    pkg = _make_test_package()
+    buf = io.BytesIO()
+    pkg.dump(buf)
+    compact = Package.load(io.BytesIO(buf.getvalue()), compact=True)
+
+    # Entries handed out are kept, so changes made to them are not lost.
+    for p in (pkg, compact):
+        p["a/b/d/e.txt"].set_meta({"changed": True})
+    assert compact.top_hash == pkg.top_hash
+
+    for p in (pkg, compact):
+        p.delete("a/b/c.txt")
+        p.set(
+            "a/b/new", PackageEntry(PhysicalKey("bucket", "new", None), 10, {"type": "SHA256", "value": "0" * 64}, {})
+        )
+        p["ü"].set_meta({"dir": "ü"})
+    assert compact.top_hash == pkg.top_hash
+    assert list(compact.manifest) == list(pkg.manifest)
+
+    with pytest.raises(KeyError):
+        compact.delete("a/b/c.txt")
+
+
+def _reference_top_hash(pkg):
+    """Top hash computed from scratch, the way it was done before it was cached."""
+    top_hash = hashlib.sha256()
+    json_encode = json.JSONEncoder(sort_keys=True, separators=(",", ":")).encode
+    top_hash.update(json_encode(pkg._meta).encode())
+    for logical_key, entry in pkg.walk():
+        part = {"hash": entry.hash, "logical_key": logical_key, "meta": entry._meta, "size": entry.size}
+        top_hash.update(json_encode(part).encode())
+    return top_hash.hexdigest()
+
+
+def _mutate_randomly(rnd, pkg):
+    keys = [lk for lk, _ in pkg.walk()]
+    dirs = sorted({lk.rpartition("/")[0] for lk in keys} - {""})
+    new_key = "/".join(rnd.choice("abc") for _ in range(rnd.randint(1, 3))) + rnd.choice(["", ".txt"])
+    new_entry = PackageEntry(
+        PhysicalKey("bucket", new_key, None), rnd.randint(0, 5), {"type": "SHA256", "value": rnd.choice("01") * 64}, {}
+    )
+    op = rnd.randrange(9)
+    try:
+        if op == 0 or not keys:
+            pkg.set(new_key, new_entry)
+        elif op == 1:
+            pkg.delete(rnd.choice(keys))
+        elif op == 2:
+            pkg[rnd.choice(keys)].set_meta({"n": rnd.random()})
+        elif op == 3:
+            pkg[rnd.choice(keys)].hash = new_entry.hash
+        elif op == 4:
+            pkg[rnd.choice(keys)].size = new_entry.size
+        elif op == 5:
+            key = rnd.choice(keys)
+            pkg.set(key, pkg[key].with_physical_key(new_entry.physical_key))
+        elif op == 6 and dirs:
+            pkg[rnd.choice(dirs)].set(rnd.choice("xyz"), new_entry)
+        elif op == 7 and dirs:
+            pkg[rnd.choice(dirs)].set_meta({"dir": rnd.random()})
+        elif op == 8:
+            pkg.set_meta({"n": rnd.random()})
+    except QuiltException:
+        pass  # Entry and directory conflict.
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_top_hash_random_mutations(seed):
+    rnd = random.Random(seed)
+    pkg = Package()
+    for _ in range(rnd.randint(0, 20)):
+        _mutate_randomly(rnd, pkg)
+    buf = io.BytesIO()
+    pkg.dump(buf)
+    compact = Package.load(io.BytesIO(buf.getvalue()), compact=True)
+
+    for _ in range(50):
+        for p in (pkg, compact):
+            _mutate_randomly(random.Random(rnd.random()), p)
+            if rnd.random() < 0.5:
+                assert p.top_hash == _reference_top_hash(p)
+    for p in (pkg, compact):
+        assert p.top_hash == _reference_top_hash(p)
+
+
+def test_top_hash_shared_entry():
+    entry = PackageEntry(
+        PhysicalKey("bucket", "key", None), 1, {"type": "SHA256", "value": "0" * 64}, {"user_meta": {"initial": True}}
+    )
+    pkg = Package().set("a", entry).set("b/c", entry)
+    assert pkg.top_hash == _reference_top_hash(pkg)
+
+    # Copies share the metadata dict.
+    entry.with_physical_key(PhysicalKey("bucket", "other", None)).set_meta({"changed": True})
+    assert pkg.top_hash == _reference_top_hash(pkg)
+    PackageEntry(PhysicalKey("bucket", "other", None), 1, None, entry._meta).set_meta({"changed": False})
+    assert pkg.top_hash == _reference_top_hash(pkg)
+    assert pkg["b/c"].meta == {"changed": False}
+
+    with pytest.raises(QuiltException, match="missing hash"):
+        pkg.set("d", PackageEntry(PhysicalKey("bucket", "d", None), None, None, {})).top_hash
+
+
+def test_top_hash_meta_mutated_in_place():
+    user_meta = {"x": 1}
+    entry = PackageEntry(PhysicalKey("bucket", "c.txt", None), 1, {"type": "SHA256", "value": "0" * 64}, {})
+    entry.set_meta(user_meta)
+    pkg = Package().set("c.txt", entry).set("d/e.txt", entry.with_physical_key(entry.physical_key))
+    pkg.top_hash
+
+    pkg["c.txt"].meta["x"] = 2
+    buf = io.BytesIO()
+    pkg.dump(buf)
+    assert pkg.top_hash == _reference_top_hash(pkg)
+    assert pkg.top_hash == Package.load(io.BytesIO(buf.getvalue())).top_hash
+
+    user_meta["y"] = 3
+    pkg["d/e.txt"]._meta["other"] = True
+    buf = io.BytesIO()
+    pkg.dump(buf)
+    assert pkg.top_hash == _reference_top_hash(pkg)
+    assert pkg.top_hash == Package.load(io.BytesIO(buf.getvalue())).top_hash
+
+
+def _reference_walk(pkg, prefix=""):
+    """`Package.walk()` that sorts every directory level again."""
+    for name, child in sorted(pkg._children.items()):
+        if isinstance(child, PackageEntry):
+            yield f"{prefix}{name}", child
+        else:
+            yield from _reference_walk(child, f"{prefix}{name}/")
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_walk_random_mutations(seed):
+    rnd = random.Random(seed)
+    pkg = Package()
+    for _ in range(100):
+        _mutate_randomly(rnd, pkg)
+        if rnd.random() < 0.5:
+            assert list(pkg.walk()) == list(_reference_walk(pkg))
+    assert list(pkg.walk()) == list(_reference_walk(pkg))
+
+
+def test_walk_sorts_once():
+    entry = PackageEntry(PhysicalKey("bucket", "key", None), 1, {"type": "SHA256", "value": "0" * 64}, {})
+    pkg = Package().set("b", entry).set("a/d", entry).set("a/c", entry)
+
+    with patch("quilt3.packages.sorted", side_effect=sorted, create=True) as sorted_mock:
+        for _ in range(3):
+            assert [lk for lk, _ in pkg.walk()] == ["a/c", "a/d", "b"]
+            pkg.top_hash
+            list(pkg.manifest)
+        assert sorted_mock.call_count == 2
+
+        # Only the changed directory is sorted again.
+        pkg.set("a/a", entry)
+        assert [lk for lk, _ in pkg.walk()] == ["a/a", "a/c", "a/d", "b"]
+        assert sorted_mock.call_count == 3
+
+    keys = []
+    entries = []
+    pkg._walk_into(lambda lk, e: keys.append(lk), lambda lk, e: entries.append(e))
+    assert list(zip(keys, entries, strict=True)) == list(pkg.walk())
+
+
 def test_directory_not_exist_error():
     pkg = Package()
     with pytest.raises(PackageException, match="The specified directory .*non_existent_directory'. doesn't exist"):
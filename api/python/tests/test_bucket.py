@@ -15,6 +15,7 @@ class TestBucket(QuiltTestCase):
     def test_bucket_construct(self):
         Bucket('s3://test-bucket')
 
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     def test_bucket_fetch(self):
         bucket = Bucket('s3://test-bucket')
 
@@ -107,6 +108,29 @@ class TestBucket(QuiltTestCase):
         with pytest.raises(QuiltException):
             bucket.fetch('does/not/exist/', './')
 
+    def test_bucket_ls_recursive(self):
+        bucket = Bucket('s3://test-bucket')
+
+        # Subdirectories aren't listed separately unless `parallel` is set.
+        self.s3_stubber.add_response(
+            method='list_object_versions',
+            service_response={
+                'IsTruncated': False,
+                'Versions': [
+                    {'Key': 'dir/a', 'VersionId': 'v1', 'IsLatest': True, 'Size': 1},
+                    {'Key': 'dir/foo/b', 'VersionId': 'v2', 'IsLatest': True, 'Size': 2},
+                ],
+            },
+            expected_params={
+                'Bucket': 'test-bucket',
+                'Prefix': 'dir/',
+            },
+        )
+
+        versions, delete_markers = bucket.ls('dir', recursive=True)
+        assert [v['Key'] for v in versions] == ['dir/a', 'dir/foo/b']
+        assert delete_markers == []
+
     def test_bucket_select(self):
         # Stubber doesn't have an accurate shape for the results of select_object_content
         chunks = [
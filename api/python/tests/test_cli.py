@@ -197,6 +197,17 @@ def test_list_packages(capsys):
         assert captured.out.split() == pkg_names
 
 
+def test_diff(capsys):
+    with patch_package_class as mocked_package_class:
+        mocked_package_class.diff_manifests.return_value = iter(
+            [('modified', 'a/b'), ('deleted', 'c'), ('added', 'e')]
+        )
+        main.main(('diff', 'test/name', 'abcdef', '123456', '--registry', 's3://bucket'))
+
+        mocked_package_class.diff_manifests.assert_called_once_with('s3://bucket', 'test/name', 'abcdef', '123456')
+        assert capsys.readouterr().out == 'M\ta/b\nD\tc\nA\te\n'
+
+
 def test_push_no_copy():
     name = 'test/name'
     dir_path = 's3://test/dir/path'
@@ -227,3 +238,24 @@ def test_push_no_copy_local_dir(capsys):
     assert main.main(('push', '--dir', dir_path, '--no-copy', name)) == 1
     captured = capsys.readouterr()
     assert "--no-copy flag can be specified only for remote data." in captured.err
+
+
+def test_cache(capsys):
+    with patch('quilt3.packages.ContentCache') as content_cache_mock:
+        content_cache_mock.stats.return_value = (3, 1024)
+        content_cache_mock.prune.return_value = 2
+
+        main.main(('cache',))
+        content_cache_mock.prune.assert_not_called()
+        assert 'Objects: 3\nSize: 1024 B\n' in capsys.readouterr().out
+
+        main.main(('cache', '--prune'))
+        content_cache_mock.prune.assert_called_once_with(0)
+        assert capsys.readouterr().out.startswith('Removed 2 objects from the cache.\n')
+
+        content_cache_mock.prune.reset_mock()
+        main.main(('cache', '--prune', '512'))
+        content_cache_mock.prune.assert_called_once_with(512)
+
+    with pytest.raises(SystemExit):
+        main.main(('cache', '--prune', '-1'))
@@ -3,8 +3,10 @@
 import io
 import os
 import pathlib
+import threading
 import time
 import unittest
+from concurrent.futures import Future
 from contextlib import redirect_stderr
 from unittest import mock
 
@@ -161,6 +163,100 @@ class DataTransferTest(QuiltTestCase):
             ("x/blah.txt", 6),
         }
 
+    @pytest.mark.skipif(os.name == 'nt', reason="Creating symlinks requires extra privileges on Windows")
+    def test_scan_local_dir(self):
+        root = pathlib.Path('root')
+        for path in ('a', 'b/c', 'b/d/e', 'ignored/f', 'b/ignored.txt'):
+            (root / path).parent.mkdir(parents=True, exist_ok=True)
+            (root / path).write_text(path)
+        (root / 'empty').mkdir()
+        outside = pathlib.Path('outside')
+        outside.mkdir()
+        (outside / 'file').write_text('outside')
+        (root / 'link-to-file').symlink_to(outside.resolve() / 'file')
+        (root / 'link-to-dir').symlink_to(outside.resolve(), target_is_directory=True)
+        (root / 'broken-link').symlink_to(root.resolve() / 'missing')
+
+        def ignore(path, is_dir):
+            return path.endswith(os.path.join('', 'ignored') if is_dir else 'ignored.txt')
+
+        real_root = PhysicalKey.from_path(root).path.rstrip('/')
+        with mock.patch.object(data_transfer, 'MAX_CONCURRENCY', 2):
+            results = list(data_transfer.scan_local_dir(real_root, ignore))
+
+        assert sorted((dir_key, sorted(files)) for dir_key, files in results) == [
+            (
+                (),
+                [
+                    ('a', f'{real_root}/a', 1),
+                    ('link-to-file', PhysicalKey.from_path(outside / 'file').path, 7),
+                ],
+            ),
+            (('b',), [('c', f'{real_root}/b/c', 3)]),
+            (('b', 'd'), [('e', f'{real_root}/b/d/e', 5)]),
+        ]
+
+    def test_list_parallel(self):
+        keys = sorted(
+            ['a', 'b/c', 'b/d/e', 'b/d/f', 'b/g/h', 'i/j', 'i/k', 'i/l/m', 'i/l/n', 'i/l/o', 'p/q/r/s']
+            + [f'p/t/{i:02}' for i in range(10)]
+        )
+        requests = []
+
+        def list_page(*, Bucket, Prefix, Delimiter=None, ContinuationToken=None, KeyMarker=None):
+            # Pages of 2 keys or common prefixes, markers are indices of the next item.
+            requests.append((Prefix, Delimiter))
+            items = []
+            for key in keys:
+                if not key.startswith(Prefix):
+                    continue
+                sep = key.find('/', len(Prefix)) if Delimiter else -1
+                item = ('CommonPrefixes', key[: sep + 1]) if sep != -1 else ('Contents', key)
+                if item not in items:
+                    items.append(item)
+            start = int(ContinuationToken or KeyMarker or 0)
+            page = items[start : start + 2]
+            response = {
+                'IsTruncated': start + 2 < len(items),
+                'NextContinuationToken': str(start + 2),
+                'NextKeyMarker': str(start + 2),
+                'Contents': [{'Key': v, 'Size': 0} for k, v in page if k == 'Contents'],
+                'Versions': [{'Key': v, 'VersionId': 'v'} for k, v in page if k == 'Contents'],
+                'CommonPrefixes': [{'Prefix': v} for k, v in page if k == 'CommonPrefixes'],
+            }
+            return response
+
+        with (
+            mock.patch.object(data_transfer, 'MAX_CONCURRENCY', 1),
+            mock.patch.object(self.s3_client, 'list_objects_v2', side_effect=list_page),
+        ):
+            assert sorted(obj['Key'] for obj in data_transfer.iter_objects('bucket', '', parallel=True)) == keys
+        # 'a' and 3 prefixes take 2 pages at the top level.
+        assert requests.count(('', '/')) == 2
+        # Prefixes discovered after 4 * MAX_CONCURRENCY are already waiting are listed without a delimiter.
+        assert ('p/t/', None) in requests
+        assert ('p/t/', '/') not in requests
+
+        with (
+            mock.patch.object(data_transfer, 'MAX_CONCURRENCY', 2),
+            mock.patch.object(self.s3_client, 'list_objects_v2', side_effect=list_page),
+            mock.patch.object(self.s3_client, 'list_object_versions', side_effect=list_page),
+        ):
+            assert sorted(obj['Key'] for obj in data_transfer.iter_objects('bucket', '', parallel=True)) == keys
+            assert sorted(obj['Key'] for obj in data_transfer.iter_objects('bucket', 'i/', parallel=True)) == [
+                key for key in keys if key.startswith('i/')
+            ]
+
+            versions, delete_markers = data_transfer.list_object_versions('bucket', '', parallel=True)
+            assert [v['Key'] for v in versions] == keys
+            assert delete_markers == []
+            assert [o['Key'] for o in data_transfer.list_objects('bucket', 'b/', parallel=True)] == [
+                'b/c',
+                'b/d/e',
+                'b/d/f',
+                'b/g/h',
+            ]
+
     def test_etag(self):
         assert data_transfer._calculate_etag(DATA_DIR / 'small_file.csv') == '"0bec5bf6f93c547bc9c6774acaf85e1a"'
         assert (
@@ -186,6 +282,7 @@ class DataTransferTest(QuiltTestCase):
 
         data_transfer.copy_file(PhysicalKey.from_path(path), PhysicalKey.from_url('s3://example/foo.csv'))
 
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     def test_multi_upload(self):
         path1 = DATA_DIR / 'small_file.csv'
         path2 = DATA_DIR / 'dir/foo.txt'
@@ -603,6 +700,7 @@ class DataTransferTest(QuiltTestCase):
             "Ij4KFgr52goD5t0sRxnFb11mpjPL6E54qqnzc1hlUio=",
         )
 
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     def test_multipart_upload(self):
         name = 'very_large_file.bin'
         path = pathlib.Path(name)
@@ -687,6 +785,91 @@ class DataTransferTest(QuiltTestCase):
                 ]
             )
 
+    def test_open_writer_local(self):
+        dest = pathlib.Path('dir', 'file')
+
+        with data_transfer.open_writer(PhysicalKey.from_path(dest)) as f:
+            f.write(b'old')
+        assert dest.read_bytes() == b'old'
+
+        with pytest.raises(ZeroDivisionError):
+            with data_transfer.open_writer(PhysicalKey.from_path(dest)) as f:
+                f.write(b'new')
+                1 / 0  # pylint: disable=pointless-statement
+        assert dest.read_bytes() == b'old'
+        assert list(dest.parent.iterdir()) == [dest]
+
+    def test_open_writer_single_part(self):
+        self.s3_stubber.add_response(
+            method='put_object',
+            service_response={'VersionId': 'v1'},
+            expected_params={'Bucket': 'example', 'Key': 'file', 'Body': b'abc'},
+        )
+
+        with data_transfer.open_writer(PhysicalKey('example', 'file', None)) as f:
+            f.write(b'a')
+            f.write(b'bc')
+
+    @mock.patch.object(data_transfer.s3_transfer_config, 'multipart_chunksize', 4)
+    @mock.patch('quilt3.data_transfer.WRITER_MAX_PENDING_PARTS', 1)
+    def test_open_writer_multipart(self):
+        self.s3_stubber.add_response(
+            method='create_multipart_upload',
+            service_response={'UploadId': '123'},
+            expected_params={'Bucket': 'example', 'Key': 'file'},
+        )
+        for part_num, body in enumerate([b'0123', b'4567', b'89'], 1):
+            self.s3_stubber.add_response(
+                method='upload_part',
+                service_response={'ETag': f'etag{part_num}'},
+                expected_params={
+                    'Bucket': 'example',
+                    'Key': 'file',
+                    'UploadId': '123',
+                    'Body': body,
+                    'PartNumber': part_num,
+                },
+            )
+        self.s3_stubber.add_response(
+            method='complete_multipart_upload',
+            service_response={'VersionId': 'v1'},
+            expected_params={
+                'Bucket': 'example',
+                'Key': 'file',
+                'UploadId': '123',
+                'MultipartUpload': {'Parts': [{'ETag': f'etag{i}', 'PartNumber': i} for i in range(1, 4)]},
+            },
+        )
+
+        with data_transfer.open_writer(PhysicalKey('example', 'file', None)) as f:
+            f.write(b'012')
+            f.write(b'3456789')
+
+    @mock.patch.object(data_transfer.s3_transfer_config, 'multipart_chunksize', 4)
+    @mock.patch('quilt3.data_transfer.WRITER_MAX_PENDING_PARTS', 1)
+    def test_open_writer_abort(self):
+        self.s3_stubber.add_response(
+            method='create_multipart_upload',
+            service_response={'UploadId': '123'},
+            expected_params={'Bucket': 'example', 'Key': 'file'},
+        )
+        self.s3_stubber.add_response(
+            method='upload_part',
+            service_response={'ETag': 'etag1'},
+            expected_params={'Bucket': 'example', 'Key': 'file', 'UploadId': '123', 'Body': b'0123', 'PartNumber': 1},
+        )
+        self.s3_stubber.add_response(
+            method='abort_multipart_upload',
+            service_response={},
+            expected_params={'Bucket': 'example', 'Key': 'file', 'UploadId': '123'},
+        )
+
+        with pytest.raises(ZeroDivisionError):
+            with data_transfer.open_writer(PhysicalKey('example', 'file', None)) as f:
+                f.write(b'01234')
+                1 / 0  # pylint: disable=pointless-statement
+
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     def test_multipart_copy(self):
         size = 100 * 1024 * 1024 * 1024
 
@@ -766,6 +949,51 @@ class DataTransferTest(QuiltTestCase):
                 )
             assert stderr.getvalue()
 
+    def test_copy_reuse_destination(self):
+        size = 100 * 1024 * 1024
+        src = PhysicalKey('example1', 'large_file1.npy', 'v1')
+        dest = PhysicalKey('example2', 'large_file2.npy', None)
+
+        def head_object(checksum):
+            self.s3_stubber.add_response(
+                method='head_object',
+                service_response={
+                    'ContentLength': size,
+                    'ChecksumSHA256': checksum,
+                    'VersionId': 'v2',
+                },
+                expected_params={'Bucket': 'example2', 'Key': 'large_file2.npy', 'ChecksumMode': 'ENABLED'},
+            )
+
+        def copy_remote_file(ctx, size, *args):
+            ctx.done(PhysicalKey('example2', 'large_file2.npy', 'v3'), None)
+
+        # The destination has the known checksum of the source: nothing is copied, and the source isn't read.
+        head_object('abc-13')
+        assert data_transfer.copy_file_list([(src, dest, size)], src_checksums=['abc']) == [
+            (PhysicalKey('example2', 'large_file2.npy', 'v2'), 'abc')
+        ]
+        self.s3_stubber.assert_no_pending_responses()
+
+        # The destination was uploaded in other parts, or has other content.
+        for checksum in ('abc-10', 'def-13'):
+            head_object(checksum)
+            with mock.patch.object(
+                data_transfer, '_copy_remote_file', side_effect=copy_remote_file
+            ) as copy_remote_file_mock:
+                data_transfer.copy_file_list([(src, dest, size)], src_checksums=['abc'])
+            copy_remote_file_mock.assert_called_once_with(
+                ANY, size, 'example1', 'large_file1.npy', 'v1', 'example2', 'large_file2.npy'
+            )
+            self.s3_stubber.assert_no_pending_responses()
+
+        # The destination isn't checked if the checksum of the source isn't known.
+        with mock.patch.object(
+            data_transfer, '_copy_remote_file', side_effect=copy_remote_file
+        ) as copy_remote_file_mock:
+            data_transfer.copy_file_list([(src, dest, size)])
+        copy_remote_file_mock.assert_called_once()
+
     @mock.patch('botocore.client.BaseClient._make_api_call')
     def test_calculate_sha256_read_timeout(self, mocked_api_call):
         bucket = 'test-bucket'
@@ -893,6 +1121,7 @@ class DataTransferTest(QuiltTestCase):
         multipart_threshold=1,
         multipart_chunksize=1,
     )
+    @pytest.mark.usefixtures('fixed_transfer_concurrency')
     @mock.patch('quilt3.data_transfer.MAX_CONCURRENCY', 1)
     def test_download_latest_in_versioned_bucket(self):
         bucket = 'example'
@@ -1037,6 +1266,15 @@ class S3DownloadTest(QuiltTestCase):
     def test_threshold_eq_chunk_gt_size(self):
         self._test_download(threshold=self.size, chunksize=self.size + 1)
 
+    def test_overwrite_with_small_io_chunks(self):
+        parts = {
+            'bytes=0-7': self.data[:8],
+            'bytes=8-15': self.data[8:],
+        }
+        pathlib.Path(self.filename).write_bytes(b'x' * (self.size * 2))
+        with mock.patch.object(data_transfer.s3_transfer_config, 'io_chunksize', 3):
+            self._test_download(threshold=self.size, chunksize=8, parts=parts)
+
 
 class S3HashingTest(QuiltTestCase):
     bucket = 'test-bucket'
@@ -1164,6 +1402,60 @@ def test_crc64nvme_local_file(tmp_path):
     assert result[0] == checksums.calculate_multipart_checksum_bytes(data, checksum_type=checksums.CRC64NVME_HASH_NAME)
 
 
+def test_checksum_cache(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b'Hello, World!')
+    old_mtime_ns = time.time_ns() - 10**10
+    os.utime(path, ns=(old_mtime_ns, old_mtime_ns))
+    task = data_transfer.FileChecksumTask.create(PhysicalKey.from_path(path), 13, checksums.SHA256_CHUNKED_HASH_NAME)
+    expected = checksums.calculate_multipart_checksum_bytes(
+        b'Hello, World!', checksum_type=task.checksum_calculator_cls.checksum_type
+    )
+
+    with mock.patch.object(
+        data_transfer, '_calculate_local_part_checksum', wraps=data_transfer._calculate_local_part_checksum
+    ) as part_checksum_mock:
+        assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+        assert part_checksum_mock.call_count == 1
+
+        # Unchanged file is not hashed again.
+        assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+        assert part_checksum_mock.call_count == 1
+
+        # A different hash type is cached separately.
+        crc_task = data_transfer.FileChecksumTask.create(task.physical_key, 13, checksums.CRC64NVME_HASH_NAME)
+        assert data_transfer.calculate_multipart_checksum([crc_task]) == ['1Km+Qyat0k0=']
+        assert part_checksum_mock.call_count == 2
+
+        # Modified file is hashed again, but not cached while its modification time is too recent.
+        path.write_bytes(b'Hello, Quilt!')
+        expected = checksums.calculate_multipart_checksum_bytes(
+            b'Hello, Quilt!', checksum_type=task.checksum_calculator_cls.checksum_type
+        )
+        assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+        assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+        assert part_checksum_mock.call_count == 4
+
+        with mock.patch('quilt3.util.IS_CACHE_ENABLED', False):
+            os.utime(path, ns=(old_mtime_ns, old_mtime_ns))
+            assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+            assert data_transfer.calculate_multipart_checksum([task]) == [expected]
+            assert part_checksum_mock.call_count == 6
+
+
+def test_checksum_cache_unusable(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b'Hello, World!')
+    old_mtime_ns = time.time_ns() - 10**10
+    os.utime(path, ns=(old_mtime_ns, old_mtime_ns))
+    task = data_transfer.FileChecksumTask.create(PhysicalKey.from_path(path), 13, checksums.CRC64NVME_HASH_NAME)
+
+    # The cache directory can't be created under a regular file.
+    with mock.patch('quilt3.data_transfer.CACHE_PATH', path / 'cache'):
+        assert data_transfer.calculate_multipart_checksum([task]) == ['1Km+Qyat0k0=']
+        assert data_transfer.calculate_multipart_checksum([task]) == ['1Km+Qyat0k0=']
+
+
 def test_s3_no_valid_client_error_renders_message():
     msg = 'S3 AccessDenied for S3Api.LIST_OBJECTS_V2 on bucket: some-bucket'
     err = data_transfer.S3NoValidClientError(msg)
@@ -1171,3 +1463,169 @@ def test_s3_no_valid_client_error_renders_message():
     assert str(err) == msg
     assert err.args == (msg,)
     assert err.message == msg
+
+
+def test_adaptive_executor():
+    changes = []
+
+    def on_change(concurrency):
+        # The executor isn't locked, so other threads can use it meanwhile.
+        thread = threading.Thread(target=executor.add_progress, args=(0,))
+        thread.start()
+        thread.join(timeout=1)
+        assert not thread.is_alive()
+        changes.append(concurrency)
+
+    with mock.patch.object(data_transfer.AdaptiveExecutor, 'WINDOW', 0.01):
+        with data_transfer.AdaptiveExecutor(2, 8, on_change=on_change) as executor:
+            order = []
+
+            def task(i):
+                order.append(i)
+                executor.add_progress(1 + i)  # Throughput keeps improving.
+                time.sleep(0.02)
+                return i
+
+            futures = [executor.submit(task, i) for i in range(40)]
+            assert [f.result() for f in futures] == list(range(40))
+            assert order[:2] == [0, 1]
+            assert changes and changes == sorted(changes)
+            grown = executor.concurrency
+            assert 2 < grown == changes[-1] <= 8
+
+            executor.backoff()
+            assert executor.concurrency == grown // 2 == changes[-1]
+            # Backoff happens at most once per window.
+            concurrency = executor.concurrency
+            executor.backoff()
+            assert executor.concurrency == concurrency
+
+        with pytest.raises(RuntimeError):
+            executor.submit(task, 0)
+
+
+def test_copy_file_list_adaptive_concurrency(tmp_path):
+    # Runs with the default `MAX_ADAPTIVE_CONCURRENCY`, unlike tests with stubbed responses.
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def copy_local_file(ctx, size, src_path, dest_path):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.005)
+        with lock:
+            running -= 1
+        ctx.progress(size)
+        ctx.done(PhysicalKey.from_path(dest_path), None)
+
+    file_list = [
+        (PhysicalKey.from_path(tmp_path / f'src{i}'), PhysicalKey.from_path(tmp_path / f'dest{i}'), 1)
+        for i in range(200)
+    ]
+    with (
+        mock.patch.object(data_transfer, 'MAX_CONCURRENCY', 1),
+        mock.patch.object(data_transfer.AdaptiveExecutor, 'WINDOW', 0.01),
+        mock.patch.object(data_transfer, '_copy_local_file', copy_local_file),
+    ):
+        results = data_transfer.copy_file_list(file_list)
+
+    assert [pk for pk, _ in results] == [dest for _, dest, _ in file_list]
+    assert 1 < max_running <= data_transfer.MAX_ADAPTIVE_CONCURRENCY
+
+
+@mock.patch.multiple('quilt3.data_transfer.s3_transfer_config', multipart_threshold=1, multipart_chunksize=1)
+def test_download_file_failed(tmp_path):
+    dest = tmp_path / 'file'
+    parts = []
+
+    def run(fn, *args):
+        future = Future()
+        parts.append((future, fn, args))
+        return future
+
+    def get_object(Range, **kwargs):
+        if Range == 'bytes=1-1':
+            raise ClientError({'Error': {'Code': 'InternalError'}}, 'GetObject')
+        return {'Body': io.BytesIO(b'0')}
+
+    s3_client_provider = mock.Mock()
+    s3_client_provider.find_correct_client.return_value.get_object.side_effect = get_object
+    ctx = data_transfer.WorkerContext(
+        s3_client_provider=s3_client_provider,
+        progress=lambda num_bytes: None,
+        done=mock.Mock(),
+        run=run,
+    )
+    files = []
+    path_open = pathlib.Path.open
+
+    def open_file(path, *args, **kwargs):
+        f = path_open(path, *args, **kwargs)
+        files.append(f)
+        return f
+
+    with mock.patch.object(pathlib.Path, 'open', open_file):
+        data_transfer._download_file(ctx, 3, 'bucket', 'key', None, str(dest))
+    assert len(parts) == 3
+    assert dest.stat().st_size == 3
+
+    (_, fn, args), (_, fn2, args2), (future3, _, _) = parts
+    fn(*args)
+    with pytest.raises(ClientError):
+        fn2(*args2)
+    assert not files[0].closed
+    # The file is closed once the last part is cancelled, and truncated, so it doesn't look complete.
+    future3.cancel()
+    assert files[0].closed
+    assert dest.stat().st_size == 0
+    ctx.done.assert_not_called()
+
+
+def test_adaptive_executor_throttling():
+    executor = data_transfer.AdaptiveExecutor(8, 8)
+
+    def task():
+        raise ClientError({'Error': {'Code': 'SlowDown'}}, 'CopyObject')
+
+    with executor:
+        with pytest.raises(ClientError):
+            executor.submit(task).result()
+    assert executor.concurrency == 4
+
+
+def test_adaptive_executor_lanes():
+    started = []
+    gate = threading.Event()
+    release = threading.Event()
+
+    def task(name):
+        started.append(name)
+        release.wait()
+
+    with data_transfer.AdaptiveExecutor(4, 4, lanes=3) as executor:
+        try:
+            # Keep all threads busy until every task is queued.
+            gates = [executor.submit(gate.wait, lane=2) for _ in range(4)]
+            futures = [executor.submit(task, f'small{i}') for i in range(10)]
+            futures += [executor.submit(task, f'part{i}', lane=1) for i in range(10)]
+            gate.set()
+            while len(started) < 4:
+                time.sleep(0.01)
+            # Parts submitted after all small files still get their share of threads.
+            assert sorted(started) == ['part0', 'part1', 'small0', 'small1']
+        finally:
+            gate.set()
+            release.set()
+        for f in gates + futures:
+            f.result()
+
+    # With one thread, tasks start in the order they were submitted.
+    started.clear()
+    with data_transfer.AdaptiveExecutor(1, 1, lanes=2) as executor:
+        futures = [executor.submit(task, i, lane=i % 2) for i in range(6)]
+        for f in futures:
+            f.result()
+    assert started == list(range(6))
@@ -0,0 +1,307 @@
+"""Tests for quilt3.manifest module."""
+
+import io
+import json
+import os
+
+import pytest
+
+from quilt3 import checksums
+from quilt3.exceptions import PackageException
+from quilt3.manifest import ManifestIndex, ManifestTable, diff_manifests
+from quilt3.util import PhysicalKey, QuiltException
+
+
+def _row(logical_key, **kwargs):
+    row = {
+        "logical_key": logical_key,
+        "physical_keys": [f"s3://bucket/prefix/{logical_key}?versionId=v1"],
+        "size": 1,
+        "hash": {"type": checksums.SHA256_CHUNKED_HASH_NAME, "value": "MOFJVevxNSJm3C/4Bn5oEEYH51CrudOzZYK4r5Cfy1g="},
+        "meta": {},
+    }
+    row.update(kwargs)
+    return row
+
+
+def test_rows_sorted_in_walk_order():
+    table = ManifestTable.from_records({"version": "v0"}, [_row("a.b"), _row("b"), _row("a/b"), _row("a-c/d")])
+
+    assert [table.logical_key(i) for i in range(len(table))] == ["a/b", "a-c/d", "a.b", "b"]
+
+
+@pytest.mark.parametrize(
+    "hash_obj",
+    [
+        None,
+        {"type": checksums.SHA256_HASH_NAME, "value": "0123456789abcdef" * 4},
+        # Uppercase hex can't be restored from raw bytes.
+        {"type": checksums.SHA256_HASH_NAME, "value": "0123456789ABCDEF" * 4},
+        {"type": checksums.SHA256_CHUNKED_HASH_NAME, "value": "MOFJVevxNSJm3C/4Bn5oEEYH51CrudOzZYK4r5Cfy1g="},
+        {"type": checksums.CRC64NVME_HASH_NAME, "value": "1Km+QyatA00="},
+        {"type": "unknown", "value": "whatever"},
+        {"type": checksums.SHA256_HASH_NAME, "value": "abc", "extra": 1},
+    ],
+)
+def test_record_roundtrip(hash_obj):
+    row = _row("dir/file", hash=hash_obj, size=None, meta={"user_meta": {"ü": [1, 2.5, None]}})
+    table = ManifestTable.from_records({"version": "v0"}, [row])
+
+    assert table.record(0) == row
+
+
+def test_directory_meta_rows():
+    table = ManifestTable.from_records(
+        {"version": "v0"},
+        [
+            {"logical_key": "a/", "meta": {"old": True}},
+            {"logical_key": "a/", "meta": {"new": True}},
+            {"logical_key": "top", "meta": {"root": True}},
+            _row("a/b"),
+        ],
+    )
+
+    assert len(table) == 2
+    assert table.record(0) == {"logical_key": "a/", "meta": {"new": True}}
+    assert table.meta == {"version": "v0", "user_meta": {"root": True}}
+    assert table.find("a") == (0, 2)
+    assert table.find("a/b") == 1
+    assert table.find("a/c") is None
+    assert list(table.iter_level(0, 2, "")) == [("a", 0, 2)]
+    assert list(table.iter_level(0, 2, "a/")) == [("b", 1, None)]
+
+
+def test_duplicate_logical_key():
+    with pytest.raises(PackageException, match="Duplicate logical key 'a/b'"):
+        ManifestTable.from_records({"version": "v0"}, [_row("a/b"), _row("c"), _row("a/b")])
+
+
+def test_entry_and_directory_conflict():
+    with pytest.raises(PackageException, match="is both an entry and a directory"):
+        ManifestTable.from_records({"version": "v0"}, [_row("a"), _row("a/b")])
+
+
+def _write_manifest(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in [{"version": "v0", "user_meta": {"foo": "bar"}}, *rows]:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_index(tmp_path):
+    manifest_path = tmp_path / "manifest"
+    index_path = tmp_path / "manifest.index"
+    rows = [{"logical_key": "a/", "meta": {"dir": True}}, _row("a/ü"), _row('a/"quoted"'), _row("a.b"), _row("a-b")]
+    _write_manifest(manifest_path, rows)
+
+    for _ in range(2):
+        index = ManifestIndex.open(manifest_path, index_path)
+        assert index.meta == {"version": "v0", "user_meta": {"foo": "bar"}}
+        assert [index.logical_key(i) for i in range(len(index))] == ["a/", 'a/"quoted"', "a/ü", "a-b", "a.b"]
+        assert [index.record(i) for i in range(len(index))] == [rows[0], rows[2], rows[1], rows[4], rows[3]]
+        assert index_path.exists()
+
+    # Stale index is rebuilt.
+    _write_manifest(manifest_path, [_row("x")])
+    os.utime(manifest_path, ns=(0, 0))
+    index = ManifestIndex.open(manifest_path, index_path)
+    assert [index.record(i) for i in range(len(index))] == [_row("x")]
+    assert ManifestIndex.open(manifest_path, index_path).find("x") == 0
+
+
+def test_index_in_memory(tmp_path):
+    manifest_path = tmp_path / "manifest"
+    _write_manifest(manifest_path, [_row("b"), _row("a")])
+
+    index = ManifestIndex.open(manifest_path)
+
+    assert isinstance(index._data, bytes)
+    assert index.find("a") == 0
+    assert index.record(1) == _row("b")
+    assert list(tmp_path.iterdir()) == [manifest_path]
+
+
+def test_physical_key():
+    urls = [
+        "s3://bucket/a/b%20c?versionId=v1",
+        "s3://bucket/a/%2F?versionId=a+b",
+        "s3://bucket/a/b?versionId=",
+        "s3://bucket/a/%23",
+        "s3://bucket/top",
+        "file:///tmp/file",
+    ]
+    table = ManifestTable.from_records(
+        {"version": "v0"}, [_row(f"k{i}", physical_keys=[u]) for i, u in enumerate(urls)]
+    )
+
+    for i in range(len(table)):
+        assert table.physical_key(i) == PhysicalKey.from_url(table.url(i))
+
+
+@pytest.fixture
+def arrow_table():
+    pytest.importorskip("pyarrow")
+    return ManifestTable.from_records(
+        {"version": "v0", "message": "msg"},
+        [
+            {"logical_key": "a/", "meta": {"dir": True}},
+            _row("a/ü", size=None, meta={"user_meta": {"x": 1}}),
+            _row("a/b", hash={"type": checksums.SHA256_HASH_NAME, "value": "00" * 32}),
+            _row("c", hash=None),
+        ],
+    )
+
+
+def test_arrow_roundtrip(tmp_path, arrow_table):
+    path = tmp_path / "cache" / "manifest.arrow"
+    arrow_table.write_arrow(path, {"size": 1})
+
+    table = ManifestTable.read_arrow(path, {"size": 1})
+
+    assert table.meta == arrow_table.meta
+    assert [table.record(i) for i in range(len(table))] == [arrow_table.record(i) for i in range(len(arrow_table))]
+    assert table.find("a") == (0, 3)
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_arrow_stale(tmp_path, arrow_table):
+    path = tmp_path / "manifest.arrow"
+    arrow_table.write_arrow(path, {"size": 1})
+
+    with pytest.raises(ValueError, match="Stale"):
+        ManifestTable.read_arrow(path, {"size": 2})
+
+
+def test_arrow_corrupted(tmp_path, arrow_table):
+    path = tmp_path / "manifest.arrow"
+    arrow_table.write_arrow(path, {"size": 1})
+    data = path.read_bytes()
+    offset = data.index("a/ü".encode())
+    path.write_bytes(data[:offset] + b"x" + data[offset + 1 :])
+
+    with pytest.raises(ValueError, match="checksum"):
+        ManifestTable.read_arrow(path, {"size": 1})
+
+
+def _arrow_entry(row, logical_key=None):
+    hash_obj = row["hash"]
+    if hash_obj is None or hash_obj.keys() != {"type", "value"}:
+        hash_type, hash_value = None, None if hash_obj is None else json.dumps(hash_obj)
+    else:
+        hash_type, hash_value = hash_obj["type"], hash_obj["value"]
+    return {
+        "logical_key": logical_key or row["logical_key"],
+        "physical_key": row["physical_keys"][0],
+        "size": row["size"],
+        "hash_type": hash_type,
+        "hash_value": hash_value,
+        "meta": json.dumps(row["meta"], ensure_ascii=False, separators=(",", ":")) if row["meta"] else None,
+    }
+
+
+def test_entries_to_arrow():
+    pytest.importorskip("pyarrow")
+    rows = [
+        {"logical_key": "a/", "meta": {"dir": True}},
+        # Base64 digests of the same length are encoded at once, others one by one.
+        *(
+            _row(f"a/{i}", hash={"type": checksums.SHA256_CHUNKED_HASH_NAME, "value": v})
+            for i, v in enumerate("AQ== AQI= AQID".split())
+        ),
+        _row("a/c", hash={"type": checksums.CRC64NVME_HASH_NAME, "value": "1Km+QyatA00="}, size=None),
+        _row("a/d", hash={"type": checksums.CRC64NVME_HASH_NAME, "value": "AAAAAAAAAAE="}),
+        _row("b/ü", hash={"type": checksums.SHA256_HASH_NAME, "value": "0123456789abcdef" * 4}, meta={"ü": 1}),
+        _row("b/v", hash={"type": checksums.SHA256_HASH_NAME, "value": "0123456789ABCDEF" * 4}),
+        _row("c", hash={"type": checksums.SHA256_HASH_NAME, "value": "abc", "extra": 1}),
+        _row("d", hash=None),
+    ]
+    table = ManifestTable.from_records({"version": "v0"}, rows)
+
+    assert table.entries_to_arrow(0, len(table)).to_pylist() == [
+        _arrow_entry(row) for row in sorted(rows[1:], key=lambda row: row["logical_key"])
+    ]
+    assert table.entries_to_arrow(0, 6, strip=2, prefix="x/y/").to_pylist() == [
+        _arrow_entry(table.record(i), "x/y/" + table.logical_key(i)[2:]) for i in range(1, 6)
+    ]
+    assert table.entries_to_arrow(1, 1).num_rows == 0
+
+
+def test_entries_from_arrow():
+    pa = pytest.importorskip("pyarrow")
+    rows = [
+        _row("b", hash=None, meta={"user_meta": {"ü": [1, None]}}),
+        _row("a/b", hash={"type": checksums.SHA256_HASH_NAME, "value": "abc", "extra": 1}, size=None),
+        _row("a/c"),
+    ]
+    table = ManifestTable.from_entries_arrow(
+        {"version": "v0"}, pa.Table.from_pylist([_arrow_entry(row) for row in rows])
+    )
+
+    assert [table.record(i) for i in range(len(table))] == [rows[1], rows[2], rows[0]]
+
+    minimal = ManifestTable.from_entries_arrow(
+        {"version": "v0"}, pa.table({"logical_key": ["a"], "physical_key": ["s3://bucket/a"]})
+    )
+    assert minimal.record(0) == {
+        "logical_key": "a",
+        "physical_keys": ["s3://bucket/a"],
+        "size": None,
+        "hash": None,
+        "meta": {},
+    }
+
+    with pytest.raises(PackageException, match="Missing 'physical_key'"):
+        ManifestTable.from_entries_arrow({"version": "v0"}, pa.table({"logical_key": ["a"]}))
+    with pytest.raises(PackageException, match="can't contain nulls"):
+        ManifestTable.from_entries_arrow({"version": "v0"}, pa.table({"logical_key": ["a"], "physical_key": [None]}))
+    with pytest.raises(PackageException, match="Duplicate logical key"):
+        ManifestTable.from_entries_arrow(
+            {"version": "v0"}, pa.table({"logical_key": ["a", "a"], "physical_key": ["s3://b/a", "s3://b/b"]})
+        )
+    with pytest.raises(QuiltException, match="Invalid key"):
+        ManifestTable.from_entries_arrow(
+            {"version": "v0"}, pa.table({"logical_key": ["a/../b"], "physical_key": ["s3://b/a"]})
+        )
+
+
+def _manifest_bytes(rows):
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in [{"version": "v0"}, *rows]).encode()
+
+
+def test_diff_manifests():
+    rows_a = [
+        {"logical_key": "a/", "meta": {"dir": True}},
+        _row("a/b"),
+        _row("a/ü"),
+        _row("a-c/d"),
+        _row("a.b"),
+        _row("deleted"),
+        _row("moved", physical_keys=["s3://bucket/old?versionId=v1"]),
+    ]
+    rows_b = [
+        _row("a/b", meta={"user_meta": {"changed": True}}),
+        _row("a/new"),
+        _row("a/ü", size=2),
+        _row("a-c/d"),
+        _row("a.b", hash=None),
+        _row("moved", physical_keys=["s3://bucket/new?versionId=v2"]),
+        _row("z"),
+    ]
+
+    diff = list(diff_manifests(io.BytesIO(_manifest_bytes(rows_a)), io.BytesIO(_manifest_bytes(rows_b))))
+
+    assert diff == [
+        ("modified", "a/b"),
+        ("added", "a/new"),
+        ("modified", "a/ü"),
+        ("modified", "a.b"),
+        ("deleted", "deleted"),
+        ("added", "z"),
+    ]
+
+
+def test_diff_manifests_unsorted():
+    sorted_manifest = _manifest_bytes([_row("a"), _row("b")])
+    unsorted_manifest = _manifest_bytes([_row("b"), _row("a")])
+
+    with pytest.raises(PackageException, match="Entries of manifest B are not sorted"):
+        list(diff_manifests(io.BytesIO(sorted_manifest), io.BytesIO(unsorted_manifest)))
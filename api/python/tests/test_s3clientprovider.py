@@ -1,9 +1,12 @@
 import os
+import time
 from unittest import mock
 
+import boto3
 import botocore
 import pytest
 
+from quilt3 import data_transfer
 from quilt3.data_transfer import S3ClientProvider
 
 PATCH_UNSET_CREDENTIALS = mock.patch.dict(os.environ, {"AWS_SHARED_CREDENTIALS_FILE": "/not-exist"}, clear=True)
@@ -32,3 +35,126 @@ PATCH_SET_CREDENTIALS = mock.patch.dict(
 def test_client(credentials_context_manager, client, is_unsigned):
     with credentials_context_manager:
         assert (getattr(S3ClientProvider(), client).meta.config.signature_version == botocore.UNSIGNED) is is_unsigned
+
+
+def test_shared_clients():
+    with PATCH_SET_CREDENTIALS:
+        provider = S3ClientProvider()
+        provider.set_cache("GET_OBJECT", "bucket", use_unsigned=True)
+        other_provider = S3ClientProvider()
+        assert other_provider.standard_client is provider.standard_client
+        assert other_provider.should_use_unsigned_client("GET_OBJECT", "bucket") is True
+
+        # Clients aren't shared across credentials.
+        with mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "other"}):
+            other_provider = S3ClientProvider()
+            assert other_provider.standard_client is not provider.standard_client
+            assert other_provider.should_use_unsigned_client("GET_OBJECT", "bucket") is None
+
+        # Nor with sessions from an overridden get_boto_session().
+        with mock.patch.object(S3ClientProvider, "get_boto_session", staticmethod(boto3.Session)):
+            assert S3ClientProvider().standard_client is not provider.standard_client
+            assert S3ClientProvider().standard_client is not S3ClientProvider().standard_client
+
+
+def test_shared_clients_aws_config(tmp_path):
+    credentials = tmp_path / "credentials"
+    config = tmp_path / "config"
+    credentials.write_text("[default]\naws_access_key_id = a\naws_secret_access_key = s\n")
+    with mock.patch.dict(
+        os.environ, {"AWS_SHARED_CREDENTIALS_FILE": str(credentials), "AWS_CONFIG_FILE": str(config)}, clear=True
+    ):
+        client = S3ClientProvider().standard_client
+        # The session isn't resolved again while its files stay the same.
+        with mock.patch("quilt3.session.boto3.Session", wraps=boto3.Session) as session_mock:
+            assert S3ClientProvider().standard_client is client
+        session_mock.assert_not_called()
+
+        credentials.write_text("[default]\naws_access_key_id = other\naws_secret_access_key = s\n")
+        other_client = S3ClientProvider().standard_client
+        assert other_client is not client
+        assert other_client._request_signer._credentials.access_key == "other"
+
+        config.write_text("[default]\nregion = eu-west-2\n")
+        assert S3ClientProvider().standard_client.meta.region_name == "eu-west-2"
+
+
+def test_bucket_cache(tmp_path):
+    with PATCH_SET_CREDENTIALS, mock.patch("quilt3.data_transfer.CACHE_PATH", tmp_path):
+        data_transfer._shared_s3_clients.clear()
+        data_transfer._bucket_regions.clear()
+        provider = S3ClientProvider()
+        provider.set_cache("GET_OBJECT", "bucket", use_unsigned=True)
+
+        # Client types are kept for other processes with the same credentials.
+        data_transfer._shared_s3_clients.clear()
+        assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "bucket") is True
+        assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "other-bucket") is None
+        with mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "other"}):
+            assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "bucket") is None
+        with mock.patch("quilt3.data_transfer.time.time", return_value=time.time() + data_transfer.BUCKET_CACHE_TTL):
+            data_transfer._shared_s3_clients.clear()
+            assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "bucket") is None
+
+        # Requests are sent to the region a bucket was redirected to.
+        s3_client = S3ClientProvider().standard_client
+        urls = []
+
+        def before_call(params, context, **kwargs):
+            urls.append(params["url"])
+            # Pretend the request was redirected to eu-west-2.
+            context["s3_redirect"]["redirected"] = True
+            context["signing"]["region"] = "eu-west-2"
+            return botocore.awsrequest.AWSResponse(params["url"], 200, {}, None), {}
+
+        s3_client.meta.events.register_first("before-call.s3.HeadObject", before_call)
+        s3_client.head_object(Bucket="bucket", Key="key")
+        data_transfer._bucket_regions.clear()
+        s3_client.head_object(Bucket="bucket", Key="key")
+        assert "eu-west-2" not in urls[0]
+        assert urls[1] == "https://bucket.s3.eu-west-2.amazonaws.com/key"
+        assert data_transfer.BucketCache.get("bucket", "region") == "eu-west-2"
+
+
+def test_bucket_cache_client_type_identity(tmp_path):
+    credentials = tmp_path / "credentials"
+    credentials.write_text("[default]\naws_access_key_id = a\naws_secret_access_key = s\n")
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"AWS_SHARED_CREDENTIALS_FILE": str(credentials), "AWS_CONFIG_FILE": str(tmp_path / "config")},
+            clear=True,
+        ),
+        mock.patch("quilt3.data_transfer.CACHE_PATH", tmp_path / "cache"),
+    ):
+        data_transfer._shared_s3_clients.clear()
+        S3ClientProvider().set_cache("GET_OBJECT", "bucket", use_unsigned=True)
+
+        # Client types kept by other processes are only used with the same credentials.
+        data_transfer._shared_s3_clients.clear()
+        assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "bucket") is True
+        credentials.write_text("[default]\naws_access_key_id = other\naws_secret_access_key = s\n")
+        data_transfer._shared_s3_clients.clear()
+        assert S3ClientProvider().should_use_unsigned_client("GET_OBJECT", "bucket") is None
+
+
+def test_bucket_cache_unusable(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_bytes(b"")
+    # The cache can't be created under a regular file, so requests just don't use it.
+    with PATCH_SET_CREDENTIALS, mock.patch("quilt3.data_transfer.CACHE_PATH", not_a_dir / "cache"):
+        data_transfer._shared_s3_clients.clear()
+        data_transfer._bucket_regions.clear()
+        provider = S3ClientProvider()
+        provider.set_cache("GET_OBJECT", "bucket", use_unsigned=True)
+        assert provider.should_use_unsigned_client("GET_OBJECT", "bucket") is True
+
+        def before_call(params, context, **kwargs):
+            context["s3_redirect"]["redirected"] = True
+            context["signing"]["region"] = "eu-west-2"
+            return botocore.awsrequest.AWSResponse(params["url"], 200, {}, None), {}
+
+        s3_client = provider.standard_client
+        s3_client.meta.events.register_first("before-call.s3.HeadObject", before_call)
+        s3_client.head_object(Bucket="bucket", Key="key")
+        assert data_transfer.BucketCache.get("bucket", "region") is None
@@ -136,3 +136,45 @@ def test_quilt_exception_subclass_renders_message_not_own_args():
     # positional and `str(err)` would be '42'.
     assert str(err) == 'bad value: 42'
     assert err.args == ('bad value: 42',)
+
+
+def test_quiltignore(tmp_path):
+    root = tmp_path / 'root'
+    for path in ('a.txt', 'b.log', 'node_modules/x/y.js', 'src/node_modules', 'src/c.txt', 'src/d/e.log', 'build/f'):
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(path)
+    ignore = tmp_path / '.quiltignore'
+    ignore.write_text('*.log\nnode_modules/\nbuild\n\n[s]rc/d\n', 'utf-8')
+    paths = list(root.rglob('*'))
+
+    # Each rule matched on its own, as `quiltignore_filter()` used to do.
+    from fnmatch import fnmatch
+
+    rules = ['*/*.log', '*/node_modules/', '*/build', '*/[s]rc/d']
+    ignored_dirs = {
+        p
+        for p in paths
+        if p.is_dir() and any(fnmatch(p.as_posix() + '/', r) or fnmatch(p.as_posix(), r) for r in rules)
+    }
+    expected = {
+        p
+        for p in paths
+        if p not in ignored_dirs
+        and not (p.is_file() and (any(fnmatch(p, r) for r in rules) or not ignored_dirs.isdisjoint(p.parents)))
+    }
+
+    assert util.quiltignore_filter(paths, ignore, 'file') == expected
+    assert {p.relative_to(root).as_posix() for p in expected if p.is_file()} == {
+        'a.txt',
+        'src/node_modules',
+        'src/c.txt',
+    }
+
+    matches = util.quiltignore_matcher(ignore)
+    assert matches(str(root / 'node_modules'), True)
+    assert not matches(str(root / 'src' / 'node_modules'), False)
+    assert matches(str(root / 'build'), False)
+    assert matches(str(root / 'src' / 'd'), True)
+
+    ignore.write_text('\n', 'utf-8')
+    assert not util.quiltignore_matcher(ignore)(str(root / 'a.txt'), False)